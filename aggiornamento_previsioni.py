@@ -0,0 +1,222 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from artefatti import (leggi_artefatto, leggi_artefatto_long, leggi_metadati, percorso_parquet, scrivi_artefatto,
+                       scrivi_metadati)
+from bilanciamento import CLIENTI_PER_GIRO, inserisci_consegne
+from estrazione import CARTELLA_ESTRAZIONE, PERCORSO_ESTRAZIONE, aggiungi_consegne, leggi_estrazione
+from modelli import PERCORSO_MODELLO, carica_modello
+from pianificazione import BILANCIA_CARICHI, piano_da_consegne, ripianifica_giri_piccoli
+from regression_final import CATEGORICAL_FEATURES, NUMERICAL_FEATURES, prepara_dati, riepilogo_clienti
+from strumentazione import incrementa, misura
+from zone import mappa_zona
+
+# Aggiornamento incrementale delle previsioni dopo nuove consegne. Le feature di ritardo
+# (Data_prec, Quantita_prec, Giorni_trascorsi, Consumo_giornaliero) vengono ricalcolate solo sullo
+# storico dei clienti con nuove consegne, letto dalla cache colonnare (estrazione.py); questi clienti
+# sono rivalutati con il modello salvato (modelli.py), senza riaddestramento, e le loro date previste
+# sostituiscono le precedenti negli artefatti a valle e nel piano delle consegne, con la stessa
+# modalità con cui il piano è stato prodotto (metadati del piano scritti da pianificazione.py).
+# I percorsi dei giorni cambiati non vengono ricalcolati: sono segnati come da ricalcolare nei
+# metadati degli artefatti dei percorsi, finché pianificazione.py o pianificazione_multi_veicolo.py
+# non li riscrivono.
+# Il costo è proporzionale alle consegne del giorno; il ricalcolo completo (pipeline.py) resta
+# necessario per riaddestrare il modello e per i clienti non ancora geocodificati o assegnati a una zona.
+
+RISULTATI = "risultati_random_forest.csv"
+ARTEFATTI_CLIENTI = ["clienti_validi_geocodificati.csv", "clienti_con_cluster_riparato.csv"]
+PIANO = "piano_consegne_finale.csv"
+ARTEFATTI_PERCORSI = ["percorso_ottimizzato_nearest_neightbor.csv", "percorso_multi_veicolo.csv"]
+COLONNA_PREVISIONI = 'Giorni_previsti_RF'
+
+
+def _esiste(percorso_csv):
+    return os.path.exists(percorso_parquet(percorso_csv)) or os.path.exists(percorso_csv)
+
+
+def prevedi_clienti(clienti, percorso_estrazione=PERCORSO_ESTRAZIONE, cartella=CARTELLA_ESTRAZIONE,
+                    percorso_modello=PERCORSO_MODELLO):
+    """
+    Riepilogo aggiornato (colonne di risultati_random_forest.csv) dei soli clienti indicati:
+    feature ricalcolate sul loro storico e previsioni del modello salvato.
+    Restituisce None se nessuno dei clienti ha abbastanza consegne per la previsione.
+    """
+    df = prepara_dati(leggi_estrazione(percorso_estrazione, cartella=cartella, clienti=clienti))
+    if df.empty:
+        return None
+    modello, metadati = carica_modello(percorso_modello)
+    feature = (metadati.get('feature_numeriche', NUMERICAL_FEATURES)
+               + metadati.get('feature_categoriche', CATEGORICAL_FEATURES))
+    df[COLONNA_PREVISIONI] = modello.predict(df[feature])
+    incrementa('righe_rivalutate', len(df))
+
+    riepilogo = riepilogo_clienti(df, COLONNA_PREVISIONI)
+    # Liste Python, come nelle colonne lista lette dagli artefatti
+    riepilogo['Date_consegna_previste'] = pd.Series(riepilogo['Date_consegna_previste'].tolist(),
+                                                    index=riepilogo.index, dtype=object)
+    return riepilogo
+
+
+def sostituisci_clienti(df, riepilogo):
+    # Righe dei clienti del riepilogo sostituite (o aggiunte), in ordine di codice cliente
+    righe = pd.concat([df[~df['Codice Cliente'].isin(riepilogo['Codice Cliente'])], riepilogo], ignore_index=True)
+    return righe.sort_values('Codice Cliente', kind='stable', ignore_index=True)
+
+
+def aggiorna_colonne_clienti(df, riepilogo):
+    """
+    Colonne della previsione aggiornate per i clienti del riepilogo già presenti in df
+    (coordinate e zone restano invariate). Restituisce (df, numero di clienti aggiornati).
+    """
+    nuovi = riepilogo.set_index('Codice Cliente')
+    presenti = df['Codice Cliente'].isin(nuovi.index)
+    righe = nuovi.loc[df.loc[presenti, 'Codice Cliente']]
+    for colonna in nuovi.columns.intersection(df.columns):
+        valori = righe[colonna]
+        # Colonne di testo nell'artefatto (es. date lette dal CSV): stesso tipo dei valori esistenti
+        if pd.api.types.is_string_dtype(df[colonna]) and not pd.api.types.is_object_dtype(df[colonna]):
+            valori = valori.astype(df[colonna].dtype)
+        df.loc[presenti, colonna] = pd.Series(valori.to_numpy(), index=df.index[presenti])
+    return df, int(presenti.sum())
+
+
+def aggiorna_piano(piano, riepilogo, df_cluster, clienti_per_giro=CLIENTI_PER_GIRO):
+    """
+    Sostituisce nel piano bilanciato (una riga per giro) le consegne dei clienti del riepilogo con
+    le nuove date previste, inserite nei giri esistenti del loro cluster entro le finestre sicure
+    (bilanciamento.inserisci_consegne). I clienti senza zona restano fuori dal piano.
+    """
+    aggiornati = set(riepilogo['Codice Cliente'])
+    giri = piano[['Data Consegna', 'Cluster']].copy()
+    giri['Clienti'] = [[c for c in clienti if c not in aggiornati] for clienti in piano['Clienti']]
+    giri = giri[giri['Clienti'].map(len) > 0].reset_index(drop=True)
+
+    consegne = riepilogo[['Codice Cliente', 'Date_consegna_previste', 'Consumo_medio_giornaliero',
+                          'Quantita_ultima_consegna']].explode('Date_consegna_previste')
+    consegne = consegne.dropna(subset=['Date_consegna_previste'])
+    consegne['Date_consegna_previste'] = pd.to_datetime(consegne['Date_consegna_previste'])
+    consegne = consegne.merge(df_cluster[['Codice Cliente', 'cluster_finale']], on='Codice Cliente')
+    consegne = consegne.sort_values(['Date_consegna_previste', 'Codice Cliente'], ignore_index=True)
+
+    piano_aggiornato = inserisci_consegne(giri, consegne, clienti_per_giro)
+    piano_aggiornato['Numero Clienti'] = piano_aggiornato['Clienti'].apply(len)
+    piano_aggiornato['Zona Consegna'] = piano_aggiornato['Cluster'].astype(str).apply(mappa_zona)
+    return piano_aggiornato.sort_values(['Data Consegna', 'Cluster'], kind='stable', ignore_index=True)
+
+
+def ricalcola_piano(percorso_cluster, min_clienti_giro=3, tolleranza_giorni=7):
+    # Piano con la regola dei giri minimi ricostruito dalle date aggiornate dei clienti, come in
+    # pianificazione.py: la regola dipende da tutti i giri del cluster, non si applica per inserimento
+    consegne = leggi_artefatto_long(percorso_cluster, 'Date_consegna_previste')
+    piano = piano_da_consegne(ripianifica_giri_piccoli(consegne, min_clienti_giro, tolleranza_giorni))
+    return piano.sort_values(['Data Consegna', 'Cluster'], kind='stable', ignore_index=True)
+
+
+def giorni_cambiati(piano, piano_aggiornato):
+    # Date dei giri aggiunti, tolti o con clienti diversi tra i due piani
+    def giri(p):
+        return {(pd.Timestamp(d).date(), str(c), tuple(sorted(cl))) for d, c, cl in
+                zip(p['Data Consegna'], p['Cluster'], p['Clienti'])}
+    return sorted({giro[0] for giro in giri(piano) ^ giri(piano_aggiornato)})
+
+
+def segna_percorsi_da_ricalcolare(giorni):
+    # I percorsi dei giorni cambiati restano quelli del piano precedente: restano segnati nei metadati
+    # finché la fase che produce l'artefatto non lo riscrive
+    for percorso in ARTEFATTI_PERCORSI:
+        if not _esiste(percorso) or not giorni:
+            continue
+        metadati = leggi_metadati(percorso)
+        da_ricalcolare = sorted(set(metadati.get('giorni_da_ricalcolare', [])) | {str(g) for g in giorni})
+        scrivi_metadati(percorso, {**metadati, 'giorni_da_ricalcolare': da_ricalcolare})
+        print(f"{percorso}: percorsi non aggiornati per {len(da_ricalcolare)} giorni "
+              f"(da ricalcolare con la fase di pianificazione che lo produce)")
+
+
+def aggiorna_previsioni(clienti, percorso_estrazione=PERCORSO_ESTRAZIONE, cartella=CARTELLA_ESTRAZIONE,
+                        percorso_modello=PERCORSO_MODELLO, clienti_per_giro=CLIENTI_PER_GIRO):
+    """
+    Rivaluta i clienti indicati (già aggiornati nella cache dell'estrazione) e ne sostituisce le
+    previsioni in risultati_random_forest.csv, negli artefatti dei clienti e nel piano delle consegne.
+    Restituisce il riepilogo aggiornato dei clienti, None se non ce ne sono da prevedere.
+    """
+    clienti = pd.unique(np.asarray(clienti))
+    with misura('previsione_incrementale'):
+        riepilogo = prevedi_clienti(clienti, percorso_estrazione, cartella, percorso_modello)
+    if riepilogo is None:
+        print(f"Nessuno dei {len(clienti)} clienti ha consegne sufficienti per la previsione")
+        return None
+    incrementa('clienti_rivalutati', len(riepilogo))
+    print(f"Clienti rivalutati: {len(riepilogo)} di {len(clienti)}")
+
+    with misura('aggiornamento_artefatti'):
+        scrivi_artefatto(sostituisci_clienti(leggi_artefatto(RISULTATI), riepilogo), RISULTATI)
+        df_cluster = percorso_cluster = None
+        for percorso in ARTEFATTI_CLIENTI:
+            if not _esiste(percorso):
+                continue
+            df, aggiornati = aggiorna_colonne_clienti(leggi_artefatto(percorso), riepilogo)
+            scrivi_artefatto(df, percorso)
+            print(f"{percorso}: {aggiornati} clienti aggiornati")
+            df_cluster, percorso_cluster = df, percorso
+
+        if df_cluster is not None and 'cluster_finale' in df_cluster and _esiste(PIANO):
+            # Piani senza metadati: prodotti con la modalità predefinita di pianificazione.py
+            parametri = {'bilancia': BILANCIA_CARICHI, 'clienti_per_giro': clienti_per_giro, **leggi_metadati(PIANO)}
+            piano = leggi_artefatto(PIANO)
+            if parametri['bilancia']:
+                piano_aggiornato = aggiorna_piano(piano, riepilogo, df_cluster, parametri['clienti_per_giro'])
+            else:
+                piano_aggiornato = ricalcola_piano(percorso_cluster, parametri.get('min_clienti_giro', 3),
+                                                   parametri.get('tolleranza_giorni', 7))
+            scrivi_artefatto(piano_aggiornato, PIANO, metadati=parametri)
+            senza_zona = ~riepilogo['Codice Cliente'].isin(df_cluster['Codice Cliente'])
+            modalita = 'bilanciamento' if parametri['bilancia'] else 'giri minimi'
+            print(f"Piano delle consegne aggiornato ({modalita}): {len(piano_aggiornato)} giri; clienti senza zona "
+                  f"(da geocodificare con il ricalcolo completo): {int(senza_zona.sum())}")
+            segna_percorsi_da_ricalcolare(giorni_cambiati(piano, piano_aggiornato))
+    return riepilogo
+
+
+def aggiorna_da_consegne(nuove, percorso_estrazione=PERCORSO_ESTRAZIONE, cartella=CARTELLA_ESTRAZIONE,
+                         percorso_modello=PERCORSO_MODELLO, clienti_per_giro=CLIENTI_PER_GIRO):
+    # Aggiunge le nuove consegne alla cache dell'estrazione e aggiorna le previsioni dei loro clienti
+    aggiungi_consegne(nuove, cartella)
+    return aggiorna_previsioni(nuove['Codice Cliente'].unique(), percorso_estrazione, cartella,
+                               percorso_modello, clienti_per_giro)
+
+
+def clienti_dal(data, percorso_estrazione=PERCORSO_ESTRAZIONE, cartella=CARTELLA_ESTRAZIONE):
+    # Codici dei clienti con consegne dalla data indicata (lettura delle sole colonne chiave)
+    df = leggi_estrazione(percorso_estrazione, colonne=[], cartella=cartella)
+    return df.loc[df['Data'] >= pd.Timestamp(data), 'Codice Cliente'].unique()
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from estrazione import leggi_blocchi_sorgente
+
+    parser = argparse.ArgumentParser(description="Aggiornamento incrementale delle previsioni per le nuove consegne")
+    gruppo = parser.add_mutually_exclusive_group(required=True)
+    gruppo.add_argument("--aggiungi", metavar="FILE", help="aggiunge le consegne di un file CSV o Parquet e "
+                                                           "aggiorna i loro clienti")
+    gruppo.add_argument("--dal", metavar="DATA", help="aggiorna i clienti con consegne in cache dalla data indicata")
+    gruppo.add_argument("--clienti", nargs='+', type=int, metavar="CODICE", help="aggiorna i clienti indicati")
+    parser.add_argument("--estrazione", default=PERCORSO_ESTRAZIONE)
+    parser.add_argument("--cartella", default=CARTELLA_ESTRAZIONE)
+    parser.add_argument("--modello", default=PERCORSO_MODELLO)
+    parser.add_argument("--clienti-per-giro", type=int, default=CLIENTI_PER_GIRO)
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    if args.aggiungi:
+        nuove = pd.concat(leggi_blocchi_sorgente(args.aggiungi), ignore_index=True)
+        aggiorna_da_consegne(nuove, args.estrazione, args.cartella, args.modello, args.clienti_per_giro)
+    else:
+        clienti = args.clienti if args.clienti else clienti_dal(args.dal, args.estrazione, args.cartella)
+        aggiorna_previsioni(clienti, args.estrazione, args.cartella, args.modello, args.clienti_per_giro)
+    print(f"Aggiornamento completato in {time.perf_counter() - t0:.2f} s")
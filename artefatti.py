@@ -0,0 +1,198 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# Lettura/scrittura degli artefatti intermedi della pipeline.
+# Ogni artefatto viene salvato sia come CSV (leggibile, date delle liste in ISO) sia come Parquet,
+# dove le colonne lista sono tipi nativi (list<date32>, list<int64>, list<double>, list<string>).
+# In lettura si preferisce il Parquet, se non è più vecchio del CSV; i CSV storici restano supportati senza eval().
+
+# Colonne lista note e tipo degli elementi
+COLONNE_LISTA_DATE = ['Date_consegna_previste']
+COLONNE_LISTA_CODICI = ['Clienti', 'Percorso Ottimo', 'Percorso Ottimo (NN)']
+COLONNE_LISTA_NUMERI = ['Km risparmiati per giro']
+COLONNE_LISTA_TESTO = ['Cluster Percorso']
+
+# Date in CSV: ISO "[2025-08-20, 2025-09-10]", oppure "[datetime.date(2025, 8, 20), ...]" nei CSV storici
+PATTERN_DATA = r"date\((\d+),\s*(\d+),\s*(\d+)\)|(\d{4})-(\d{2})-(\d{2})"
+PATTERN_CODICE = r"(-?\d+)"
+PATTERN_NUMERO = r"(-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)"
+PATTERN_TESTO = r"'([^']*)'"
+
+
+def percorso_parquet(percorso_csv):
+    return os.path.splitext(percorso_csv)[0] + ".parquet"
+
+
+def percorso_metadati(percorso_csv):
+    return os.path.splitext(percorso_csv)[0] + ".json"
+
+
+def leggi_metadati(percorso_csv):
+    # Metadati dell'artefatto (parametri con cui è stato prodotto, stato), {} se assenti
+    percorso = percorso_metadati(percorso_csv)
+    if not os.path.exists(percorso):
+        return {}
+    with open(percorso) as f:
+        return json.load(f)
+
+
+def scrivi_metadati(percorso_csv, metadati):
+    with open(percorso_metadati(percorso_csv), "w") as f:
+        json.dump(metadati, f, indent=2, default=str)
+
+
+def parquet_aggiornato(percorso_csv):
+    # Il Parquet si usa solo se esiste ed è aggiornato rispetto al CSV (il CSV può essere sostituito o modificato)
+    parquet = percorso_parquet(percorso_csv)
+    if not os.path.exists(parquet):
+        return False
+    return not os.path.exists(percorso_csv) or os.path.getmtime(parquet) >= os.path.getmtime(percorso_csv)
+
+
+def _estrai_liste(serie, pattern):
+    # Estrazione vettoriale degli elementi da una colonna testuale "[..., ...]":
+    # restituisce una tabella lunga (indice riga originale, posizione, valore/i)
+    return serie.astype("string").str.extractall(pattern)
+
+
+def _date_long(serie):
+    estratti = _estrai_liste(serie, PATTERN_DATA)
+    estratti = estratti[[0, 1, 2]].fillna(estratti[[3, 4, 5]].set_axis([0, 1, 2], axis=1)).astype(int)
+    date = pd.to_datetime(pd.DataFrame({'year': estratti[0], 'month': estratti[1], 'day': estratti[2]}))
+    return date
+
+
+def _codici_long(serie):
+    return _estrai_liste(serie, PATTERN_CODICE)[0].astype('int64')
+
+
+def _numeri_long(serie):
+    return _estrai_liste(serie, PATTERN_NUMERO)[0].astype('float64')
+
+
+def _testi_long(serie):
+    return _estrai_liste(serie, PATTERN_TESTO)[0]
+
+
+def _ricomponi_liste(valori_long, indice):
+    # Da tabella lunga (MultiIndex riga, match) a una lista per riga; le righe vuote diventano []
+    liste = valori_long.groupby(level=0).agg(list)
+    return pd.Series([liste.get(i, []) for i in indice], index=indice, dtype=object)
+
+
+def _decodifica_csv_storico(df):
+    for col in df.columns:
+        if df[col].dtype != object and not pd.api.types.is_string_dtype(df[col]):
+            continue
+        if col in COLONNE_LISTA_DATE:
+            df[col] = _ricomponi_liste(_date_long(df[col]).dt.date, df.index)
+        elif col in COLONNE_LISTA_CODICI:
+            df[col] = _ricomponi_liste(_codici_long(df[col]), df.index)
+        elif col in COLONNE_LISTA_NUMERI:
+            df[col] = _ricomponi_liste(_numeri_long(df[col]), df.index)
+        elif col in COLONNE_LISTA_TESTO:
+            df[col] = _ricomponi_liste(_testi_long(df[col]), df.index)
+    return df
+
+
+def leggi_artefatto(percorso_csv, colonne=None):
+    """
+    Legge un artefatto della pipeline: dal Parquet (memory-mapped) se presente e non più vecchio
+    del CSV, altrimenti dal CSV storico, decodificando le colonne lista senza eval().
+    """
+    parquet = percorso_parquet(percorso_csv)
+    if parquet_aggiornato(percorso_csv):
+        return pq.read_table(parquet, columns=colonne, memory_map=True).to_pandas()
+    df = pd.read_csv(percorso_csv, usecols=colonne)
+    return _decodifica_csv_storico(df)
+
+
+def leggi_artefatto_long(percorso_csv, colonna, colonne=None):
+    """
+    Legge un artefatto in forma lunga: una riga per ogni elemento della colonna lista `colonna`
+    (equivalente a .explode(), ma vettoriale). Le date diventano datetime64.
+    """
+    parquet = percorso_parquet(percorso_csv)
+    if parquet_aggiornato(percorso_csv):
+        tabella = pq.read_table(parquet, columns=colonne, memory_map=True)
+        liste = tabella[colonna].combine_chunks()
+        valori = pc.list_flatten(liste)
+        righe = pc.list_parent_indices(liste)
+        df = tabella.drop_columns([colonna]).take(righe).to_pandas()
+        if pa.types.is_date(valori.type):
+            df[colonna] = valori.to_pandas(date_as_object=False).values
+        else:
+            df[colonna] = valori.to_pandas().values
+        return df
+
+    df = pd.read_csv(percorso_csv, usecols=colonne)
+    if colonna in COLONNE_LISTA_DATE:
+        valori = _date_long(df[colonna])
+    elif colonna in COLONNE_LISTA_CODICI:
+        valori = _codici_long(df[colonna])
+    elif colonna in COLONNE_LISTA_NUMERI:
+        valori = _numeri_long(df[colonna])
+    else:
+        valori = _testi_long(df[colonna])
+    righe = valori.index.get_level_values(0)
+    long = _decodifica_csv_storico(df.drop(columns=[colonna]).loc[righe].reset_index(drop=True))
+    long[colonna] = valori.values
+    return long
+
+
+def lista_da_long(valori, conteggi, indice=None):
+    """
+    Colonna lista (Arrow) da valori in forma lunga ordinati per riga e numero di elementi per riga,
+    senza creare liste Python; le date datetime64[D] diventano list<date32>.
+    """
+    offset = np.concatenate([[0], np.cumsum(conteggi)]).astype(np.int32)
+    liste = pa.ListArray.from_arrays(pa.array(offset, type=pa.int32()), pa.array(valori))
+    return pd.Series(liste, dtype=pd.ArrowDtype(liste.type), index=indice)
+
+
+def _liste_date(serie):
+    # Colonna lista di date come array Arrow list<date32> (già nativa se creata con lista_da_long)
+    if isinstance(serie.dtype, pd.ArrowDtype):
+        return pa.array(serie.array)
+    return pa.array(serie.array, type=pa.list_(pa.date32()), from_pandas=True)
+
+
+def _date_csv(liste):
+    # Testo CSV "[2025-08-20, 2025-09-10]" calcolato in Arrow, senza liste Python per riga
+    testo = pc.binary_join(pc.cast(liste, pa.list_(pa.string())), ", ")
+    return pc.binary_join_element_wise("[", testo, "]", "").to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def _come_lista(valore):
+    # Le celle lista lette dal Parquet sono array NumPy: in CSV vanno scritte come liste Python
+    if isinstance(valore, (list, tuple)):
+        return list(valore)
+    if hasattr(valore, 'tolist') and not isinstance(valore, str):
+        return valore.tolist()
+    return valore
+
+
+def scrivi_artefatto(df, percorso_csv, metadati=None, **opzioni_csv):
+    # Salva l'artefatto in CSV (date delle liste in ISO) e in Parquet con colonne lista native.
+    # I metadati descrivono questa versione dell'artefatto: senza, quelli della precedente sono rimossi
+    df = df.copy()
+    for col in COLONNE_LISTA_CODICI + COLONNE_LISTA_NUMERI + COLONNE_LISTA_TESTO:
+        if col in df.columns:
+            df[col] = df[col].map(_come_lista)
+    liste = {col: _liste_date(df[col]) for col in COLONNE_LISTA_DATE if col in df.columns}
+    testo = {col: _date_csv(valori).set_axis(df.index) for col, valori in liste.items()}
+    df.assign(**testo).to_csv(percorso_csv, index=False, **opzioni_csv)
+    tabella = pa.Table.from_pandas(df.drop(columns=list(liste)), preserve_index=False)
+    for col in liste:
+        tabella = tabella.add_column(df.columns.get_loc(col), col, liste[col])
+    pq.write_table(tabella, percorso_parquet(percorso_csv))
+    if metadati is not None:
+        scrivi_metadati(percorso_csv, metadati)
+    elif os.path.exists(percorso_metadati(percorso_csv)):
+        os.remove(percorso_metadati(percorso_csv))
@@ -0,0 +1,364 @@
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from sklearn.cluster import DBSCAN, HDBSCAN
+from sklearn.neighbors import BallTree
+from sklearn.preprocessing import StandardScaler
+
+from distanze import RAGGIO_TERRA_KM
+from selezione_parametri import stima_eps
+
+# Backend intercambiabili per il clustering dei clienti.
+# Ogni backend lavora su coordinate (lat, lon) in gradi e, dopo fit(), espone:
+# - labels_ e core_sample_indices_ come DBSCAN di scikit-learn (-1 = outlier);
+# - metrica e spazio(coordinate): lo spazio in cui sono definite le distanze,
+#   usabile con IndiceSpaziale ('euclidean' su coordinate standardizzate, 'haversine' in km);
+# - eps: raggio di vicinato nello stesso spazio (km per i backend haversine).
+# Le etichette sono interi 0..n-1 come quelle di DBSCAN, quindi lo schema cluster_finale
+# ("0_1", "2", "outlier") resta invariato qualunque sia il backend.
+
+
+class DBSCANStandardizzato:
+    """
+    DBSCAN originale su latitudine e longitudine standardizzate (eps adimensionale).
+    Con eps=None il valore è scelto dal gomito della curva k-distance.
+    """
+    metrica = 'euclidean'
+
+    def __init__(self, eps=None, min_samples=4, quota_outlier_max=0.03, distanza_riparazione=0.35):
+        self.eps = eps
+        self.min_samples = min_samples
+        self.quota_outlier_max = quota_outlier_max
+        self.distanza_riparazione = distanza_riparazione
+        self.curva = None
+
+    def spazio(self, coordinate):
+        return self.scaler.transform(np.asarray(coordinate, dtype=float))
+
+    def fit(self, coordinate):
+        self.scaler = StandardScaler().fit(np.asarray(coordinate, dtype=float))
+        X = self.spazio(coordinate)
+        if self.eps is None:
+            self.eps, self.curva = stima_eps(X, self.min_samples, self.quota_outlier_max)
+        db = DBSCAN(eps=self.eps, min_samples=self.min_samples).fit(X)
+        self.labels_ = db.labels_
+        self.core_sample_indices_ = db.core_sample_indices_
+        return self
+
+
+# Punti per blocco nelle query sul BallTree e coppie di punti confrontate insieme tra celle vicine
+PUNTI_BLOCCO = 20000
+COPPIE_BLOCCO = 200_000
+# Oltre questo numero di coppie due celle vicine si confrontano con una query k=1 sul BallTree
+COPPIE_DIRETTE = 1024
+
+
+def _distanza_rad(a, b):
+    # Distanza haversine (radianti) tra righe corrispondenti di a e b, (lat, lon) in radianti, come nel BallTree
+    h = np.sin((b[:, 0] - a[:, 0]) / 2) ** 2 + np.cos(a[:, 0]) * np.cos(b[:, 0]) * np.sin((b[:, 1] - a[:, 1]) / 2) ** 2
+    return 2 * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def _griglia(X, raggio):
+    """
+    Celle di lato raggio/2 in latitudine e almeno altrettanto strette in longitudine (alla latitudine
+    più vicina all'equatore): due punti della stessa cella distano al più raggio.
+    Restituisce (chiave della cella di ogni punto, larghezza di una riga di celle, spostamenti
+    (righe, colonne) delle celle che possono contenere punti entro raggio, dai più vicini).
+    """
+    lato = raggio / 2 * (1 - 1e-9)
+    lat_min, lat_max = np.abs(X[:, 0]).min(), min(np.abs(X[:, 0]).max(), np.radians(89.0))
+    passo_lon = lato / np.cos(lat_min)
+    # Differenza massima di longitudine tra due punti entro raggio, con |lat| <= lat_max
+    lon_max = 2 * np.arcsin(min(1.0, np.sin(raggio / 2) / np.cos(lat_max)))
+    max_righe, max_colonne = 3, int(np.ceil(lon_max / passo_lon)) + 1
+    riga = np.floor(X[:, 0] / lato).astype(np.int64)
+    colonna = np.floor(X[:, 1] / passo_lon).astype(np.int64)
+    larghezza = colonna.max() - colonna.min() + 2 * max_colonne + 1
+    chiave = (riga - riga.min()) * larghezza + (colonna - colonna.min() + max_colonne)
+    spostamenti = sorted(((r, c) for r in range(max_righe + 1) for c in range(-max_colonne, max_colonne + 1)
+                          if r > 0 or c > 0), key=lambda rc: rc[0] ** 2 + rc[1] ** 2)
+    return chiave, larghezza, spostamenti
+
+
+def _celle_vicine_dirette(punti, inizio, conteggio, a, b, raggio):
+    # Per ogni coppia di celle (a, b): True se almeno due loro punti distano al più raggio (confronto diretto,
+    # a blocchi di al più COPPIE_BLOCCO coppie di punti)
+    esito = np.zeros(len(a), dtype=bool)
+    totali = conteggio[a] * conteggio[b]
+    cumulati = np.cumsum(totali)
+    s = 0
+    while s < len(a):
+        e = max(s + 1, int(np.searchsorted(cumulati, cumulati[s] - totali[s] + COPPIE_BLOCCO, side='right')))
+        t = totali[s:e]
+        coppia = np.repeat(np.arange(s, e), t)
+        locale = np.arange(t.sum()) - np.repeat(np.cumsum(t) - t, t)
+        per_riga = conteggio[b[coppia]]
+        i = inizio[a[coppia]] + locale // per_riga
+        j = inizio[b[coppia]] + locale % per_riga
+        entro = _distanza_rad(punti[i], punti[j]) <= raggio
+        esito[s:e] = np.bincount(coppia[entro] - s, minlength=e - s) > 0
+        s = e
+    return esito
+
+
+def dbscan_haversine(coordinate, eps_km, min_samples=4, blocco=PUNTI_BLOCCO, leaf_size=40):
+    """
+    DBSCAN sulla distanza haversine con memoria limitata (lineare nei punti, senza i vicinati),
+    con gli stessi punti core e cluster di DBSCAN di scikit-learn. I punti sono divisi in celle
+    di lato eps/2, i cui punti distano tra loro al più eps:
+    - i punti delle celle con almeno min_samples punti sono core; per gli altri i vicini sono
+      contati con query a blocchi di al più `blocco` punti sul BallTree;
+    - i punti core di una cella sono nello stesso cluster; due celle vicine si uniscono se hanno
+      due punti core entro eps (confronto diretto, o query k=1 sul BallTree per le celle più dense);
+    - ogni punto di bordo prende il cluster del punto core più vicino entro eps.
+    Le etichette sono numerate nell'ordine del primo punto core di ogni cluster, come in DBSCAN.
+    Restituisce (labels, indici dei punti core).
+    """
+    X = np.radians(np.asarray(coordinate, dtype=float))
+    n = len(X)
+    raggio = eps_km / RAGGIO_TERRA_KM
+    labels = np.full(n, -1, dtype=int)
+    if n == 0:
+        return labels, np.zeros(0, dtype=int)
+
+    chiave, larghezza, spostamenti = _griglia(X, raggio)
+    _, cella, dimensione = np.unique(chiave, return_inverse=True, return_counts=True)
+    is_core = dimensione[cella] >= min_samples
+    da_contare = np.flatnonzero(~is_core)
+    if len(da_contare):
+        albero = BallTree(X, metric='haversine', leaf_size=leaf_size)
+        conteggi = np.concatenate([albero.query_radius(X[da_contare[i:i + blocco]], r=raggio, count_only=True)
+                                   for i in range(0, len(da_contare), blocco)])
+        is_core[da_contare[conteggi >= min_samples]] = True
+        del albero
+    core = np.flatnonzero(is_core)
+    if len(core) == 0:
+        return labels, core
+
+    # Punti core raggruppati per cella (celle in ordine di chiave)
+    celle, cella_core, conteggio = np.unique(chiave[core], return_inverse=True, return_counts=True)
+    m = len(celle)
+    ordine = np.argsort(cella_core, kind='stable')
+    punti = X[core[ordine]]
+    inizio = np.concatenate([[0], np.cumsum(conteggio)[:-1]])
+
+    # Coppie di celle vicine (a, b), dalle più vicine
+    a, b = [], []
+    for dr, dc in spostamenti:
+        vicina = celle + dr * larghezza + dc
+        pos = np.minimum(np.searchsorted(celle, vicina), m - 1)
+        trovata = np.flatnonzero(celle[pos] == vicina)
+        a.append(trovata)
+        b.append(pos[trovata])
+    a, b = np.concatenate(a), np.concatenate(b)
+
+    # Unione delle celle: prima il confronto diretto tra celle poco popolate, poi le celle dense
+    # (query k=1 sul BallTree della cella più grande), solo se non sono già nello stesso cluster
+    dirette = conteggio[a] * conteggio[b] <= COPPIE_DIRETTE
+    unite = _celle_vicine_dirette(punti, inizio, conteggio, a[dirette], b[dirette], raggio)
+    grafo = coo_matrix((np.ones(unite.sum(), dtype=np.int8), (a[dirette][unite], b[dirette][unite])), shape=(m, m))
+    _, componenti = connected_components(grafo, directed=False)
+
+    padre = np.arange(componenti.max() + 1)
+
+    def radice(x):
+        while padre[x] != x:
+            padre[x] = padre[padre[x]]
+            x = padre[x]
+        return x
+
+    alberi = {}
+    for x, y in zip(a[~dirette], b[~dirette]):
+        rx, ry = radice(componenti[x]), radice(componenti[y])
+        if rx == ry:
+            continue
+        if conteggio[x] > conteggio[y]:
+            x, y = y, x
+        if y not in alberi:
+            alberi[y] = BallTree(punti[inizio[y]:inizio[y] + conteggio[y]], metric='haversine', leaf_size=leaf_size)
+        dist, _ = alberi[y].query(punti[inizio[x]:inizio[x] + conteggio[x]], k=1)
+        if dist.min() <= raggio:
+            padre[rx] = ry
+    del alberi
+    componenti = np.array([radice(c) for c in range(len(padre))])[componenti][cella_core]
+
+    # Numerazione nell'ordine del primo punto core di ciascun cluster
+    _, primo, inverso = np.unique(componenti, return_index=True, return_inverse=True)
+    rango = np.empty(len(primo), dtype=int)
+    rango[np.argsort(primo)] = np.arange(len(primo))
+    labels[core] = rango[inverso]
+
+    # Punti di bordo: cluster del punto core più vicino, se entro eps
+    albero_core = BallTree(X[core], metric='haversine', leaf_size=leaf_size)
+    bordo = np.flatnonzero(~is_core)
+    for i in range(0, len(bordo), blocco):
+        righe = bordo[i:i + blocco]
+        dist, idx = albero_core.query(X[righe], k=1)
+        entro = dist[:, 0] <= raggio
+        labels[righe[entro]] = labels[core[idx[entro, 0]]]
+    return labels, core
+
+
+class DBSCANHaversine:
+    """
+    DBSCAN sulla distanza haversine, con eps in km (dal gomito della curva k-distance se None)
+    e memoria lineare nel numero di clienti (vedi dbscan_haversine).
+    """
+    metrica = 'haversine'
+
+    def __init__(self, eps_km=None, min_samples=4, quota_outlier_max=0.03, distanza_riparazione=12.0,
+                 blocco=PUNTI_BLOCCO):
+        self.eps = eps_km
+        self.min_samples = min_samples
+        self.quota_outlier_max = quota_outlier_max
+        self.distanza_riparazione = distanza_riparazione
+        self.blocco = blocco
+        self.curva = None
+
+    def spazio(self, coordinate):
+        return np.asarray(coordinate, dtype=float)
+
+    def fit(self, coordinate):
+        if self.eps is None:
+            self.eps, self.curva = stima_eps(coordinate, self.min_samples, self.quota_outlier_max, metrica='haversine')
+        self.labels_, self.core_sample_indices_ = dbscan_haversine(coordinate, self.eps, self.min_samples,
+                                                                    self.blocco)
+        return self
+
+
+class HDBSCANHaversine:
+    """
+    HDBSCAN sulla distanza haversine (BallTree): non richiede eps, solo la dimensione minima dei cluster.
+    eps_km, se indicato, unisce i cluster più vicini di eps_km (cluster_selection_epsilon);
+    altrimenti viene stimato dalla curva k-distance e usato solo come raggio di assegnazione
+    dei nuovi clienti nel clustering incrementale. Tutti i punti clusterizzati sono considerati core.
+    """
+    metrica = 'haversine'
+
+    def __init__(self, min_cluster_size=15, min_samples=4, eps_km=None, quota_outlier_max=0.03,
+                 distanza_riparazione=12.0):
+        self.min_cluster_size = min_cluster_size
+        self.min_samples = min_samples
+        self.eps_selezione = eps_km
+        self.eps = eps_km
+        self.quota_outlier_max = quota_outlier_max
+        self.distanza_riparazione = distanza_riparazione
+        self.curva = None
+
+    def spazio(self, coordinate):
+        return np.asarray(coordinate, dtype=float)
+
+    def fit(self, coordinate):
+        if self.eps is None:
+            self.eps, self.curva = stima_eps(coordinate, self.min_samples, self.quota_outlier_max, metrica='haversine')
+        hdb = HDBSCAN(
+            min_cluster_size=self.min_cluster_size, min_samples=self.min_samples, metric='haversine',
+            algorithm='ball_tree', copy=False,
+            cluster_selection_epsilon=(self.eps_selezione or 0.0) / RAGGIO_TERRA_KM,
+        ).fit(np.radians(np.asarray(coordinate, dtype=float)))
+        self.labels_ = hdb.labels_
+        self.core_sample_indices_ = np.flatnonzero(hdb.labels_ != -1)
+        return self
+
+
+BACKEND_CLUSTERING = {
+    'dbscan_standardizzato': DBSCANStandardizzato,
+    'dbscan_haversine': DBSCANHaversine,
+    'hdbscan_haversine': HDBSCANHaversine,
+}
+
+
+def crea_backend(nome, **parametri):
+    if nome not in BACKEND_CLUSTERING:
+        raise ValueError(f"Backend di clustering non supportato: {nome}")
+    return BACKEND_CLUSTERING[nome](**parametri)
+
+
+def genera_clienti_sintetici(n, clienti_per_paese=200, quota_sparsi=0.08, centro=(40.6, 15.8), seed=42):
+    """
+    Clienti sintetici con la densità dell'anagrafica reale: paesi di dimensione decrescente (Zipf,
+    raggio 0.5-3 km) a distanza esponenziale (media 35 km) dal centro, più clienti isolati entro 90 km.
+    """
+    rng = np.random.default_rng(seed)
+    km_lat, km_lon = 111.2, 111.2 * np.cos(np.radians(centro[0]))
+    n_paesi = max(10, n // clienti_per_paese)
+    distanza = rng.exponential(35.0, n_paesi)
+    angolo = rng.uniform(0, 2 * np.pi, n_paesi)
+    centri = np.column_stack([centro[0] + distanza * np.cos(angolo) / km_lat,
+                              centro[1] + distanza * np.sin(angolo) / km_lon])
+    raggi = rng.uniform(0.5, 3.0, n_paesi)
+
+    n_sparsi = int(n * quota_sparsi)
+    pesi = 1.0 / np.arange(1, n_paesi + 1)
+    paese = rng.choice(n_paesi, n - n_sparsi, p=pesi / pesi.sum())
+    scarto = rng.normal(size=(n - n_sparsi, 2)) * raggi[paese][:, None]
+    punti = centri[paese] + scarto / [km_lat, km_lon]
+    r = 90.0 * np.sqrt(rng.random(n_sparsi))
+    a = rng.uniform(0, 2 * np.pi, n_sparsi)
+    sparsi = np.column_stack([centro[0] + r * np.cos(a) / km_lat, centro[1] + r * np.sin(a) / km_lon])
+    return np.vstack([punti, sparsi])
+
+
+if __name__ == "__main__":
+    import multiprocessing
+    import resource
+    import sys
+    import time
+
+    # Benchmark: python backend_clustering.py [n1 n2 ...] (default 10k, 100k, 500k, 1M clienti sintetici).
+    # Ogni metodo gira in un processo figlio con al più LIMITE_MEMORIA byte di memoria virtuale;
+    # il picco è la memoria residente massima del processo (dati di partenza inclusi).
+    dimensioni = [int(a) for a in sys.argv[1:]] or [10_000, 100_000, 500_000, 1_000_000]
+    EPS_KM = 1.0
+    LIMITE_MEMORIA = 3 * 2**30
+
+    def con_haversine(coordinate):
+        return dbscan_haversine(coordinate, EPS_KM, min_samples=4)
+
+    def con_scikit_learn(coordinate):
+        # Riferimento: DBSCAN di scikit-learn, che tiene in memoria tutti i vicinati
+        rif = DBSCAN(eps=EPS_KM / RAGGIO_TERRA_KM, min_samples=4, metric='haversine',
+                     algorithm='ball_tree').fit(np.radians(coordinate))
+        return rif.labels_, np.sort(rif.core_sample_indices_)
+
+    def misura(metodo, coordinate, uscita):
+        resource.setrlimit(resource.RLIMIT_AS, (LIMITE_MEMORIA, LIMITE_MEMORIA))
+        t0 = time.perf_counter()
+        try:
+            labels, core = metodo(coordinate)
+        except MemoryError:
+            uscita.send(None)
+            return
+        picco = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        uscita.send((time.perf_counter() - t0, picco, labels, core))
+
+    def in_processo(metodo, coordinate):
+        ricezione, uscita = multiprocessing.Pipe(duplex=False)
+        figlio = multiprocessing.get_context('fork').Process(target=misura, args=(metodo, coordinate, uscita))
+        figlio.start()
+        uscita.close()
+        try:
+            return ricezione.recv()
+        except EOFError:
+            # Processo terminato senza risultato (memoria esaurita)
+            return None
+        finally:
+            figlio.join()
+
+    for n in dimensioni:
+        coordinate = genera_clienti_sintetici(n)
+        risultati = {}
+        for nome, metodo in [('dbscan_haversine', con_haversine), ('DBSCAN scikit-learn', con_scikit_learn)]:
+            risultati[nome] = esito = in_processo(metodo, coordinate)
+            if esito is None:
+                print(f"{n:>9} clienti | {nome:<20} (eps {EPS_KM} km): memoria esaurita oltre "
+                      f"{LIMITE_MEMORIA / 2**30:.0f} GB")
+                continue
+            durata, picco, labels, _ = esito
+            print(f"{n:>9} clienti | {nome:<20} (eps {EPS_KM} km): {durata:7.2f} s, picco RSS {picco:7.1f} MB, "
+                  f"{len(np.unique(labels[labels != -1]))} cluster, outlier {np.mean(labels == -1):.1%}")
+        if all(esito is not None for esito in risultati.values()):
+            (_, _, labels, core), (_, _, labels_rif, core_rif) = risultati.values()
+            uguali = np.array_equal(core, core_rif) and np.array_equal(labels[core], labels_rif[core_rif])
+            print(f"{'':>9}         | stessi punti core ed etichette: {uguali}")
@@ -0,0 +1,405 @@
+import json
+import os
+import pickle
+import platform
+import subprocess
+import threading
+import time
+from functools import cached_property, partial
+
+import numpy as np
+import pandas as pd
+
+from backend_clustering import DBSCANHaversine
+from bilanciamento import bilancia_consegne, genera_consegne_sintetiche, giri_per_giorno
+from clustering import local_density
+from coordinate import coordinate_da_gps
+from distanze import matrice_distanze
+from indice_spaziale import IndiceSpaziale
+from pianificazione_multi_veicolo import DURATA_MAX_TURNO_MIN, pianifica_giro, tempo_servizio
+from regression_final import (CATEGORICAL_FEATURES, MAX_DATE_PREVISTE, NUMERICAL_FEATURES, _genera_date_riferimento,
+                              crea_modello, crea_regressore, date_previste, prepara_dati)
+from rete_stradale import CostiStradali, crea_server_locale
+from ricerca_locale import percorso_giro
+from ripianificazione import genera_orizzonte_sintetico, trova_date_vicine
+from strumentazione import azzera, misura, misure
+from vrp import pianifica_veicoli
+
+# Benchmark delle fasi del progetto su clienti sintetici (1k, 10k, 100k, 1M).
+# Il generatore riproduce la struttura dell'estrazione aziendale: clienti raggruppati in paesi
+# la cui densità decresce con la distanza dal deposito, stringhe GPS in DMS (alcune mancanti)
+# e uno storico di consegne per cliente con intervalli e quantità plausibili.
+# Ogni esecuzione viene aggiunta a risultati_benchmark.jsonl, così da confrontare le esecuzioni nel tempo.
+
+DEPOSITO_COORD = (40.656361, 15.880113)
+DIMENSIONI = [1_000, 10_000, 100_000]
+PERCORSO_RISULTATI = "risultati_benchmark.jsonl"
+
+KM_PER_GRADO = 111.2
+DISTANZA_MEDIA_PAESI_KM = 35.0   # distanza media dei paesi dal deposito (esponenziale)
+CLIENTI_PER_PAESE = 200
+QUOTA_SPARSI = 0.08              # clienti isolati, uniformi entro RAGGIO_SPARSI_KM dal deposito
+RAGGIO_SPARSI_KM = 90.0
+QUOTA_GPS_MANCANTI = 0.05
+CONSEGNE_MEDIE = 8
+FINE_STORICO = pd.Timestamp("2025-04-30")
+CLIENTI_PER_GIRO = 25
+
+
+def formato_dms(gradi, positivo, negativo):
+    # Gradi decimali -> stringhe DMS come nell'estrazione, es. "40°38'38.43''N"
+    centesimi = np.round(np.abs(gradi) * 360000).astype(np.int64)
+    g = centesimi // 360000
+    m = (centesimi % 360000) // 6000
+    s = np.char.mod('%.2f', (centesimi % 6000) / 100)
+    emisfero = np.where(gradi < 0, negativo, positivo)
+    return (pd.Series(g).astype(str) + '°' + pd.Series(m).astype(str) + "'" + pd.Series(s) + "''"
+            + pd.Series(emisfero)).to_numpy(dtype=object)
+
+
+def genera_clienti(n, seed=42):
+    """
+    Anagrafica sintetica di n clienti attorno al deposito: paesi di dimensione decrescente (Zipf)
+    a distanza esponenziale dal deposito più una quota di clienti isolati.
+    Colonne: Codice Cliente, latitudine, longitudine, GPS (DMS, NaN per una quota), Via, Localita, Ragione sociale, paese.
+    """
+    rng = np.random.default_rng(seed)
+    n_paesi = max(10, n // CLIENTI_PER_PAESE)
+    distanza = rng.exponential(DISTANZA_MEDIA_PAESI_KM, n_paesi)
+    angolo = rng.uniform(0, 2 * np.pi, n_paesi)
+    centri_lat = DEPOSITO_COORD[0] + distanza * np.cos(angolo) / KM_PER_GRADO
+    centri_lon = DEPOSITO_COORD[1] + distanza * np.sin(angolo) / (KM_PER_GRADO * np.cos(np.radians(DEPOSITO_COORD[0])))
+    raggio_km = rng.uniform(0.5, 3.0, n_paesi)
+
+    n_sparsi = int(n * QUOTA_SPARSI)
+    pesi = 1.0 / np.arange(1, n_paesi + 1)
+    paese = np.concatenate([rng.choice(n_paesi, n - n_sparsi, p=pesi / pesi.sum()), np.full(n_sparsi, -1)])
+    in_paese = paese >= 0
+
+    lat = np.empty(n)
+    lon = np.empty(n)
+    scarto = rng.normal(size=(n, 2)) * raggio_km[paese][:, None] / KM_PER_GRADO
+    lat[in_paese] = centri_lat[paese[in_paese]] + scarto[in_paese, 0]
+    lon[in_paese] = centri_lon[paese[in_paese]] + scarto[in_paese, 1] / np.cos(np.radians(DEPOSITO_COORD[0]))
+    r = RAGGIO_SPARSI_KM * np.sqrt(rng.random(n_sparsi))
+    a = rng.uniform(0, 2 * np.pi, n_sparsi)
+    lat[~in_paese] = DEPOSITO_COORD[0] + r * np.cos(a) / KM_PER_GRADO
+    lon[~in_paese] = DEPOSITO_COORD[1] + r * np.sin(a) / (KM_PER_GRADO * np.cos(np.radians(DEPOSITO_COORD[0])))
+
+    gps = formato_dms(lat, 'N', 'S') + ' ' + formato_dms(lon, 'E', 'W')
+    gps[rng.random(n) < QUOTA_GPS_MANCANTI] = np.nan
+    codici = np.arange(10000, 10000 + n)
+    nome_paese = np.where(in_paese, pd.Series(paese).astype(str).radd('PAESE '), 'CAMPAGNA')
+    return pd.DataFrame({
+        'Codice Cliente': codici,
+        'latitudine': lat,
+        'longitudine': lon,
+        'GPS': gps,
+        'Via': pd.Series(rng.integers(1, 400, n)).astype(str).radd('VIA ').to_numpy(),
+        'Localita': pd.Series(nome_paese).radd(pd.Series(85000 + np.maximum(paese, 0) % 1000).astype(str) + ' ')
+                      .add(' PZ').to_numpy(),
+        'Ragione sociale': pd.Series(codici).astype(str).radd('CLIENTE ').to_numpy(),
+        'paese': paese,
+    })
+
+
+def genera_storico(clienti, consegne_medie=CONSEGNE_MEDIE, seed=42):
+    """
+    Storico sintetico delle consegne con le colonne dell'estrazione (prima della pulizia dei nomi):
+    per ogni cliente un intervallo tipico (15-150 giorni) e una quantità tipica, con variazioni casuali,
+    fino a FINE_STORICO.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(clienti)
+    intervallo = rng.uniform(15, 150, n)
+    quantita = rng.choice([200, 500, 800, 1000, 1500, 2000], n)
+    conteggi = rng.poisson(consegne_medie - 1, n) + 1
+    righe = np.repeat(np.arange(n), conteggi)
+
+    # Intervalli all'indietro dalla consegna più recente: somma cumulata per cliente
+    salti = intervallo[righe] * rng.lognormal(0.0, 0.25, len(righe))
+    cumulati = np.cumsum(salti)
+    inizio_cliente = np.repeat(np.cumsum(conteggi) - conteggi, conteggi)
+    cumulati -= np.concatenate([[0.0], cumulati])[inizio_cliente]
+    giorni_indietro = np.rint(cumulati - salti).astype(int) + rng.integers(0, 20, n)[righe]
+    rapporto = salti / intervallo[righe]
+    litri = np.maximum(100, np.round(quantita[righe] * rapporto / 50) * 50)
+
+    return pd.DataFrame({
+        'Codice Cliente': clienti['Codice Cliente'].to_numpy()[righe],
+        'Data': FINE_STORICO - pd.to_timedelta(giorni_indietro, unit='D'),
+        'Quantità [litri]': litri,
+        'Ragione sociale': clienti['Ragione sociale'].to_numpy()[righe],
+        'Via': clienti['Via'].to_numpy()[righe],
+        'Località': clienti['Localita'].to_numpy()[righe],
+        'GPS': clienti['GPS'].to_numpy()[righe],
+    })
+
+
+class DatiSintetici:
+    # Dati di una dimensione, generati solo se richiesti da un benchmark
+    def __init__(self, n, seed=42):
+        self.n = n
+        self.seed = seed
+
+    @cached_property
+    def clienti(self):
+        return genera_clienti(self.n, self.seed)
+
+    @cached_property
+    def storico(self):
+        return genera_storico(self.clienti, seed=self.seed)
+
+    @cached_property
+    def previsioni(self):
+        # Tabella come media_completa della regressione, con le medie previste pari agli intervalli reali
+        s = self.storico.sort_values(['Codice Cliente', 'Data'])
+        g = s.groupby('Codice Cliente')
+        media = (g['Data'].max() - g['Data'].min()).dt.days / (g['Data'].count() - 1).clip(lower=1)
+        return pd.DataFrame({
+            'Codice Cliente': media.index,
+            'Media_giorni_previsti': media.clip(lower=1).to_numpy(),
+            'Data_ultima_consegna': g['Data'].max().to_numpy(),
+            'Quantita_ultima_consegna': g['Quantità [litri]'].last().to_numpy(),
+        })
+
+    @cached_property
+    def orizzonte(self):
+        # Piano di 5 anni con giri validi per (data, zona) e un cliente escluso da ripianificare per cliente
+        return genera_orizzonte_sintetico(anni=5, n_cluster=max(11, self.n // 300), n_esclusi=self.n, seed=self.seed)
+
+    @cached_property
+    def consegne(self):
+        # Consegne previste su 5 anni (una riga per consegna) con consumo e quantità per il bilanciamento
+        return genera_consegne_sintetiche(self.n, anni=5, n_cluster=max(11, self.n // 300), seed=self.seed)
+
+    @cached_property
+    def giri(self):
+        # Giri di CLIENTI_PER_GIRO clienti vicini (ordinati per paese e latitudine), come (lat, lon) per giro
+        ordine = self.clienti.sort_values(['paese', 'latitudine']).index.to_numpy()
+        lat = self.clienti['latitudine'].to_numpy()[ordine]
+        lon = self.clienti['longitudine'].to_numpy()[ordine]
+        return [(lat[i:i + CLIENTI_PER_GIRO], lon[i:i + CLIENTI_PER_GIRO])
+                for i in range(0, len(ordine), CLIENTI_PER_GIRO)]
+
+
+def bench_dms(dati):
+    coordinate = coordinate_da_gps(dati.clienti['GPS'])
+    return {'coordinate_valide': int(coordinate['latitudine'].notna().sum())}
+
+
+def bench_clustering(dati):
+    backend = DBSCANHaversine().fit(dati.clienti[['latitudine', 'longitudine']].to_numpy())
+    return {'eps_km': round(float(backend.eps), 3), 'cluster': int(backend.labels_.max() + 1),
+            'quota_outlier': round(float(np.mean(backend.labels_ == -1)), 4)}
+
+
+def bench_densita_locale(dati):
+    indice = IndiceSpaziale(dati.clienti[['latitudine', 'longitudine']].to_numpy(), metrica='haversine')
+    densita = local_density(dati.clienti['latitudine'], dati.clienti['longitudine'], indice)
+    return {'densita_media': round(float(np.mean(densita)), 1)}
+
+
+def bench_date_previste(dati):
+    p = dati.previsioni
+    date = date_previste(p['Codice Cliente'], p['Data_ultima_consegna'], p['Media_giorni_previsti'],
+                         p['Quantita_ultima_consegna'])
+    return {'date': len(date)}
+
+
+def bench_date_previste_riferimento(dati):
+    date = dati.previsioni.apply(_genera_date_riferimento, axis=1).str[:MAX_DATE_PREVISTE]
+    return {'date': int(date.str.len().sum())}
+
+
+def bench_ripianificazione(dati):
+    nuove = trova_date_vicine(*dati.orizzonte)
+    return {'ripianificati': int(nuove.notna().sum())}
+
+
+def bench_bilanciamento(dati):
+    c = dati.consegne
+    nuove = bilancia_consegne(c)
+    veicoli = giri_per_giorno(nuove, c['cluster_finale'])
+    return {'consegne': len(c), 'veicoli': int(veicoli.sum()), 'max_giorno': int(veicoli.max())}
+
+
+def bench_routing_nn(dati):
+    totale = 0.0
+    for lat, lon in dati.giri:
+        km = matrice_distanze(np.r_[DEPOSITO_COORD[0], lat], np.r_[DEPOSITO_COORD[1], lon])
+        totale += percorso_giro(km, list(range(1, len(lat) + 1)))[0]
+    return {'giri': len(dati.giri), 'km': round(totale, 1)}
+
+
+def bench_routing_vrp(dati):
+    rng = np.random.default_rng(dati.seed)
+    totale, veicoli = 0.0, 0
+    for lat, lon in dati.giri:
+        km = matrice_distanze(np.r_[DEPOSITO_COORD[0], lat], np.r_[DEPOSITO_COORD[1], lon])
+        domanda = {i: q for i, q in enumerate(rng.choice([200, 500, 800, 1000, 1500, 2000], len(lat)), start=1)}
+        giri = pianifica_veicoli(km, list(range(1, len(lat) + 1)), domanda)
+        totale += sum(g[0] for g in giri)
+        veicoli += len(giri)
+    return {'giri': len(dati.giri), 'veicoli': veicoli, 'km': round(totale, 1)}
+
+
+def bench_routing_stradale(dati, asimmetria=0.3):
+    # VRP con durata del turno sui costi asimmetrici del server locale di prova (verso nord più caro):
+    # i km sono contati nel verso reale; 'peggiori_nn' conta i veicoli più lunghi del loro Nearest Neighbor
+    server = crea_server_locale(porta=0, asimmetria=asimmetria)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    costi = CostiStradali(f"http://127.0.0.1:{server.server_port}", percorso_cache=None)
+    try:
+        with misura('costi_stradali'):
+            tabelle = costi.tabelle([(np.r_[DEPOSITO_COORD[0], lat], np.r_[DEPOSITO_COORD[1], lon])
+                                     for lat, lon in dati.giri])
+    finally:
+        costi.chiudi()
+        server.shutdown()
+        server.server_close()
+    rng = np.random.default_rng(dati.seed)
+    totale, veicoli, peggiori = 0.0, 0, 0
+    for (lat, lon), (km, minuti) in zip(dati.giri, tabelle):
+        nodi = list(range(1, len(lat) + 1))
+        domanda = dict(zip(nodi, rng.choice([200, 500, 800, 1000, 1500, 2000], len(lat))))
+        giri, _ = pianifica_giro((nodi, km, minuti), domanda, {n: tempo_servizio(q) for n, q in domanda.items()},
+                                 durata_max=DURATA_MAX_TURNO_MIN)
+        totale += sum(g[0] for g in giri)
+        veicoli += len(giri)
+        peggiori += sum(int(dist > dist_nn) for dist, dist_nn, _ in giri)
+    return {'giri': len(dati.giri), 'veicoli': veicoli, 'km': round(totale, 1), 'peggiori_nn': peggiori,
+            'stimati': costi.statistiche['stimati']}
+
+
+def bench_previsione(dati, codifica='onehot', modello='random_forest', n_jobs=1):
+    with misura('feature'):
+        df = prepara_dati(dati.storico)
+    X, y = df[NUMERICAL_FEATURES + CATEGORICAL_FEATURES], df['Giorni_trascorsi']
+    pipeline = crea_modello(crea_regressore(modello, n_jobs), codifica)
+    with misura('fit'):
+        pipeline.fit(X, y)
+    with misura('predict'):
+        pipeline.predict(X)
+    return {'righe': len(df), 'modello_mb': round(len(pickle.dumps(pipeline)) / 2**20, 1)}
+
+
+# nome -> (funzione, numero massimo di clienti per cui viene eseguito, dati generati prima della misura)
+BENCHMARK = {
+    'dms': (bench_dms, 1_000_000, ('clienti',)),
+    'clustering': (bench_clustering, 1_000_000, ('clienti',)),
+    'densita_locale': (bench_densita_locale, 1_000_000, ('clienti',)),
+    'date_previste': (bench_date_previste, 1_000_000, ('previsioni',)),
+    'date_previste_riferimento': (bench_date_previste_riferimento, 100_000, ('previsioni',)),
+    'ripianificazione': (bench_ripianificazione, 1_000_000, ('orizzonte',)),
+    'bilanciamento': (bench_bilanciamento, 1_000_000, ('consegne',)),
+    'routing_nn': (bench_routing_nn, 100_000, ('giri',)),
+    'routing_vrp': (bench_routing_vrp, 100_000, ('giri',)),
+    'routing_stradale': (bench_routing_stradale, 10_000, ('giri',)),
+    'previsione': (bench_previsione, 10_000, ('storico',)),
+    'previsione_frequenza': (partial(bench_previsione, codifica='frequenza', n_jobs=-1), 100_000, ('storico',)),
+    'previsione_hash': (partial(bench_previsione, codifica='hash', n_jobs=-1), 1_000, ('storico',)),
+    'previsione_hgb': (partial(bench_previsione, codifica='target', modello='hist_gradient_boosting'), 1_000_000,
+                       ('storico',)),
+}
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def esegui_benchmark(dimensioni=DIMENSIONI, nomi=None, seed=42):
+    """
+    Esegue i benchmark richiesti per ogni dimensione (saltando quelli oltre il loro massimo).
+    Restituisce il record dell'esecuzione: ambiente e, per ogni (benchmark, clienti),
+    tempo reale e CPU, picco RSS, contatori, sotto-misure e informazioni sul risultato.
+    """
+    nomi = nomi or list(BENCHMARK)
+    risultati = []
+    for n in dimensioni:
+        dati = DatiSintetici(n, seed)
+        for nome in nomi:
+            funzione, massimo, richiesti = BENCHMARK[nome]
+            if n > massimo:
+                continue
+            for attributo in richiesti:
+                getattr(dati, attributo)   # generazione dei dati fuori dalla misura
+            azzera()
+            with misura(nome) as m:
+                info = funzione(dati)
+            sotto = [{k: s[k] for k in ('nome', 'tempo_s', 'picco_rss_mb')} for s in misure(nome)]
+            risultati.append({'benchmark': nome, 'clienti': n, 'tempo_s': m['tempo_s'], 'cpu_s': m['cpu_s'],
+                              'picco_rss_mb': m['picco_rss_mb'], 'contatori': m['contatori'],
+                              'sotto_misure': sotto, 'info': info})
+            print(f"{nome:>17} {n:>9} clienti: {m['tempo_s']:9.3f} s, picco RSS {m['picco_rss_mb']:8.1f} MB  {info}")
+    return {
+        'creato': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'piattaforma': platform.platform(),
+        'cpu': os.cpu_count(),
+        'seed': seed,
+        'risultati': risultati,
+    }
+
+
+def salva_risultati(esecuzione, percorso=PERCORSO_RISULTATI):
+    # Una riga JSON per esecuzione, in coda al file
+    with open(percorso, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(esecuzione, ensure_ascii=False) + '\n')
+
+
+def carica_risultati(percorso=PERCORSO_RISULTATI):
+    if not os.path.exists(percorso):
+        return []
+    with open(percorso, encoding='utf-8') as f:
+        return [json.loads(riga) for riga in f if riga.strip()]
+
+
+def confronta(precedente, attuale):
+    # Tabella dei tempi per (benchmark, clienti) presenti in entrambe le esecuzioni
+    prima = {(r['benchmark'], r['clienti']): r for r in precedente['risultati']}
+    righe = []
+    for r in attuale['risultati']:
+        p = prima.get((r['benchmark'], r['clienti']))
+        if p is None:
+            continue
+        righe.append({
+            'benchmark': r['benchmark'], 'clienti': r['clienti'],
+            'tempo_prima_s': p['tempo_s'], 'tempo_s': r['tempo_s'],
+            'rapporto': round(r['tempo_s'] / p['tempo_s'], 3) if p['tempo_s'] else None,
+            'picco_prima_mb': p['picco_rss_mb'], 'picco_mb': r['picco_rss_mb'],
+        })
+    return pd.DataFrame(righe)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark delle fasi su clienti sintetici")
+    parser.add_argument("--dimensioni", nargs='*', type=int, default=DIMENSIONI,
+                        help="numero di clienti (es. 1000 10000 100000 1000000)")
+    parser.add_argument("--benchmark", nargs='*', choices=list(BENCHMARK), help="benchmark da eseguire (default tutti)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--risultati", default=PERCORSO_RISULTATI)
+    parser.add_argument("--non-salvare", action="store_true", help="non aggiunge l'esecuzione al file dei risultati")
+    parser.add_argument("--confronta", action="store_true",
+                        help="solo confronto tra le ultime due esecuzioni salvate, senza eseguire i benchmark")
+    args = parser.parse_args()
+
+    if args.confronta:
+        esecuzioni = carica_risultati(args.risultati)
+        if len(esecuzioni) < 2:
+            raise SystemExit(f"Servono almeno due esecuzioni in {args.risultati}")
+        print(f"{esecuzioni[-2]['creato']} ({esecuzioni[-2]['commit']}) -> "
+              f"{esecuzioni[-1]['creato']} ({esecuzioni[-1]['commit']})")
+        print(confronta(esecuzioni[-2], esecuzioni[-1]).to_string(index=False))
+    else:
+        esecuzione = esegui_benchmark(args.dimensioni, args.benchmark, args.seed)
+        if not args.non_salvare:
+            salva_risultati(esecuzione, args.risultati)
+            print(f"Risultati aggiunti a {args.risultati}")
@@ -0,0 +1,213 @@
+import heapq
+
+import numpy as np
+import pandas as pd
+
+# Bilanciamento del piano sull'intero orizzonte: ogni consegna prevista può essere anticipata
+# o posticipata entro una finestra sicura, calcolata dall'autonomia del serbatoio
+# (Quantita_ultima_consegna / Consumo_medio_giornaliero), così da non lasciare il cliente senza gas.
+# 1) Per ogni cluster le consegne vengono raccolte nel minor numero di giri compatibili con le
+#    finestre (scadenza più vicina per prima, al massimo clienti_per_giro per giro);
+# 2) ogni giro viene spostato, entro l'intersezione delle finestre dei suoi clienti, nel giorno
+#    meno carico, partendo dai giri meno flessibili.
+
+# Anticipo massimo come quota dell'autonomia (si consegna qualche litro in meno)
+QUOTA_ANTICIPO = 0.15
+# Scorta stimata alla data prevista, come quota dell'autonomia, e giorni di margine prima dell'esaurimento
+QUOTA_SCORTA = 0.2
+MARGINE_GIORNI = 2
+# Spostamento massimo in giorni, in entrambe le direzioni
+MAX_SPOSTAMENTO_GIORNI = 7
+CLIENTI_PER_GIRO = 8
+
+
+def finestre_sicure(date, consumo, quantita, quota_anticipo=QUOTA_ANTICIPO, quota_scorta=QUOTA_SCORTA,
+                    margine=MARGINE_GIORNI, max_spostamento=MAX_SPOSTAMENTO_GIORNI):
+    """
+    Prima e ultima data ammesse (datetime64[D]) per ogni consegna prevista.
+    Senza consumo o quantità validi la finestra si riduce alla data prevista.
+    """
+    date = np.asarray(date, dtype='datetime64[D]')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        autonomia = np.asarray(quantita, dtype=float) / np.asarray(consumo, dtype=float)
+    autonomia = np.where(np.isfinite(autonomia) & (autonomia > 0), autonomia, 0.0)
+    anticipo = np.clip(np.floor(quota_anticipo * autonomia), 0, max_spostamento).astype(int)
+    ritardo = np.clip(np.floor(quota_scorta * autonomia) - margine, 0, max_spostamento).astype(int)
+    return date - anticipo, date + ritardo
+
+
+def _giri_cluster(inizio, fine, clienti_per_giro, clienti):
+    # Copertura delle finestre [inizio, fine] (giorni interi) con il minimo numero di giri:
+    # il giro si fissa alla scadenza più vicina tra le consegne già aperte e serve le più urgenti.
+    # Un cliente compare una sola volta per giro: le sue altre consegne aperte compatibili con il
+    # giorno del giro vi confluiscono (stessa fermata, nessun posto in più), le altre restano in coda
+    ordine = np.argsort(inizio, kind='stable')
+    giro = np.empty(len(inizio), dtype=np.int64)
+    giorni = []
+    coda = []
+    j = 0
+    while j < len(ordine) or coda:
+        if j < len(ordine) and (not coda or inizio[ordine[j]] <= coda[0][0]):
+            k = ordine[j]
+            heapq.heappush(coda, (fine[k], k))
+            j += 1
+            continue
+        giorno = coda[0][0]
+        nel_giro = set()
+        ripetute = []
+        while coda and len(nel_giro) < clienti_per_giro:
+            voce = heapq.heappop(coda)
+            if clienti[voce[1]] in nel_giro:
+                ripetute.append(voce)
+            else:
+                nel_giro.add(clienti[voce[1]])
+                giro[voce[1]] = len(giorni)
+        restanti = []
+        for voce in ripetute + coda:
+            if clienti[voce[1]] in nel_giro and inizio[voce[1]] <= giorno:
+                giro[voce[1]] = len(giorni)
+            else:
+                restanti.append(voce)
+        if len(restanti) != len(coda):
+            coda = restanti
+            heapq.heapify(coda)
+        giorni.append(giorno)
+    return giro, np.asarray(giorni, dtype=np.int64)
+
+
+def forma_giri(cluster, inizio, fine, clienti_per_giro=CLIENTI_PER_GIRO, clienti=None):
+    """
+    Raggruppa le consegne in giri per cluster. inizio e fine sono giorni interi; con clienti (codici)
+    uno stesso cliente occupa un solo posto per giro (senza, ogni consegna è un cliente diverso).
+    Restituisce il giro di ogni consegna e, per ogni giro, primo e ultimo giorno ammessi
+    (intersezione delle finestre dei suoi clienti).
+    """
+    inizio = np.asarray(inizio, dtype=np.int64)
+    fine = np.asarray(fine, dtype=np.int64)
+    clienti = np.arange(len(inizio)) if clienti is None else np.asarray(clienti)
+    giro = np.empty(len(inizio), dtype=np.int64)
+    primo, ultimo = [], []
+    n_giri = 0
+    for righe in pd.Series(cluster).groupby(np.asarray(cluster), sort=False).indices.values():
+        locale, giorni = _giri_cluster(inizio[righe], fine[righe], clienti_per_giro, clienti[righe])
+        giro[righe] = locale + n_giri
+        inizio_giri = np.full(len(giorni), np.iinfo(np.int64).min)
+        np.maximum.at(inizio_giri, locale, inizio[righe])
+        primo.append(inizio_giri)
+        ultimo.append(giorni)
+        n_giri += len(giorni)
+    if not primo:
+        return giro, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return giro, np.concatenate(primo), np.concatenate(ultimo)
+
+
+def distribuisci_giri(primo, ultimo):
+    """
+    Sceglie il giorno di ogni giro in [primo, ultimo] livellando il numero di giri per giorno:
+    i giri meno flessibili scelgono per primi il giorno meno carico (a parità, il più tardo).
+    """
+    if len(primo) == 0:
+        return np.empty(0, dtype=np.int64)
+    base = primo.min()
+    carico = np.zeros(ultimo.max() - base + 1)
+    giorno = np.empty(len(primo), dtype=np.int64)
+    for g in np.lexsort((ultimo, ultimo - primo)):
+        a, b = primo[g] - base, ultimo[g] - base
+        k = b - int(np.argmin(carico[a:b + 1][::-1]))
+        carico[k] += 1
+        giorno[g] = k + base
+    return giorno
+
+
+def bilancia_consegne(df, clienti_per_giro=CLIENTI_PER_GIRO, col_data='Date_consegna_previste',
+                      col_cluster='cluster_finale', **finestra):
+    """
+    Nuove date delle consegne previste (una riga per consegna, con Consumo_medio_giornaliero
+    e Quantita_ultima_consegna), ciascuna entro la propria finestra sicura.
+    Restituisce una Series di date allineata a df: più consegne di uno stesso cliente riunite
+    nello stesso giro ricevono la stessa data (una sola fermata).
+    """
+    inizio, fine = finestre_sicure(df[col_data].values, df['Consumo_medio_giornaliero'].values,
+                                   df['Quantita_ultima_consegna'].values, **finestra)
+    giro, primo, ultimo = forma_giri(df[col_cluster].values, inizio.astype(np.int64), fine.astype(np.int64),
+                                     clienti_per_giro, df['Codice Cliente'].values)
+    giorni = distribuisci_giri(primo, ultimo)[giro]
+    return pd.Series(pd.to_datetime(giorni.astype('datetime64[D]')), index=df.index)
+
+
+def inserisci_consegne(piano, consegne, clienti_per_giro=CLIENTI_PER_GIRO, col_data='Date_consegna_previste',
+                       col_cluster='cluster_finale', **finestra):
+    """
+    Aggiornamento incrementale di un piano già bilanciato (una riga per giro con Data Consegna,
+    Cluster e Clienti): ogni consegna entra nel giro non pieno del suo cluster più vicino alla
+    data prevista entro la propria finestra sicura, altrimenti apre un giro alla data prevista.
+    Restituisce il piano aggiornato (Data Consegna, Cluster, Clienti).
+    """
+    inizio, fine = finestre_sicure(consegne[col_data].values, consegne['Consumo_medio_giornaliero'].values,
+                                   consegne['Quantita_ultima_consegna'].values, **finestra)
+    date = list(pd.to_datetime(piano['Data Consegna']).values.astype('datetime64[D]'))
+    cluster_giri = list(piano['Cluster'])
+    clienti = [list(c) for c in piano['Clienti']]
+    giri = {c: list(righe) for c, righe in piano.groupby('Cluster').indices.items()}
+
+    previste = consegne[col_data].values.astype('datetime64[D]')
+    for i, (codice, cluster) in enumerate(zip(consegne['Codice Cliente'], consegne[col_cluster])):
+        candidati = [g for g in giri.get(cluster, [])
+                     if inizio[i] <= date[g] <= fine[i] and len(clienti[g]) < clienti_per_giro
+                     and codice not in clienti[g]]
+        if candidati:
+            g = min(candidati, key=lambda g: (abs(date[g] - previste[i]), date[g]))
+        else:
+            g = len(clienti)
+            date.append(previste[i])
+            cluster_giri.append(cluster)
+            clienti.append([])
+            giri.setdefault(cluster, []).append(g)
+        clienti[g].append(codice)
+    return pd.DataFrame({
+        'Data Consegna': pd.to_datetime(np.asarray(date, dtype='datetime64[D]')),
+        'Cluster': cluster_giri,
+        'Clienti': clienti,
+    })
+
+
+def giri_per_giorno(date, cluster, clienti_per_giro=CLIENTI_PER_GIRO):
+    # Veicoli stimati per giorno: ogni giro (data, cluster) richiede ceil(clienti / clienti_per_giro) veicoli
+    giri = pd.DataFrame({'data': np.asarray(date), 'cluster': np.asarray(cluster)}).value_counts()
+    veicoli = np.ceil(giri / clienti_per_giro)
+    return veicoli.groupby(level='data').sum()
+
+
+def genera_consegne_sintetiche(n_clienti=100_000, anni=5, n_cluster=300, seed=42):
+    # Consegne previste sintetiche: intervalli tra 15 e 200 giorni, una riga per consegna
+    rng = np.random.default_rng(seed)
+    intervallo = rng.uniform(15, 200, n_clienti)
+    quantita = rng.choice([400, 600, 800, 1000, 1500], n_clienti)
+    n_date = np.maximum(1, (365 * anni / intervallo).astype(int))
+    righe = np.repeat(np.arange(n_clienti), n_date)
+    k = np.arange(len(righe)) - np.repeat(np.cumsum(n_date) - n_date, n_date)
+    primo = rng.integers(0, 200, n_clienti)
+    giorni = primo[righe] + np.rint((k + 1) * intervallo[righe]).astype(int)
+    return pd.DataFrame({
+        'Codice Cliente': righe,
+        'Date_consegna_previste': np.datetime64('2025-06-01') + giorni.astype('timedelta64[D]'),
+        'cluster_finale': rng.integers(0, n_cluster, n_clienti)[righe].astype(str),
+        'Consumo_medio_giornaliero': (quantita / intervallo)[righe],
+        'Quantita_ultima_consegna': quantita[righe],
+    })
+
+
+if __name__ == "__main__":
+    import time
+
+    consegne = genera_consegne_sintetiche()
+    t0 = time.perf_counter()
+    nuove = bilancia_consegne(consegne)
+    t_bilanciamento = time.perf_counter() - t0
+
+    prima = giri_per_giorno(consegne['Date_consegna_previste'], consegne['cluster_finale'])
+    dopo = giri_per_giorno(nuove, consegne['cluster_finale'])
+    print(f"Consegne: {len(consegne)} di {consegne['Codice Cliente'].nunique()} clienti (5 anni)")
+    print(f"Bilanciamento: {t_bilanciamento:.2f} s")
+    print(f"Veicoli stimati: {prima.sum():.0f} -> {dopo.sum():.0f}; per giorno massimo {prima.max():.0f} -> "
+          f"{dopo.max():.0f}, deviazione standard {prima.std():.1f} -> {dopo.std():.1f}")
@@ -0,0 +1,91 @@
+import sqlite3
+import time
+
+from strumentazione import incrementa
+
+# Cache persistente (SQLite) dei risultati di geocodifica.
+# Le chiavi sono gli indirizzi già normalizzati (Via_clean / Localita_clean) e i CAP a 5 cifre,
+# così le esecuzioni successive e i nuovi clienti interrogano l'API solo per indirizzi mai visti.
+
+SECONDI_AL_GIORNO = 86400
+
+
+def normalizza_chiave(testo):
+    # Maiuscolo e spazi compattati: "Via  Roma, Potenza" e "VIA ROMA, POTENZA" hanno la stessa chiave
+    return " ".join(str(testo).upper().split())
+
+
+def chiave_indirizzo(indirizzo):
+    return "ind:" + normalizza_chiave(indirizzo)
+
+
+def chiave_cap(cap):
+    return "cap:" + str(cap).strip()
+
+
+class CacheGeocodifica:
+    """
+    Cache su disco indirizzo -> (lat, lon) con scadenza (TTL).
+    Anche i risultati negativi (indirizzo non trovato) vengono memorizzati,
+    con una scadenza più breve, per non ripetere richieste inutili.
+    """
+
+    def __init__(self, percorso="cache_geocodifica.sqlite", ttl_giorni=365, ttl_negativi_giorni=30):
+        self.percorso = percorso
+        self.ttl = ttl_giorni * SECONDI_AL_GIORNO
+        self.ttl_negativi = ttl_negativi_giorni * SECONDI_AL_GIORNO
+        self.hit = 0
+        self.miss = 0
+        self.conn = sqlite3.connect(percorso)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS geocodifica ("
+            " chiave TEXT PRIMARY KEY, lat REAL, lon REAL, salvato REAL NOT NULL)"
+        )
+        self.elimina_scaduti()
+
+    def elimina_scaduti(self):
+        adesso = time.time()
+        with self.conn:
+            cur = self.conn.execute(
+                "DELETE FROM geocodifica WHERE (lat IS NOT NULL AND salvato < ?) OR (lat IS NULL AND salvato < ?)",
+                (adesso - self.ttl, adesso - self.ttl_negativi),
+            )
+        return cur.rowcount
+
+    def leggi(self, chiave):
+        """
+        Restituisce (trovato, coordinate): trovato=False se la chiave non è in cache o è scaduta,
+        coordinate=None per un risultato negativo memorizzato.
+        """
+        riga = self.conn.execute("SELECT lat, lon, salvato FROM geocodifica WHERE chiave = ?", (chiave,)).fetchone()
+        if riga is not None:
+            lat, lon, salvato = riga
+            ttl = self.ttl if lat is not None else self.ttl_negativi
+            if time.time() - salvato <= ttl:
+                self.hit += 1
+                incrementa('cache_geocodifica_hit')
+                return True, (lat, lon) if lat is not None else None
+        self.miss += 1
+        incrementa('cache_geocodifica_miss')
+        return False, None
+
+    def scrivi(self, chiave, coordinate):
+        lat, lon = coordinate if coordinate else (None, None)
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO geocodifica (chiave, lat, lon, salvato) VALUES (?, ?, ?, ?)",
+                (chiave, lat, lon, time.time()),
+            )
+
+    def statistiche(self):
+        totale = self.hit + self.miss
+        voci = self.conn.execute("SELECT COUNT(*) FROM geocodifica").fetchone()[0]
+        return {
+            'hit': self.hit,
+            'miss': self.miss,
+            'hit_rate': round(self.hit / totale, 3) if totale else 0.0,
+            'voci': voci,
+        }
+
+    def chiudi(self):
+        self.conn.close()
@@ -1,148 +1,175 @@
 import pandas as pd
 import numpy as np
-from sklearn.cluster import DBSCAN
-from sklearn.preprocessing import StandardScaler
-from sklearn.neighbors import NearestNeighbors
-from sklearn.metrics import silhouette_score, pairwise_distances_argmin_min
+import matplotlib
+matplotlib.use("Agg")  # esecuzione senza interfaccia grafica: i grafici vengono salvati su file
 import matplotlib.pyplot as plt
-import folium
-from sklearn.cluster import KMeans
-from folium.plugins import MarkerCluster
-from matplotlib import cm, colors
-
-# Caricamento dati e preparazione coordinate
-df = pd.read_csv("clienti_validi_geocodificati.csv")
-coordinates = df[['latitudine', 'longitudine']]
-
-# Standardizzazione delle coordinate geografiche
-scaled = StandardScaler().fit_transform(coordinates)
-
-# K-distance plot per determinare il parametro eps
-neighbors = NearestNeighbors(n_neighbors=4)
-d, _ = neighbors.fit(scaled).kneighbors(scaled)
-k_d = np.sort(d[:, -1])
-
-plt.figure(figsize=(8, 4))
-plt.plot(k_d)
-plt.xlabel("Punti ordinati")
-plt.ylabel("Distanza al 4° vicino")
-plt.title("Curva k-distance (min_samples = 4)")
-plt.grid(True)
-plt.show()
-
-# Clustering con DBSCAN
-db = DBSCAN(eps=0.3, min_samples=4)
-df['cluster'] = db.fit_predict(scaled)
-labels = db.labels_
-
-# Calcolo del Silhouette Score escludendo gli outlier
-if len(set(labels)) > 1 and -1 in labels:
+from indice_spaziale import IndiceSpaziale
+from artefatti import leggi_artefatto, scrivi_artefatto
+from clustering_incrementale import SOGLIA_DRIFT, aggiorna_da_artefatti, crea_stato, salva_stato
+from selezione_parametri import silhouette_campionata, scegli_sottocluster
+from backend_clustering import crea_backend
+from strumentazione import misura
+
+# Backend di clustering: 'dbscan_haversine' (eps in km), 'hdbscan_haversine'
+# oppure 'dbscan_standardizzato' (DBSCAN su coordinate standardizzate, metodo originale)
+BACKEND = 'dbscan_haversine'
+EPS = None                   # None: scelto dal gomito della curva k-distance (km per i backend haversine)
+
+# Parametri della selezione automatica
+MIN_SAMPLES = 4
+QUOTA_OUTLIER_MAX = 0.03     # quota massima di clienti fuori dai punti core accettata per eps
+MAX_CLIENTI_ZONA = 300       # oltre questo numero di clienti un cluster viene suddiviso
+RAGGIO_MAX_KM = 30.0         # raggio massimo di una zona (95° percentile dal baricentro)
+CAMPIONE_SILHOUETTE = 2000
+N_PROCESSI = None            # processi per la valutazione dei candidati (None = tutti i core, 1 = seriale)
+
+# Aggiornamento incrementale (clustering_incrementale.py): i clienti nuovi o spostati vengono assegnati
+# alle zone salvate; il clustering completo si esegue solo oltre la soglia di drift o senza stato salvato
+INCREMENTALE = False
+
+
+# Funzione per calcolo della densità locale (raggio: 10 km), in un'unica query batch
+def local_density(lat, lon, indice, r_km=10.0):
+    return indice.conta_entro(np.column_stack([lat, lon]), r_km)
+
+
+def esegui(nome_backend=BACKEND, eps=EPS, min_samples=MIN_SAMPLES, quota_outlier_max=QUOTA_OUTLIER_MAX,
+           max_clienti_zona=MAX_CLIENTI_ZONA, raggio_max_km=RAGGIO_MAX_KM,
+           campione_silhouette=CAMPIONE_SILHOUETTE, n_processi=N_PROCESSI, mappa=True,
+           incrementale=INCREMENTALE, soglia_drift=SOGLIA_DRIFT):
+    """
+    Clustering dei clienti geocodificati in zone di consegna, sottoclusterizzazione delle zone
+    troppo grandi e riassegnazione degli outlier. Restituisce il DataFrame dei clienti con i cluster.
+    Con incrementale=True si aggiornano le zone salvate, se il drift accumulato resta sotto soglia_drift.
+    """
+    if incrementale:
+        with misura('clustering_incrementale'):
+            df_finale = aggiorna_da_artefatti(soglia_drift)
+        if df_finale is not None:
+            return df_finale
+
+    # Caricamento dati e preparazione coordinate
+    df = leggi_artefatto("clienti_validi_geocodificati.csv")
+    coordinates = df[['latitudine', 'longitudine']]
+
+    # Clustering con il backend scelto; eps (se None) è scelto dal gomito della curva k-distance
+    parametri = {'min_samples': min_samples, 'quota_outlier_max': quota_outlier_max}
+    if eps is not None:
+        parametri['eps' if nome_backend == 'dbscan_standardizzato' else 'eps_km'] = eps
+    with misura('backend'):
+        backend = crea_backend(nome_backend, **parametri).fit(coordinates.values)
+    df['cluster'] = backend.labels_
+    labels = backend.labels_
+    punti = backend.spazio(coordinates.values)
+    unita = " km" if backend.metrica == 'haversine' else ""
+    print(f"Backend {nome_backend}, eps: {backend.eps:.3f}{unita}")
+
+    if backend.curva is not None:
+        plt.figure(figsize=(8, 4))
+        plt.plot(backend.curva)
+        plt.axhline(backend.eps, color='red', linestyle='--', label=f"eps = {backend.eps:.3f}{unita}")
+        plt.xlabel("Punti ordinati")
+        plt.ylabel(f"Distanza al {min_samples}° vicino{unita}")
+        plt.title(f"Curva k-distance (min_samples = {min_samples})")
+        plt.legend()
+        plt.grid(True)
+        plt.savefig("kDistance.png")
+        plt.close()
+
+    # Silhouette Score (su un campione) escludendo gli outlier
     mask = labels != -1
-    score = silhouette_score(scaled[mask], labels[mask])
-    print(f"Silhouette Score: {score:.3f}")
-else:
-    print("Silhouette Score non calcolabile")
-
-# Distribuzione dei clienti in ciascun cluster
-print(df['cluster'].value_counts())
-
-# Funzione per calcolo della densità locale (raggio: 10 km)
-def local_density(lat, lon, data, r_km=10.0):
-    from geopy.distance import geodesic
-    return sum(
-        geodesic((lat, lon), (r['latitudine'], r['longitudine'])).km <= r_km
-        for _, r in data.iterrows()
-    )
-
-# Calcolo densità locale per i punti identificati come outlier da DBSCAN
-outliers = df[df['cluster'] == -1].copy()
-outliers['local_density'] = outliers.apply(
-    lambda r: local_density(r['latitudine'], r['longitudine'], df), axis=1
-)
-
-# Sottoclusterizzazione del cluster 0 con KMeans (4 gruppi)
-cluster0_df = df[df['cluster'] == 0].copy()
-coords0 = cluster0_df[['latitudine', 'longitudine']].values
-coords0_scaled = StandardScaler().fit_transform(coords0)
-kmeans0 = KMeans(n_clusters=4, random_state=42).fit(coords0_scaled)
-cluster0_df['subcluster'] = kmeans0.labels_
-
-# Sottoclusterizzazione del cluster 1 con KMeans (4 gruppi)
-cluster1_df = df[df['cluster'] == 1].copy()
-coords1 = cluster1_df[['latitudine', 'longitudine']].values
-coords1_scaled = StandardScaler().fit_transform(coords1)
-kmeans1 = KMeans(n_clusters=4, random_state=42).fit(coords1_scaled)
-cluster1_df['subcluster'] = kmeans1.labels_
-
-# Composizione finale dei cluster
-cluster0_df['cluster_finale'] = '0_' + cluster0_df['subcluster'].astype(str)
-cluster1_df['cluster_finale'] = '1_' + cluster1_df['subcluster'].astype(str)
-rest_df = df[df['cluster'].isin([2, 3])].copy()
-rest_df['cluster_finale'] = rest_df['cluster'].astype(str)
-outlier_df = df[df['cluster'] == -1].copy()
-outlier_df['cluster_finale'] = 'outlier'
-
-# Unione di tutti i dataframe in uno unico finale
-df_finale = pd.concat([cluster0_df, cluster1_df, rest_df, outlier_df], ignore_index=True)
-
-# Riassegnazione condizionata degli outlier
-core_pts = scaled[labels != -1]
-core_lbl = labels[labels != -1]
-outlier_pts = scaled[labels == -1]
-
-# Calcolo del cluster più vicino per ogni outlier
-nearest_cluster, distances = pairwise_distances_argmin_min(outlier_pts, core_pts)
-assigned = core_lbl[nearest_cluster]
-
-# Condizioni per riassegnazione: vicino + sufficiente densità locale
-density_thresh = 3
-distance_thresh = 0.35
-out_idx = outliers.index
-reassign_mask = (distances < distance_thresh) & (outliers['local_density'] >= density_thresh)
-
-# Applicazione della riassegnazione
-df_finale['cluster_riparato'] = df_finale['cluster']
-df_finale['riassegnato'] = False
-df_finale.loc[out_idx[reassign_mask], 'cluster_riparato'] = assigned[reassign_mask.values]
-df_finale.loc[out_idx[reassign_mask], 'riassegnato'] = True
-
-print(f"\nOutlier riassegnati: {reassign_mask.sum()} su {len(outliers)}")
-
-# Visualizzazione su mappa interattiva con Folium
-map_center = [df_finale['latitudine'].mean(), df_finale['longitudine'].mean()]
-m = folium.Map(location=map_center, zoom_start=10)
-mc = MarkerCluster().add_to(m)
-
-# Preparazione dei colori per ogni cluster riparato
-n_clusters = df_finale[df_finale['cluster_riparato'] != -1]['cluster_riparato'].nunique()
-cmap = cm.get_cmap('Set1', n_clusters)
-cluster_labels = sorted(df_finale[df_finale['cluster_riparato'] != -1]['cluster_riparato'].unique())
-cluster_colors = {label: colors.to_hex(cmap(i)) for i, label in enumerate(cluster_labels)}
-
-# Aggiunta dei marker alla mappa
-for _, r in df_finale.iterrows():
-    if r['cluster_riparato'] != -1:
-        col = cluster_colors[r['cluster_riparato']]
-        folium.CircleMarker(
-            location=[r['latitudine'], r['longitudine']],
-            radius=5,
-            color=col,
-            fill=True,
-            fill_color=col,
-            fill_opacity=0.9,
-            popup=f"Cliente {r['Codice Cliente']}, Cluster {r['cluster_riparato']}"
-        ).add_to(mc)
+    score = silhouette_campionata(punti[mask], labels[mask], campione_silhouette, metrica=backend.metrica)
+    if np.isnan(score):
+        print("Silhouette Score non calcolabile")
     else:
-        folium.Marker(
-            location=[r['latitudine'], r['longitudine']],
-            popup=f"Cliente {r['Codice Cliente']} (Outlier)",
-            icon=folium.Icon(color='red')
-        ).add_to(m)
-
-
-# Esportazione dei risultati
-m.save("clienti_clusters_outliers.html")
-df_finale.to_csv("clienti_con_cluster_riparato.csv", index=False)
-
-print(df_finale['cluster'].value_counts())
-
+        print(f"Silhouette Score: {score:.3f}")
+
+    # Distribuzione dei clienti in ciascun cluster
+    print(df['cluster'].value_counts())
+
+    # Indice spaziale (BallTree haversine) su tutti i clienti, costruito una sola volta
+    indice_clienti = IndiceSpaziale(coordinates.values, metrica='haversine')
+
+    # Calcolo densità locale per i punti identificati come outlier da DBSCAN
+    outliers = df[df['cluster'] == -1].copy()
+    with misura('densita_locale'):
+        outliers['local_density'] = local_density(outliers['latitudine'], outliers['longitudine'], indice_clienti)
+
+    # Sottoclusterizzazione con KMeans dei cluster troppo grandi o estesi:
+    # il numero di gruppi è scelto per ogni cluster tra più candidati valutati in parallelo
+    with misura('sottocluster'):
+        sottocluster, valutazioni = scegli_sottocluster(
+            coordinates.values, labels, max_clienti_zona=max_clienti_zona, raggio_max_km=raggio_max_km,
+            campione=campione_silhouette, n_processi=n_processi)
+    for v in valutazioni:
+        print(f"Cluster {v['cluster']}, k={v['k']}: silhouette {v['silhouette']:.3f}, "
+              f"max clienti {v['max_clienti']}, raggio max {v['max_raggio_km']:.1f} km")
+
+    df['subcluster'] = np.nan
+    parti = []
+    for cluster, (scaler_sub, kmeans) in sottocluster.items():
+        cluster_df = df[df['cluster'] == cluster].copy()
+        cluster_df['subcluster'] = kmeans.predict(scaler_sub.transform(cluster_df[['latitudine', 'longitudine']].values))
+        cluster_df['cluster_finale'] = f"{cluster}_" + cluster_df['subcluster'].astype(str)
+        print(f"Cluster {cluster} suddiviso in {kmeans.n_clusters} sottocluster")
+        parti.append(cluster_df)
+
+    # Cluster non suddivisi e outlier
+    rest_df = df[(df['cluster'] != -1) & ~df['cluster'].isin(list(sottocluster))].copy()
+    rest_df['cluster_finale'] = rest_df['cluster'].astype(str)
+    outlier_df = df[df['cluster'] == -1].copy()
+    outlier_df['cluster_finale'] = 'outlier'
+
+    # Unione di tutti i dataframe in uno unico finale
+    df_finale = pd.concat(parti + [rest_df, outlier_df], ignore_index=True)
+
+    # Riassegnazione condizionata degli outlier
+    core_pts = punti[labels != -1]
+    core_lbl = labels[labels != -1]
+    outlier_pts = punti[labels == -1]
+
+    # Calcolo del cluster più vicino per ogni outlier (indice sui punti clusterizzati, nello spazio del backend)
+    indice_core = IndiceSpaziale(core_pts, metrica=backend.metrica)
+    nearest_cluster, distances = indice_core.piu_vicino(outlier_pts)
+    assigned = core_lbl[nearest_cluster]
+
+    # Condizioni per riassegnazione: vicino + sufficiente densità locale
+    density_thresh = 3
+    distance_thresh = backend.distanza_riparazione  # unità dello spazio del backend (km per haversine)
+    out_idx = outliers.index
+    reassign_mask = (distances < distance_thresh) & (outliers['local_density'] >= density_thresh)
+
+    # Applicazione della riassegnazione
+    df_finale['cluster_riparato'] = df_finale['cluster']
+    df_finale['riassegnato'] = False
+    df_finale.loc[out_idx[reassign_mask], 'cluster_riparato'] = assigned[reassign_mask.values]
+    df_finale.loc[out_idx[reassign_mask], 'riassegnato'] = True
+
+    print(f"\nOutlier riassegnati: {reassign_mask.sum()} su {len(outliers)}")
+
+    # Salvataggio dello stato del clustering per gli aggiornamenti incrementali (clustering_incrementale.py)
+    salva_stato(crea_stato(df, backend, sottocluster,
+                           distance_thresh=distance_thresh, density_thresh=density_thresh))
+
+    # Visualizzazione su mappa interattiva (un unico layer FastMarkerCluster), saltata con --senza-mappa
+    if mappa:
+        from mappa import crea_mappa_clienti, salva_mappa
+        salva_mappa(crea_mappa_clienti(df_finale, colonna_cluster='cluster_riparato'), "clienti_clusters_outliers.html")
+
+    # Esportazione dei risultati
+    scrivi_artefatto(df_finale, "clienti_con_cluster_riparato.csv")
+
+    print(df_finale['cluster'].value_counts())
+    return df_finale
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Clustering dei clienti in zone di consegna")
+    parser.add_argument("--senza-mappa", action="store_true", help="non genera la mappa HTML (esecuzioni batch)")
+    parser.add_argument("--incrementale", action="store_true",
+                        help="aggiorna le zone salvate invece di ricalcolarle (se il drift è sotto soglia)")
+    parser.add_argument("--soglia-drift", type=float, default=SOGLIA_DRIFT)
+    args = parser.parse_args()
+    esegui(mappa=not args.senza_mappa, incrementale=args.incrementale, soglia_drift=args.soglia_drift)
@@ -0,0 +1,236 @@
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from indice_spaziale import IndiceSpaziale
+
+# Clustering incrementale: lo stato del clustering completo (backend con i punti core,
+# centroidi KMeans dei sottocluster, parametri di riparazione degli outlier) viene salvato su disco.
+# I clienti nuovi o spostati sono assegnati alle zone esistenti con una ricerca del punto core
+# più vicino; i clienti invariati mantengono la zona precedente (ID stabili).
+# Dopo ogni aggiornamento lo stato viene salvato di nuovo (clienti, punti clusterizzati, centroidi
+# e conteggi dei sottocluster) e il drift si accumula dall'ultimo clustering completo:
+# il ricalcolo completo serve solo quando il drift accumulato supera la soglia.
+
+PERCORSO_STATO = "stato_clustering.joblib"
+VERSIONE_STATO = 3
+SOGLIA_DRIFT = 0.2
+
+# Spostamento minimo (gradi) perché un cliente sia considerato "spostato"
+TOLLERANZA_SPOSTAMENTO = 1e-6
+
+
+def crea_stato(df, backend, sottocluster, distance_thresh=0.35, density_thresh=3, r_km=10.0):
+    """
+    Raccoglie lo stato del clustering completo.
+    backend: backend di clustering già addestrato (backend_clustering.py).
+    sottocluster: dizionario cluster -> (scaler, KMeans) dei cluster suddivisi.
+    distance_thresh è espressa nello spazio del backend (km per i backend haversine).
+    """
+    punti = backend.spazio(df[['latitudine', 'longitudine']].values)
+    labels = backend.labels_
+    core = backend.core_sample_indices_
+    return {
+        'versione': VERSIONE_STATO,
+        'creato': time.time(),
+        'backend': backend,
+        'metrica': backend.metrica,
+        'eps': backend.eps,
+        'core_punti': punti[core],
+        'core_etichette': labels[core],
+        'clusterizzati_punti': punti[labels != -1],
+        'clusterizzati_etichette': labels[labels != -1],
+        'clusterizzati_codici': df['Codice Cliente'].values[labels != -1],
+        'sottocluster': sottocluster,
+        'conteggi_sottocluster': {c: np.bincount(kmeans.labels_, minlength=kmeans.n_clusters).astype(float)
+                                  for c, (_, kmeans) in sottocluster.items()},
+        'riparazione': {'distance_thresh': distance_thresh, 'density_thresh': density_thresh, 'r_km': r_km},
+        'clienti': df[['Codice Cliente', 'latitudine', 'longitudine']].reset_index(drop=True),
+        'quota_outlier': float(np.mean(labels == -1)),
+        'drift': 0.0,
+        'aggiornamenti': 0,
+    }
+
+
+def salva_stato(stato, percorso=PERCORSO_STATO):
+    joblib.dump(stato, percorso)
+
+
+def carica_stato(percorso=PERCORSO_STATO):
+    stato = joblib.load(percorso)
+    if stato.get('versione') != VERSIONE_STATO:
+        raise ValueError(f"Versione dello stato di clustering non supportata: {stato.get('versione')}")
+    return stato
+
+
+def confronta_clienti(stato, df_clienti):
+    # Clienti aggiunti, spostati (coordinate cambiate) e rimossi rispetto al clustering salvato
+    prima = stato['clienti'].set_index('Codice Cliente')
+    adesso = df_clienti.set_index('Codice Cliente')[['latitudine', 'longitudine']]
+    comuni = adesso.index.intersection(prima.index)
+    delta = (adesso.loc[comuni] - prima.loc[comuni]).abs().max(axis=1)
+    return {
+        'aggiunti': adesso.index.difference(prima.index),
+        'spostati': comuni[(delta > TOLLERANZA_SPOSTAMENTO).values],
+        'rimossi': prima.index.difference(adesso.index),
+    }
+
+
+def assegna_clienti(stato, df_nuovi, df_tutti):
+    """
+    Assegna i clienti di df_nuovi alle zone esistenti:
+    - cluster del punto core più vicino se entro eps, altrimenti outlier (-1);
+    - sottocluster con il KMeans salvato per i cluster suddivisi;
+    - riparazione degli outlier vicini a un cluster e con sufficiente densità locale (calcolata su df_tutti).
+    """
+    df = df_nuovi.copy()
+    if df.empty:
+        return df.assign(cluster=pd.Series(dtype=int), subcluster=np.nan, cluster_finale=pd.Series(dtype=object),
+                         cluster_riparato=pd.Series(dtype=int), riassegnato=pd.Series(dtype=bool))
+    coordinate = df[['latitudine', 'longitudine']].values
+    punti = stato['backend'].spazio(coordinate)
+
+    idx, dist = IndiceSpaziale(stato['core_punti'], metrica=stato['metrica']).piu_vicino(punti)
+    df['cluster'] = np.where(dist <= stato['eps'], stato['core_etichette'][idx], -1)
+
+    df['subcluster'] = np.nan
+    df['cluster_finale'] = np.where(df['cluster'] == -1, 'outlier', df['cluster'].astype(str))
+    for cluster, (scaler_sub, kmeans) in stato['sottocluster'].items():
+        mask = (df['cluster'] == cluster).values
+        if mask.any():
+            sub = kmeans.predict(scaler_sub.transform(coordinate[mask]))
+            df.loc[mask, 'subcluster'] = sub
+            df.loc[mask, 'cluster_finale'] = [f"{cluster}_{s}" for s in sub]
+
+    # Riparazione degli outlier, con le stesse soglie del clustering completo
+    riparazione = stato['riparazione']
+    df['cluster_riparato'] = df['cluster']
+    df['riassegnato'] = False
+    outlier = (df['cluster'] == -1).values
+    if outlier.any():
+        idx, dist = IndiceSpaziale(stato['clusterizzati_punti'], metrica=stato['metrica']).piu_vicino(punti[outlier])
+        densita = IndiceSpaziale(df_tutti[['latitudine', 'longitudine']].values).conta_entro(
+            coordinate[outlier], riparazione['r_km'])
+        riassegna = (dist < riparazione['distance_thresh']) & (densita >= riparazione['density_thresh'])
+        righe = df.index[outlier][riassegna]
+        df.loc[righe, 'cluster_riparato'] = stato['clusterizzati_etichette'][idx][riassegna]
+        df.loc[righe, 'riassegnato'] = True
+    return df
+
+
+def metrica_drift(stato, variazioni, df_assegnati):
+    """
+    Drift = quota di clienti aggiunti/spostati/rimossi rispetto al clustering salvato
+          + aumento della quota di outlier tra i clienti assegnati incrementalmente.
+    """
+    n_riferimento = max(len(stato['clienti']), 1)
+    cambiati = len(variazioni['aggiunti']) + len(variazioni['spostati']) + len(variazioni['rimossi'])
+    quota_outlier = float(np.mean(df_assegnati['cluster'] == -1)) if len(df_assegnati) else 0.0
+    return cambiati / n_riferimento + max(0.0, quota_outlier - stato['quota_outlier'])
+
+
+def _sposta_centroidi(stato, df, segno):
+    # Aggiunge (segno=1) o toglie (segno=-1) i clienti di df dalle medie dei loro sottocluster
+    for cluster, (scaler_sub, kmeans) in stato['sottocluster'].items():
+        righe = ((df['cluster'] == cluster) & df['subcluster'].notna()).values
+        if not righe.any():
+            continue
+        x = scaler_sub.transform(df[['latitudine', 'longitudine']].values[righe])
+        sub = df['subcluster'].values[righe].astype(int)
+        conteggi = stato['conteggi_sottocluster'][cluster]
+        somme = np.zeros_like(kmeans.cluster_centers_)
+        np.add.at(somme, sub, x)
+        nuovi = conteggi + segno * np.bincount(sub, minlength=len(conteggi))
+        validi = nuovi > 0
+        centri = kmeans.cluster_centers_ * conteggi[:, None] + segno * somme
+        kmeans.cluster_centers_[validi] = centri[validi] / nuovi[validi, None]
+        conteggi[:] = np.maximum(nuovi, 0)
+
+
+def aggiorna_stato(stato, df_clienti, df_precedente, variazioni, assegnati, drift):
+    """
+    Stato dopo un aggiornamento incrementale: fotografia dei clienti, punti clusterizzati
+    (senza i clienti rimossi o spostati, con quelli assegnati a un cluster), centroidi dei sottocluster
+    aggiornati come medie pesate dai conteggi e drift accumulato dall'ultimo clustering completo.
+    """
+    usciti = variazioni['rimossi'].union(variazioni['spostati'])
+
+    # Clienti usciti tolti dai centroidi, con le coordinate e il sottocluster dello stato precedente
+    precedenti = stato['clienti'][stato['clienti']['Codice Cliente'].isin(usciti)]
+    precedenti = precedenti.merge(df_precedente[['Codice Cliente', 'cluster', 'subcluster']], on='Codice Cliente')
+    _sposta_centroidi(stato, precedenti, -1)
+    _sposta_centroidi(stato, assegnati, 1)
+
+    tieni = ~np.isin(stato['clusterizzati_codici'], usciti)
+    nel_cluster = (assegnati['cluster'] != -1).values
+    punti = stato['backend'].spazio(assegnati[['latitudine', 'longitudine']].values[nel_cluster])
+    stato['clusterizzati_punti'] = np.concatenate([stato['clusterizzati_punti'][tieni], punti])
+    stato['clusterizzati_etichette'] = np.concatenate([stato['clusterizzati_etichette'][tieni],
+                                                       assegnati['cluster'].values[nel_cluster]])
+    stato['clusterizzati_codici'] = np.concatenate([stato['clusterizzati_codici'][tieni],
+                                                    assegnati['Codice Cliente'].values[nel_cluster]])
+    stato['clienti'] = df_clienti[['Codice Cliente', 'latitudine', 'longitudine']].reset_index(drop=True)
+    stato['drift'] += drift
+    stato['aggiornamenti'] += 1
+    stato['aggiornato'] = time.time()
+    return stato
+
+
+def aggiorna_clustering(df_clienti, df_precedente, stato, soglia_drift=SOGLIA_DRIFT):
+    """
+    Aggiornamento incrementale del file dei cluster e dello stato.
+    Restituisce (df_finale, drift, ricalcolo_necessario, stato): drift è accumulato dall'ultimo
+    clustering completo; se supera la soglia il chiamante deve eseguire il clustering completo.
+    """
+    variazioni = confronta_clienti(stato, df_clienti)
+    da_assegnare = variazioni['aggiunti'].union(variazioni['spostati'])
+
+    nuovi = df_clienti[df_clienti['Codice Cliente'].isin(da_assegnare)]
+    assegnati = assegna_clienti(stato, nuovi, df_clienti)
+    drift = stato['drift'] + metrica_drift(stato, variazioni, assegnati)
+
+    # I clienti invariati mantengono le etichette precedenti; i dati anagrafici vengono aggiornati
+    invariati = df_precedente[~df_precedente['Codice Cliente'].isin(da_assegnare.union(variazioni['rimossi']))]
+    colonne_cluster = ['Codice Cliente', 'cluster', 'subcluster', 'cluster_finale', 'cluster_riparato', 'riassegnato']
+    invariati = df_clienti.merge(invariati[colonne_cluster], on='Codice Cliente', how='inner')
+
+    df_finale = pd.concat([invariati, assegnati], ignore_index=True)
+    if drift > soglia_drift:
+        return df_finale, drift, True, stato
+    stato = aggiorna_stato(stato, df_clienti, df_precedente, variazioni, assegnati, drift - stato['drift'])
+    return df_finale, drift, False, stato
+
+
+def aggiorna_da_artefatti(soglia_drift=SOGLIA_DRIFT, percorso_stato=PERCORSO_STATO):
+    """
+    Aggiornamento incrementale da clienti_validi_geocodificati.csv: scrive il file dei cluster
+    e lo stato aggiornati e restituisce il DataFrame dei clienti con i cluster, oppure None
+    se lo stato non è disponibile o il drift accumulato richiede il clustering completo.
+    """
+    from artefatti import leggi_artefatto, scrivi_artefatto
+
+    df_clienti = leggi_artefatto("clienti_validi_geocodificati.csv")
+    try:
+        stato = carica_stato(percorso_stato)
+        df_precedente = leggi_artefatto("clienti_con_cluster_riparato.csv")
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Stato del clustering non disponibile ({e}): ricalcolo completo")
+        return None
+    df_finale, drift, ricalcolo = aggiorna_clustering(df_clienti, df_precedente, stato, soglia_drift)[:3]
+    print(f"Drift dall'ultimo clustering completo: {drift:.3f} (soglia {soglia_drift})")
+    if ricalcolo:
+        print("Soglia di drift superata: ricalcolo completo del clustering")
+        return None
+    salva_stato(stato, percorso_stato)
+    scrivi_artefatto(df_finale, "clienti_con_cluster_riparato.csv")
+    print(f"Clusterizzazione aggiornata incrementalmente per {len(df_finale)} clienti")
+    return df_finale
+
+
+if __name__ == "__main__":
+    from clustering import esegui as clustering_completo
+
+    if aggiorna_da_artefatti() is None:
+        clustering_completo()
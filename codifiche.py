@@ -0,0 +1,61 @@
+import numpy as np
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.feature_extraction import FeatureHasher
+from sklearn.model_selection import KFold
+from sklearn.preprocessing import OneHotEncoder, TargetEncoder
+
+# Codifiche compatte delle feature categoriche ad alta cardinalità (Ragione sociale, Via, Localita).
+# Con il one-hot la matrice delle feature ha una colonna per ogni valore distinto e cresce con
+# l'anagrafica clienti; frequenza e target producono una colonna per feature, l'hash un numero fisso di colonne.
+
+N_FEATURE_HASH = 2 ** 12
+
+
+class CodificaFrequenza(BaseEstimator, TransformerMixin):
+    """
+    Sostituisce ogni valore con la sua frequenza relativa nei dati di addestramento (0 se mai visto).
+    """
+
+    def fit(self, X, y=None):
+        self.frequenze_ = {c: X[c].value_counts(normalize=True) for c in X.columns}
+        return self
+
+    def transform(self, X):
+        return np.column_stack([X[c].map(frequenze).astype(float).fillna(0.0).to_numpy()
+                                for c, frequenze in self.frequenze_.items()])
+
+
+class CodificaHash(BaseEstimator, TransformerMixin):
+    """
+    Hashing delle coppie "colonna=valore" su n_features colonne (matrice sparsa):
+    non richiede addestramento e la dimensione non dipende dal numero di clienti.
+    """
+
+    def __init__(self, n_features=N_FEATURE_HASH):
+        self.n_features = n_features
+
+    def fit(self, X, y=None):
+        self.colonne_ = list(X.columns)
+        return self
+
+    def transform(self, X):
+        token = np.column_stack([(c + '=' + X[c].astype(str)).to_numpy() for c in self.colonne_])
+        hasher = FeatureHasher(n_features=self.n_features, input_type='string', alternate_sign=False)
+        return hasher.transform(token)
+
+
+# Codifiche con output denso, utilizzabili anche da HistGradientBoosting
+CODIFICHE_DENSE = {'frequenza', 'target'}
+
+
+def crea_codifica(nome):
+    if nome == 'onehot':
+        return OneHotEncoder(handle_unknown='ignore')
+    if nome == 'frequenza':
+        return CodificaFrequenza()
+    if nome == 'target':
+        # Media del target per valore, stimata con cross-fitting per non sovrastimare i clienti con poche consegne
+        return TargetEncoder(target_type='continuous', cv=KFold(5, shuffle=True, random_state=42))
+    if nome == 'hash':
+        return CodificaHash()
+    raise ValueError(f"Codifica delle feature categoriche non supportata: {nome}")
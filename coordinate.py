@@ -0,0 +1,59 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# Conversione e validazione vettoriale di coordinate GPS e indirizzi:
+# tutte le funzioni lavorano su intere colonne (Series) con i metodi .str di pandas
+# e l'aritmetica NumPy, senza apply riga per riga.
+
+# Coordinata in formato DMS, es. "40°31'18.01''N" o "15°4'34.58''E"
+PATTERN_DMS = re.compile(r"^(\d+)°(\d+)'([\d\.]+)''([NSEW])")
+# Stringa GPS con latitudine e longitudine separate da spazi
+PATTERN_GPS = re.compile(r"^\s*(\S+)(?:\s+(\S+))?")
+
+# Intervallo geografico approssimato per l'Italia
+LAT_MIN, LAT_MAX = 36.0, 47.0
+LON_MIN, LON_MAX = 6.0, 18.0
+
+
+def dms_to_decimal(serie):
+    """
+    Converte una colonna di stringhe DMS in gradi decimali (NaN se il formato non è valido).
+    """
+    parti = serie.astype("string").str.strip().str.extract(PATTERN_DMS)
+    gradi = pd.to_numeric(parti[0], errors='coerce').to_numpy(dtype=float)
+    minuti = pd.to_numeric(parti[1], errors='coerce').to_numpy(dtype=float)
+    secondi = pd.to_numeric(parti[2], errors='coerce').to_numpy(dtype=float)
+    segno = np.where(parti[3].isin(['S', 'W']).to_numpy(), -1.0, 1.0)
+    return pd.Series(segno * (gradi + minuti / 60 + secondi / 3600), index=serie.index)
+
+
+def coordinate_da_gps(gps):
+    # Divide la colonna GPS ("lat lon" in DMS) e converte entrambe le parti in decimali
+    parti = gps.astype("string").str.extract(PATTERN_GPS)
+    return pd.DataFrame({
+        'latitudine': dms_to_decimal(parti[0]),
+        'longitudine': dms_to_decimal(parti[1]),
+    }, index=gps.index)
+
+
+def coordinate_valide(lat, lon):
+    # Maschera booleana: coordinate presenti e all'interno dei confini approssimati dell'Italia
+    lat = pd.to_numeric(lat, errors='coerce')
+    lon = pd.to_numeric(lon, errors='coerce')
+    return lat.between(LAT_MIN, LAT_MAX) & lon.between(LON_MIN, LON_MAX)
+
+
+def normalizza_indirizzo(via):
+    # Maiuscolo, espansione delle abbreviazioni più comuni e rimozione dei simboli
+    via = via.astype("string").str.upper()
+    via = via.str.replace("C/DA", "CONTRADA", regex=False).str.replace("S.S.", "STRADA STATALE", regex=False)
+    via = via.str.replace(r"[^A-Z0-9\s]", " ", regex=True)  # rimuove simboli strani
+    return via.str.strip().astype(object).where(via.notna(), np.nan)
+
+
+def estrai_localita_pulita(localita):
+    # Rimuove il CAP iniziale: "85100 POTENZA PZ" -> "POTENZA PZ"
+    estratta = localita.astype("string").str.extract(r'\d+\s+(.*)')[0]
+    return estratta.fillna(localita.astype("string")).astype(object).where(localita.notna(), np.nan)
@@ -0,0 +1,311 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from strumentazione import misura
+
+# Ingestione condivisa dell'estrazione delle consegne. Il file Excel viene letto una sola volta,
+# a blocchi di righe (openpyxl in sola lettura, senza caricare il foglio in memoria), e convertito
+# in una cache colonnare Parquet con tipi fissati: nomi delle colonne già puliti, Data come timestamp,
+# colonne testuali ripetute (ragione sociale, via, località, GPS) con dizionario, cioè categoriche
+# in pandas. Le righe sono ordinate per (Codice Cliente, Data) una sola volta.
+# Le nuove consegne si aggiungono in nuove parti (append-only) senza riscrivere la cache;
+# regression_final.py e fase_preclustring.py leggono da qui, in memory-map e solo le colonne necessarie.
+
+PERCORSO_ESTRAZIONE = "estrazione per minervas REV01.xlsx"
+CARTELLA_ESTRAZIONE = "estrazione_colonnare"
+MANIFESTO = "manifesto.json"
+RIGHE_PER_BLOCCO = 50_000
+
+# Colonne testuali salvate con dizionario (categoriche in lettura)
+COLONNE_CATEGORICHE = ['Ragione sociale', 'Via', 'Localita', 'GPS']
+CHIAVE_ORDINAMENTO = ['Codice Cliente', 'Data']
+
+
+def normalizza_colonne(colonne):
+    # Stessa pulizia dei nomi usata in precedenza dagli script ("Quantità [litri]" -> "Quantita [litri]")
+    return pd.Index(colonne).astype(str).str.strip().str.replace("'", "").str.replace("à", "a")
+
+
+def _ordinata(df):
+    # True se le righe sono già in ordine di (Codice Cliente, Data)
+    codici = df['Codice Cliente'].to_numpy()
+    date = df['Data'].to_numpy()
+    if len(df) < 2:
+        return True
+    try:
+        passo_codice = codici[1:] > codici[:-1]
+        stesso_codice = codici[1:] == codici[:-1]
+    except TypeError:
+        return False
+    return bool(np.all(passo_codice | (stesso_codice & (date[1:] >= date[:-1]))))
+
+
+def normalizza_estrazione(df):
+    """
+    Nomi delle colonne puliti, Data come datetime (giorno prima del mese) e righe ordinate
+    per cliente e data. Idempotente: i passi già fatti (ad es. dalla cache) vengono saltati.
+    """
+    df = df.rename(columns=dict(zip(df.columns, normalizza_colonne(df.columns))))
+    if not pd.api.types.is_datetime64_any_dtype(df['Data']):
+        df['Data'] = pd.to_datetime(df['Data'], dayfirst=True)
+    if not _ordinata(df):
+        df = df.sort_values(CHIAVE_ORDINAMENTO)
+    return df
+
+
+def leggi_blocchi_sorgente(percorso, righe_per_blocco=RIGHE_PER_BLOCCO):
+    """
+    Legge l'estrazione a blocchi di righe (DataFrame con i nomi delle colonne originali).
+    Excel in sola lettura con openpyxl; sono accettati anche CSV e Parquet.
+    """
+    estensione = os.path.splitext(percorso)[1].lower()
+    if estensione == '.csv':
+        yield from pd.read_csv(percorso, chunksize=righe_per_blocco)
+        return
+    if estensione == '.parquet':
+        for batch in pq.ParquetFile(percorso).iter_batches(batch_size=righe_per_blocco):
+            yield batch.to_pandas()
+        return
+
+    from openpyxl import load_workbook
+    libro = load_workbook(percorso, read_only=True, data_only=True)
+    try:
+        righe = libro.active.iter_rows(values_only=True)
+        intestazione = list(next(righe))
+        blocco = []
+        for riga in righe:
+            if all(v is None for v in riga):
+                continue
+            blocco.append(riga)
+            if len(blocco) == righe_per_blocco:
+                yield pd.DataFrame(blocco, columns=intestazione)
+                blocco = []
+        if blocco:
+            yield pd.DataFrame(blocco, columns=intestazione)
+    finally:
+        libro.close()
+
+
+def _schema(blocco):
+    # Tipi fissati dal primo blocco: Data timestamp, colonne categoriche con dizionario, colonne vuote come testo
+    campi = []
+    for campo in pa.Schema.from_pandas(blocco, preserve_index=False):
+        if campo.name == 'Data':
+            campo = pa.field('Data', pa.timestamp('ns'))
+        elif campo.name in COLONNE_CATEGORICHE:
+            campo = pa.field(campo.name, pa.dictionary(pa.int32(), pa.string()))
+        elif pa.types.is_null(campo.type):
+            campo = pa.field(campo.name, pa.string())
+        campi.append(campo)
+    return pa.schema(campi)
+
+
+def _tabella(blocco, schema):
+    blocco = blocco.rename(columns=dict(zip(blocco.columns, normalizza_colonne(blocco.columns))))
+    if not pd.api.types.is_datetime64_any_dtype(blocco['Data']):
+        blocco['Data'] = pd.to_datetime(blocco['Data'], dayfirst=True)
+    for campo in schema:
+        if pa.types.is_string(campo.type) or pa.types.is_dictionary(campo.type):
+            blocco[campo.name] = blocco[campo.name].astype('string')
+    return pa.Table.from_pandas(blocco[schema.names], schema=schema, preserve_index=False)
+
+
+def _leggi_manifesto(cartella):
+    percorso = os.path.join(cartella, MANIFESTO)
+    if not os.path.exists(percorso):
+        return None
+    with open(percorso, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _scrivi_manifesto(cartella, manifesto):
+    temporaneo = os.path.join(cartella, MANIFESTO + ".tmp")
+    with open(temporaneo, 'w', encoding='utf-8') as f:
+        json.dump(manifesto, f, indent=2, ensure_ascii=False)
+    os.replace(temporaneo, os.path.join(cartella, MANIFESTO))
+
+
+def _impronta_sorgente(percorso):
+    stato = os.stat(percorso)
+    return {'percorso': os.path.abspath(percorso), 'dimensione': stato.st_size, 'modificato': stato.st_mtime}
+
+
+def _data_massima(colonna):
+    # Data massima di una colonna Arrow, come testo ISO (None se vuota)
+    valore = pc.max(colonna).as_py()
+    return str(pd.Timestamp(valore)) if valore is not None else None
+
+
+def converti_estrazione(percorso=PERCORSO_ESTRAZIONE, cartella=CARTELLA_ESTRAZIONE, righe_per_blocco=RIGHE_PER_BLOCCO):
+    """
+    Conversione completa dell'estrazione nella cache colonnare: i blocchi letti dalla sorgente
+    vengono scritti come row group Parquet, poi la tabella tipizzata (compatta) viene ordinata una volta.
+    Restituisce il manifesto della cache.
+    """
+    os.makedirs(cartella, exist_ok=True)
+    parte = os.path.join(cartella, "parte-00000.parquet")
+    temporaneo = parte + ".tmp"
+    scrittore = None
+    schema = None
+    try:
+        for blocco in leggi_blocchi_sorgente(percorso, righe_per_blocco):
+            if schema is None:
+                schema = _schema(blocco.rename(columns=dict(zip(blocco.columns, normalizza_colonne(blocco.columns)))))
+                scrittore = pq.ParquetWriter(temporaneo, schema)
+            scrittore.write_table(_tabella(blocco, schema), row_group_size=righe_per_blocco)
+    finally:
+        if scrittore is not None:
+            scrittore.close()
+    if schema is None:
+        raise ValueError(f"Estrazione vuota: {percorso}")
+
+    # Ordinamento stabile per cliente e data sulla tabella già tipizzata
+    tabella = pq.read_table(temporaneo, memory_map=True)
+    tabella = tabella.sort_by([(c, 'ascending') for c in CHIAVE_ORDINAMENTO])
+    pq.write_table(tabella, parte, row_group_size=righe_per_blocco)
+    os.remove(temporaneo)
+
+    for vecchia in (_leggi_manifesto(cartella) or {}).get('parti', []):
+        if vecchia != os.path.basename(parte):
+            os.remove(os.path.join(cartella, vecchia))
+    manifesto = {
+        'sorgente': _impronta_sorgente(percorso),
+        'schema': [f"{c.name}: {c.type}" for c in schema],
+        'parti': [os.path.basename(parte)],
+        'righe': tabella.num_rows,
+        'data_massima': _data_massima(tabella['Data']),
+        'ordinata': True,
+    }
+    _scrivi_manifesto(cartella, manifesto)
+    return manifesto
+
+
+def prepara_estrazione(percorso=PERCORSO_ESTRAZIONE, cartella=CARTELLA_ESTRAZIONE):
+    # Converte l'estrazione solo se la cache manca o se il file sorgente è cambiato
+    manifesto = _leggi_manifesto(cartella)
+    if manifesto is not None and not os.path.exists(percorso):
+        return manifesto
+    if manifesto is None or manifesto['sorgente'] != _impronta_sorgente(percorso):
+        manifesto = converti_estrazione(percorso, cartella)
+    return manifesto
+
+
+def aggiungi_consegne(nuove, cartella=CARTELLA_ESTRAZIONE):
+    """
+    Aggiunge righe di consegna (DataFrame con le colonne dell'estrazione) in una nuova parte
+    della cache, senza riscrivere le precedenti. Restituisce il numero di righe aggiunte.
+    """
+    manifesto = _leggi_manifesto(cartella)
+    if manifesto is None:
+        raise FileNotFoundError(f"Cache dell'estrazione non trovata in {cartella}: eseguire prima la conversione")
+    if len(nuove) == 0:
+        return 0
+    schema = pq.read_schema(os.path.join(cartella, manifesto['parti'][0]))
+    nuove = nuove.rename(columns=dict(zip(nuove.columns, normalizza_colonne(nuove.columns))))
+    mancanti = [c for c in schema.names if c not in nuove.columns]
+    if mancanti:
+        raise ValueError(f"Colonne mancanti nelle nuove consegne: {mancanti}")
+    tabella = _tabella(nuove, schema).sort_by([(c, 'ascending') for c in CHIAVE_ORDINAMENTO])
+
+    nome = f"parte-{len(manifesto['parti']):05d}.parquet"
+    pq.write_table(tabella, os.path.join(cartella, nome))
+    manifesto['parti'].append(nome)
+    manifesto['righe'] += tabella.num_rows
+    date = [d for d in (manifesto['data_massima'], _data_massima(tabella['Data'])) if d is not None]
+    manifesto['data_massima'] = str(max(pd.Timestamp(d) for d in date))
+    manifesto['ordinata'] = False
+    _scrivi_manifesto(cartella, manifesto)
+    return tabella.num_rows
+
+
+def aggiorna_da_sorgente(percorso=PERCORSO_ESTRAZIONE, cartella=CARTELLA_ESTRAZIONE, righe_per_blocco=RIGHE_PER_BLOCCO):
+    """
+    Aggiornamento append-only da una nuova estrazione: legge la sorgente a blocchi e aggiunge
+    solo le consegne successive all'ultima data in cache. Restituisce il numero di righe aggiunte.
+    """
+    manifesto = _leggi_manifesto(cartella)
+    if manifesto is None:
+        return converti_estrazione(percorso, cartella, righe_per_blocco)['righe']
+    ultima = pd.Timestamp(manifesto['data_massima'] or pd.Timestamp.min)
+    nuove = []
+    for blocco in leggi_blocchi_sorgente(percorso, righe_per_blocco):
+        blocco = blocco.rename(columns=dict(zip(blocco.columns, normalizza_colonne(blocco.columns))))
+        blocco['Data'] = pd.to_datetime(blocco['Data'], dayfirst=True)
+        nuove.append(blocco[blocco['Data'] > ultima])
+    aggiunte = aggiungi_consegne(pd.concat(nuove, ignore_index=True), cartella)
+    manifesto = _leggi_manifesto(cartella)
+    manifesto['sorgente'] = _impronta_sorgente(percorso)
+    _scrivi_manifesto(cartella, manifesto)
+    return aggiunte
+
+
+def _percorsi_parti(cartella, manifesto):
+    return [os.path.join(cartella, p) for p in manifesto['parti']]
+
+
+def leggi_estrazione(percorso=PERCORSO_ESTRAZIONE, colonne=None, cartella=CARTELLA_ESTRAZIONE, clienti=None):
+    """
+    Estrazione pulita e ordinata per (Codice Cliente, Data), letta in memory-map dalla cache colonnare
+    (creata o aggiornata se necessario), solo con le colonne richieste.
+    Con clienti (codici) si leggono solo le loro consegne: essendo la cache ordinata per cliente,
+    i row group che non li contengono vengono saltati dalle statistiche del Parquet.
+    """
+    manifesto = prepara_estrazione(percorso, cartella)
+    if colonne is not None:
+        colonne = list(dict.fromkeys(CHIAVE_ORDINAMENTO + list(colonne)))
+    filtri = None if clienti is None else [('Codice Cliente', 'in', list(clienti))]
+    tabelle = [pq.read_table(p, columns=colonne, filters=filtri, memory_map=True)
+               for p in _percorsi_parti(cartella, manifesto)]
+    tabella = pa.concat_tables(tabelle, promote_options='default') if len(tabelle) > 1 else tabelle[0]
+    if not manifesto['ordinata']:
+        tabella = tabella.sort_by([(c, 'ascending') for c in CHIAVE_ORDINAMENTO])
+    return tabella.to_pandas()
+
+
+def leggi_estrazione_a_blocchi(percorso=PERCORSO_ESTRAZIONE, colonne=None, righe_per_blocco=RIGHE_PER_BLOCCO,
+                               cartella=CARTELLA_ESTRAZIONE):
+    # Lettura in streaming della cache, un DataFrame per blocco (ordine delle parti, non ordinamento globale)
+    manifesto = prepara_estrazione(percorso, cartella)
+    for parte in _percorsi_parti(cartella, manifesto):
+        for batch in pq.ParquetFile(parte, memory_map=True).iter_batches(batch_size=righe_per_blocco, columns=colonne):
+            yield batch.to_pandas()
+
+
+def esegui(percorso_estrazione=PERCORSO_ESTRAZIONE, cartella=CARTELLA_ESTRAZIONE):
+    # Fase della pipeline: cache colonnare aggiornata rispetto al file sorgente
+    with misura('conversione_estrazione'):
+        return prepara_estrazione(percorso_estrazione, cartella)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Conversione dell'estrazione delle consegne nella cache colonnare")
+    parser.add_argument("--estrazione", default=PERCORSO_ESTRAZIONE)
+    parser.add_argument("--cartella", default=CARTELLA_ESTRAZIONE)
+    parser.add_argument("--forza", action="store_true", help="riconverte anche se la sorgente non è cambiata")
+    parser.add_argument("--aggiorna", action="store_true",
+                        help="aggiunge solo le consegne successive all'ultima data in cache")
+    parser.add_argument("--aggiungi", metavar="FILE", help="aggiunge le consegne di un file CSV o Parquet")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    if args.aggiungi:
+        nuove = pd.concat(leggi_blocchi_sorgente(args.aggiungi), ignore_index=True)
+        print(f"Consegne aggiunte: {aggiungi_consegne(nuove, args.cartella)}")
+    elif args.aggiorna:
+        print(f"Consegne aggiunte: {aggiorna_da_sorgente(args.estrazione, args.cartella)}")
+    elif args.forza:
+        converti_estrazione(args.estrazione, args.cartella)
+    else:
+        esegui(args.estrazione, args.cartella)
+    manifesto = _leggi_manifesto(args.cartella)
+    print(f"Cache {args.cartella}: {manifesto['righe']} righe in {len(manifesto['parti'])} parti, "
+          f"ultima consegna {manifesto['data_massima']} ({time.perf_counter() - t0:.2f} s)")
@@ -0,0 +1,147 @@
+import asyncio
+import random
+import re
+import time
+
+import pandas as pd
+from cache_geocodifica import chiave_cap, chiave_indirizzo
+from strumentazione import incrementa
+
+# Pipeline di geocodifica asincrona: un'unica coda per il passaggio su via/località
+# e per il fallback su CAP, con limite di richieste al secondo (token bucket),
+# concorrenza limitata e retry con backoff esponenziale.
+# Con una CacheGeocodifica i risultati già noti (anche negativi) non generano richieste.
+
+
+class LimitatoreToken:
+    """
+    Token bucket: al massimo `richieste_al_secondo` richieste in media,
+    con picchi fino a `capacita` richieste consecutive.
+    """
+
+    def __init__(self, richieste_al_secondo=1.0, capacita=1):
+        self.intervallo = 1.0 / richieste_al_secondo
+        self.capacita = capacita
+        self.token = float(capacita)
+        self.ultimo = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquisisci(self):
+        async with self.lock:
+            while True:
+                adesso = time.monotonic()
+                self.token = min(self.capacita, self.token + (adesso - self.ultimo) / self.intervallo)
+                self.ultimo = adesso
+                if self.token >= 1:
+                    self.token -= 1
+                    return
+                await asyncio.sleep((1 - self.token) * self.intervallo)
+
+
+class BackendOpenCage:
+    # Backend reale: API OpenCage (quota gratuita: 1 richiesta al secondo)
+    def __init__(self, key):
+        from opencage.geocoder import OpenCageGeocode
+        self.geocoder = OpenCageGeocode(key)
+
+    def geocodifica(self, indirizzo):
+        result = self.geocoder.geocode(indirizzo)
+        if result:
+            return result[0]['geometry']['lat'], result[0]['geometry']['lng']
+        return None
+
+
+class BackendStub:
+    # Backend locale per i test: risponde da un dizionario indirizzo -> (lat, lon)
+    def __init__(self, risposte=None, latenza=0.0):
+        self.risposte = risposte or {}
+        self.latenza = latenza
+        self.chiamate = 0
+
+    def geocodifica(self, indirizzo):
+        self.chiamate += 1
+        if self.latenza:
+            time.sleep(self.latenza)
+        return self.risposte.get(indirizzo)
+
+
+def indirizzo_cliente(row):
+    return f"{row['Via_clean']}, {row['Localita_clean']}, Italy"
+
+
+def cap_cliente(localita):
+    # Estrae il CAP a 5 cifre dalla località (es. "85100 POTENZA PZ" -> "85100")
+    cap_match = re.search(r'(\d{5})', str(localita))
+    return cap_match.group(1) if cap_match else None
+
+
+async def _geocodifica_con_retry(backend, indirizzo, chiave, cache, limitatore, tentativi, attesa_base):
+    if cache is not None:
+        trovato, coord = cache.leggi(chiave)
+        if trovato:
+            return coord
+    print(f"Geocodificando: {indirizzo}")
+    for tentativo in range(tentativi):
+        await limitatore.acquisisci()
+        incrementa('chiamate_geocoder')
+        try:
+            coord = await asyncio.to_thread(backend.geocodifica, indirizzo)
+        except Exception as e:
+            incrementa('errori_geocoder')
+            if tentativo == tentativi - 1:
+                # Gli errori non vengono memorizzati: l'indirizzo sarà ritentato al prossimo avvio
+                print(f"Errore geocodifica per {indirizzo}: {e}")
+                return None
+            # Backoff esponenziale con jitter prima di riprovare
+            await asyncio.sleep(attesa_base * 2 ** tentativo + random.uniform(0, attesa_base))
+            continue
+        if cache is not None:
+            cache.scrivi(chiave, coord)
+        return coord
+
+
+async def _geocodifica_cliente(backend, indirizzo, cap, cache, limitatore, semaforo, tentativi, attesa_base):
+    async with semaforo:
+        # Primo passaggio: via + località
+        if indirizzo:
+            coord = await _geocodifica_con_retry(backend, indirizzo, chiave_indirizzo(indirizzo), cache,
+                                                 limitatore, tentativi, attesa_base)
+            if coord and coord[0] and coord[1]:
+                return coord
+        # Fallback: solo CAP
+        if cap:
+            coord = await _geocodifica_con_retry(backend, f"{cap}, Italy", chiave_cap(cap), cache,
+                                                 limitatore, tentativi, attesa_base)
+            if coord and coord[0] and coord[1]:
+                return coord
+        return None, None
+
+
+async def geocodifica_async(richieste, backend, cache=None, richieste_al_secondo=1.0, concorrenza=4,
+                            tentativi=3, attesa_base=1.0):
+    """
+    Geocodifica una lista di richieste (indirizzo, cap) in parallelo.
+    Restituisce una lista di (lat, lon) nello stesso ordine delle richieste.
+    """
+    limitatore = LimitatoreToken(richieste_al_secondo)
+    semaforo = asyncio.Semaphore(concorrenza)
+    return await asyncio.gather(*[
+        _geocodifica_cliente(backend, indirizzo, cap, cache, limitatore, semaforo, tentativi, attesa_base)
+        for indirizzo, cap in richieste
+    ])
+
+
+def geocodifica_indirizzo(indirizzo, backend, cache=None, **opzioni):
+    # Geocodifica sincrona di un singolo indirizzo (es. il deposito), passando dalla cache
+    coord = asyncio.run(geocodifica_async([(indirizzo, None)], backend, cache=cache, **opzioni))[0]
+    return coord if coord[0] is not None else None
+
+
+def geocodifica_clienti(df_clienti, backend, **opzioni):
+    """
+    Geocodifica i clienti del DataFrame (colonne Via_clean, Localita_clean, Localita).
+    Restituisce un DataFrame con 'latitudine' e 'longitudine' allineato all'indice di input.
+    """
+    richieste = [(indirizzo_cliente(row), cap_cliente(row['Localita'])) for _, row in df_clienti.iterrows()]
+    coordinate = asyncio.run(geocodifica_async(richieste, backend, **opzioni))
+    return pd.DataFrame(coordinate, index=df_clienti.index, columns=['latitudine', 'longitudine'], dtype=float)
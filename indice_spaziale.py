@@ -0,0 +1,38 @@
+import numpy as np
+from sklearn.neighbors import BallTree
+from distanze import RAGGIO_TERRA_KM
+
+
+class IndiceSpaziale:
+    """
+    Indice spaziale (BallTree) riutilizzabile per query di raggio e di vicino più prossimo.
+    Con metrica 'haversine' i punti sono (lat, lon) in gradi e le distanze in km;
+    con 'euclidean' si lavora direttamente nello spazio fornito (es. coordinate standardizzate).
+    """
+
+    def __init__(self, punti, metrica='haversine'):
+        if metrica not in ('haversine', 'euclidean'):
+            raise ValueError(f"Metrica non supportata: {metrica}")
+        self.metrica = metrica
+        self.albero = BallTree(self._prepara(punti), metric=metrica)
+
+    def _prepara(self, punti):
+        punti = np.asarray(punti, dtype=float)
+        return np.radians(punti) if self.metrica == 'haversine' else punti
+
+    def _scala(self):
+        # Fattore per convertire la distanza dell'albero nell'unità dell'utente (km o unità dello spazio)
+        return RAGGIO_TERRA_KM if self.metrica == 'haversine' else 1.0
+
+    def conta_entro(self, punti, raggio):
+        # Numero di punti indicizzati entro `raggio` da ciascun punto richiesto (punto stesso incluso)
+        if len(punti) == 0:
+            return np.zeros(0, dtype=int)
+        return self.albero.query_radius(self._prepara(punti), r=raggio / self._scala(), count_only=True)
+
+    def piu_vicino(self, punti):
+        # Equivalente a pairwise_distances_argmin_min: indice e distanza del punto indicizzato più vicino
+        if len(punti) == 0:
+            return np.zeros(0, dtype=int), np.zeros(0)
+        dist, idx = self.albero.query(self._prepara(punti), k=1)
+        return idx[:, 0], dist[:, 0] * self._scala()
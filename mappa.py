@@ -0,0 +1,184 @@
+import json
+import os
+
+import folium
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from folium.plugins import FastMarkerCluster
+from folium.template import Template
+from matplotlib import colors
+
+# Mappe interattive leggere per molti clienti:
+# i punti sono passati al browser come un unico array [lat, lon, cliente, colore, cluster]
+# di un FastMarkerCluster, e lo stile per cluster è applicato lato client da una callback JavaScript;
+# i percorsi dei giri sono un unico layer GeoJSON di LineString.
+# Con salva_mappa l'array è scritto in un file JavaScript accanto all'HTML (<mappa>_punti.js),
+# caricato dalla pagina con un tag <script> (funziona anche aprendo l'HTML da disco): la pagina
+# resta di pochi KB qualunque sia il numero di clienti e il browser disegna solo i gruppi
+# visibili al livello di zoom corrente.
+
+PALETTE = 'Set1'
+COLORE_OUTLIER = '#d62728'
+DECIMALI_COORDINATE = 5  # circa 1 m
+
+_CALLBACK_CLIENTI = """
+function (row) {
+    var colori = %s;
+    var outlier = row[3] < 0;
+    var colore = outlier ? '%s' : colori[row[3]];
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {
+        radius: outlier ? 7 : 5, color: colore, fill: true, fillColor: colore, fillOpacity: 0.9
+    });
+    marker.bindPopup('Cliente ' + row[2] + (outlier ? ' (Outlier)' : ', Cluster ' + row[4]));
+    return marker;
+}
+"""
+
+
+class FastMarkerClusterEsterno(FastMarkerCluster):
+    """
+    FastMarkerCluster con i punti in un file JavaScript separato (salva_dati), letto dalla variabile
+    globale che il file definisce; senza file i punti restano nell'HTML come in FastMarkerCluster.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function(){
+                {{ this.callback }}
+
+                var data = {% if this.url %}window[{{ this.variabile|tojson }}]{% else %}{{ this.data|tojson }}{% endif %};
+                var cluster = L.markerClusterGroup({{ this.options|tojavascript }});
+
+                for (var i = 0; i < data.length; i++) {
+                    var row = data[i];
+                    var marker = callback(row);
+                    marker.addTo(cluster);
+                }
+
+                cluster.addTo({{ this._parent.get_name() }});
+                return cluster;
+            })();
+        {% endmacro %}"""
+    )
+
+    def __init__(self, data, callback, **kwargs):
+        # I punti non passano dalla validazione riga per riga di FastMarkerCluster
+        super().__init__([], callback=callback, **kwargs)
+        self.data = data
+        self.url = None
+        self.variabile = None
+
+    def salva_dati(self, percorso_js):
+        self.variabile = f"punti_{self.get_name()}"
+        with open(percorso_js, "w") as f:
+            f.write(f"window[{json.dumps(self.variabile)}] = {json.dumps(self.data, separators=(',', ':'))};\n")
+        self.url = os.path.basename(percorso_js)
+
+    def render(self, **kwargs):
+        if self.url:
+            self.get_root().header.add_child(folium.JavascriptLink(self.url), name=self.variabile)
+        super().render(**kwargs)
+
+
+def colori_cluster(etichette, palette=PALETTE):
+    # Colore esadecimale per ogni etichetta di cluster (in ordine), dalla palette di matplotlib
+    cmap = plt.get_cmap(palette, max(len(etichette), 1))
+    return [colors.to_hex(cmap(i)) for i in range(len(etichette))]
+
+
+def crea_mappa_clienti(df, colonna_cluster='cluster_riparato', zoom_start=10):
+    """
+    Mappa dei clienti colorati per cluster (-1 = outlier, in rosso) in un unico layer FastMarkerCluster
+    (i punti sono scritti in un file separato da salva_mappa).
+    """
+    lat = df['latitudine'].to_numpy(dtype=float)
+    lon = df['longitudine'].to_numpy(dtype=float)
+    cluster = df[colonna_cluster].to_numpy()
+    outlier = (cluster == -1) | (cluster == 'outlier')
+
+    # Indice del colore per etichetta, nell'ordine delle etichette (-1 per gli outlier)
+    colore = np.full(len(cluster), -1)
+    colore[~outlier], etichette = pd.factorize(cluster[~outlier], sort=True)
+
+    colonne = [np.round(lat, DECIMALI_COORDINATE), np.round(lon, DECIMALI_COORDINATE),
+               df['Codice Cliente'].astype(str).to_numpy(), colore, cluster.astype(str)]
+    dati = np.column_stack([c.astype(object) for c in colonne]).tolist()
+
+    m = folium.Map(location=[float(np.mean(lat)), float(np.mean(lon))], zoom_start=zoom_start)
+    callback = _CALLBACK_CLIENTI % (json.dumps(colori_cluster(list(etichette))), COLORE_OUTLIER)
+    FastMarkerClusterEsterno(dati, callback=callback, name="Clienti").add_to(m)
+    return m
+
+
+def aggiungi_percorsi(m, df_percorsi, df_clienti, deposito_coord, colonna_percorso='Percorso Ottimo',
+                      colonna_nome='Veicolo', colore='#1f77b4'):
+    """
+    Aggiunge alla mappa i percorsi del pianificatore (liste di codici cliente, in ordine di visita)
+    come un unico layer GeoJSON: ogni giro parte dal deposito.
+    """
+    coordinate = df_clienti.drop_duplicates('Codice Cliente').set_index('Codice Cliente')[['longitudine', 'latitudine']]
+    deposito = [round(deposito_coord[1], DECIMALI_COORDINATE), round(deposito_coord[0], DECIMALI_COORDINATE)]
+
+    features = []
+    for nome, percorso in zip(df_percorsi[colonna_nome], df_percorsi[colonna_percorso]):
+        punti = coordinate.reindex(list(percorso)).dropna().round(DECIMALI_COORDINATE).values.tolist()
+        if not punti:
+            continue
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'LineString', 'coordinates': [deposito] + punti},
+            'properties': {'giro': str(nome)},
+        })
+    if not features:
+        return m
+
+    folium.GeoJson(
+        {'type': 'FeatureCollection', 'features': features},
+        name="Percorsi",
+        style_function=lambda _: {'color': colore, 'weight': 3, 'opacity': 0.8},
+        tooltip=folium.GeoJsonTooltip(fields=['giro'], aliases=['Giro']),
+    ).add_to(m)
+    folium.Marker(location=list(deposito_coord), popup="Deposito", icon=folium.Icon(color='black')).add_to(m)
+    return m
+
+
+def salva_mappa(m, percorso_html):
+    # I punti dei layer FastMarkerClusterEsterno vanno in <mappa>_punti.js (_punti_2.js, ...) accanto all'HTML
+    radice = os.path.splitext(percorso_html)[0]
+    layer = [c for c in m._children.values() if isinstance(c, FastMarkerClusterEsterno)]
+    for i, l in enumerate(layer, start=1):
+        l.salva_dati(f"{radice}_punti{'' if i == 1 else f'_{i}'}.js")
+    folium.LayerControl().add_to(m)
+    m.save(percorso_html)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import pandas as pd
+    from artefatti import leggi_artefatto
+
+    # Coordinate del deposito (come in pianificazione_multi_veicolo.py)
+    DEPOSITO_COORD = (40.656361, 15.880113)
+
+    parser = argparse.ArgumentParser(description="Mappa dei clienti per cluster, con i percorsi pianificati opzionali")
+    parser.add_argument("--clienti", default="clienti_con_cluster_riparato.csv")
+    parser.add_argument("--percorsi", help="output del pianificatore, es. percorso_multi_veicolo.csv")
+    parser.add_argument("--data", help="mostra solo i percorsi di questa data (AAAA-MM-GG)")
+    parser.add_argument("--output", default="clienti_clusters_outliers.html")
+    args = parser.parse_args()
+
+    df_clienti = leggi_artefatto(args.clienti)
+    m = crea_mappa_clienti(df_clienti)
+    if args.percorsi:
+        df_percorsi = leggi_artefatto(args.percorsi)
+        if args.data:
+            df_percorsi = df_percorsi[pd.to_datetime(df_percorsi['Data Consegna']) == pd.Timestamp(args.data)]
+        colonna = 'Percorso Ottimo' if 'Percorso Ottimo' in df_percorsi else 'Percorso Ottimo (NN)'
+        nome = 'Veicolo' if 'Veicolo' in df_percorsi else 'Data Consegna'
+        aggiungi_percorsi(m, df_percorsi, df_clienti, DEPOSITO_COORD, colonna_percorso=colonna, colonna_nome=nome)
+        print(f"Percorsi sulla mappa: {len(df_percorsi)}")
+    salva_mappa(m, args.output)
+    print(f"Mappa salvata in {args.output}")
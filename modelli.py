@@ -0,0 +1,51 @@
+import hashlib
+import platform
+import time
+import warnings
+
+import joblib
+import pandas as pd
+import sklearn
+
+# Persistenza dei modelli di previsione: il modello addestrato viene salvato con joblib
+# insieme ai metadati di versione (formato del file, versione del modello, librerie, feature,
+# metriche e impronta dei dati di addestramento), così da poterlo riusare senza riaddestrarlo.
+
+PERCORSO_MODELLO = "modello_previsione.joblib"
+VERSIONE_FORMATO = 1
+
+
+def impronta_dati(X, y=None):
+    # SHA-256 del contenuto dei dati di addestramento (hash per riga di pandas)
+    h = hashlib.sha256(pd.util.hash_pandas_object(X, index=False).to_numpy().tobytes())
+    if y is not None:
+        h.update(pd.util.hash_pandas_object(y, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def salva_modello(modello, metadati, percorso=PERCORSO_MODELLO):
+    """
+    Salva il modello con i metadati forniti (feature, codifica, metriche, ...),
+    aggiungendo versione del modello, data di creazione e versioni di Python e scikit-learn.
+    Restituisce i metadati completi.
+    """
+    metadati = {
+        'versione_modello': time.strftime('%Y%m%d-%H%M%S'),
+        'creato': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'sklearn': sklearn.__version__,
+        **metadati,
+    }
+    joblib.dump({'formato': VERSIONE_FORMATO, 'modello': modello, 'metadati': metadati}, percorso)
+    return metadati
+
+
+def carica_modello(percorso=PERCORSO_MODELLO):
+    # Restituisce (modello, metadati); avvisa se il modello è stato salvato con un'altra versione di scikit-learn
+    contenuto = joblib.load(percorso)
+    if contenuto.get('formato') != VERSIONE_FORMATO:
+        raise ValueError(f"Formato del modello non supportato: {contenuto.get('formato')}")
+    metadati = contenuto['metadati']
+    if metadati.get('sklearn') != sklearn.__version__:
+        warnings.warn(f"Modello salvato con scikit-learn {metadati.get('sklearn')}, in uso {sklearn.__version__}")
+    return contenuto['modello'], metadati
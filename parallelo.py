@@ -0,0 +1,54 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from strumentazione import CONTATORI
+
+# Esecuzione parallela dei lavori di pianificazione (un lavoro per giorno/cluster) su un pool di processi.
+# Ogni lavoro porta con sé le matrici del proprio giro (deposito + clienti, poche decine di nodi);
+# i dati comuni di sola lettura sono inviati una volta a ogni processo e i risultati tornano
+# nello stesso ordine dei lavori.
+
+# Stato del processo worker, impostato dall'inizializzatore
+_COMUNI = {}
+
+
+def _inizializza(comuni):
+    global _COMUNI
+    _COMUNI = comuni
+
+
+def _esegui(argomenti):
+    # Restituisce anche i contatori incrementati dal lavoro, da sommare nel processo principale
+    funzione, lavoro = argomenti
+    prima = CONTATORI.copy()
+    risultato = funzione(lavoro, **_COMUNI)
+    return risultato, CONTATORI - prima
+
+
+def _contesto():
+    # 'fork' evita di rieseguire gli script (che lavorano a livello di modulo) nei processi figli
+    metodi = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('fork' if 'fork' in metodi else None)
+
+
+def esegui_in_parallelo(funzione, lavori, n_processi=None, blocco=16, **comuni):
+    """
+    Applica funzione(lavoro, **comuni) a ogni lavoro e restituisce i risultati in ordine.
+    `funzione` deve essere definita a livello di modulo (serializzabile);
+    `comuni` sono dati di sola lettura inviati una volta a ogni processo.
+    Con n_processi=1 (o pochi lavori) l'esecuzione resta seriale.
+    """
+    lavori = list(lavori)
+    n_processi = n_processi or os.cpu_count() or 1
+    if n_processi == 1 or len(lavori) <= blocco:
+        return [funzione(lavoro, **comuni) for lavoro in lavori]
+
+    with ProcessPoolExecutor(max_workers=n_processi, mp_context=_contesto(), initializer=_inizializza,
+                             initargs=(comuni,)) as executor:
+        risultati = []
+        for risultato, contatori in executor.map(_esegui, [(funzione, lavoro) for lavoro in lavori],
+                                                 chunksize=blocco):
+            risultati.append(risultato)
+            CONTATORI.update(contatori)
+        return risultati
@@ -1,194 +1,228 @@
 import pandas as pd
-from datetime import date
-from geopy.distance import geodesic
-from opencage.geocoder import OpenCageGeocode
-
-df_cluster = pd.read_csv("clienti_con_cluster_riparato.csv")
-
-# Funzione di parsing per convertire stringhe in liste di oggetti datetime.date
-def parse_date_objects(x):
-    try:
-        return eval(x, {"datetime": __import__("datetime"), "date": date})
-    except Exception as e:
-        print(f"Errore nella riga: {x[:50]}... -> {e}")
-        return []
-
-# Tramite l'explode ogni cliente può comparire in più righe (una per ogni data)
-df_cluster['Date_consegna_previste'] = df_cluster['Date_consegna_previste'].apply(parse_date_objects)
-df_exploded = df_cluster.explode('Date_consegna_previste')
-df_exploded['Date_consegna_previste'] = pd.to_datetime(df_exploded['Date_consegna_previste'])
-
-# Crea i giri di consegna raggruppando per data e cluster (cioè zona geografica)
-piano_consegne = df_exploded.groupby(['Date_consegna_previste', 'cluster_finale'])['Codice Cliente'].apply(list).reset_index()
-piano_consegne.columns = ['Data Consegna', 'Cluster', 'Clienti']
-
-# Aggiungi il numero di clienti per ciascun giro
-piano_consegne['Numero Clienti'] = piano_consegne['Clienti'].apply(len)
-
-piano_consegne_filtrato = piano_consegne[piano_consegne['Numero Clienti'] >= 3]
-
-# Giri esclusi (n < 3)
-giri_esclusi = piano_consegne[piano_consegne['Numero Clienti'] < 3]
-
-# Estrai tutti i clienti da quei giri per ripianificarli
-clienti_esclusi = df_exploded.merge(
-    giri_esclusi[['Data Consegna', 'Cluster']],
-    left_on=['Date_consegna_previste', 'cluster_finale'],
-    right_on=['Data Consegna', 'Cluster'],
-    how='inner'
-)
-
-# Ripianificazione
-def trova_data_vicina(row, df_validi, tolleranza=7):
-    data_attuale = row['Date_consegna_previste']
-    cluster = row['cluster_finale']
-    
-    # Cerca giri buoni nello stesso cluster, data diversa
-    possibili = df_validi[
-        (df_validi['Cluster'] == cluster) &
-        (df_validi['Data Consegna'] != data_attuale)
-    ]
-    
-    # Calcola distanza in giorni
-    possibili['delta'] = (possibili['Data Consegna'] - data_attuale).abs().dt.days
-    
-    vicine = possibili[possibili['delta'] <= tolleranza]
-    
-    if not vicine.empty:
-        return vicine.sort_values('delta').iloc[0]['Data Consegna']
+from geocodifica import BackendOpenCage, geocodifica_indirizzo
+from cache_geocodifica import CacheGeocodifica
+from distanze import MatriceDistanze
+from ricerca_locale import percorso_giro
+from parallelo import esegui_in_parallelo
+from zone import mappa_zona
+from artefatti import leggi_artefatto, leggi_artefatto_long, scrivi_artefatto
+from ripianificazione import trova_date_vicine
+from bilanciamento import CLIENTI_PER_GIRO, bilancia_consegne, giri_per_giorno
+from strumentazione import misura
+
+# Modalità di calcolo delle distanze: 'andoyer' (ellissoide, default), 'haversine' o 'geodesic'
+PRECISIONE_DISTANZE = 'andoyer'
+
+# Miglioramento dei percorsi NN con 2-opt / Or-opt e tempo massimo (secondi) per giro
+MIGLIORA_PERCORSI = True
+TEMPO_MAX_PER_GIRO = 0.05
+
+# Regola originale di ripianificazione dei giri con meno di 3 clienti; con True i giri vengono
+# invece bilanciati tra i giorni entro le finestre sicure dei serbatoi (bilanciamento.py), senza
+# la soglia minima di clienti per giro
+BILANCIA_CARICHI = False
+
+# Processi per la pianificazione parallela dei giri (None = tutti i core, 1 = seriale)
+N_PROCESSI = None
+
+
+def ripianifica_giri_piccoli(df_exploded, min_clienti_giro=3, tolleranza_giorni=7):
+    """
+    Regola originale di ripianificazione: i clienti dei giri con meno di min_clienti_giro clienti
+    passano al giro valido più vicino dello stesso cluster entro la tolleranza, altrimenti escono dal piano.
+    Restituisce le consegne (una riga per cliente e data) del piano risultante.
+    """
+    # Crea i giri di consegna raggruppando per data e cluster (cioè zona geografica)
+    piano_consegne = df_exploded.groupby(['Date_consegna_previste', 'cluster_finale'])['Codice Cliente'].apply(list).reset_index()
+    piano_consegne.columns = ['Data Consegna', 'Cluster', 'Clienti']
+
+    # Aggiungi il numero di clienti per ciascun giro
+    piano_consegne['Numero Clienti'] = piano_consegne['Clienti'].apply(len)
+
+    piano_consegne_filtrato = piano_consegne[piano_consegne['Numero Clienti'] >= min_clienti_giro]
+
+    # Giri esclusi (n < 3)
+    giri_esclusi = piano_consegne[piano_consegne['Numero Clienti'] < min_clienti_giro]
+
+    # Estrai tutti i clienti da quei giri per ripianificarli
+    clienti_esclusi = df_exploded.merge(
+        giri_esclusi[['Data Consegna', 'Cluster']],
+        left_on=['Date_consegna_previste', 'cluster_finale'],
+        right_on=['Data Consegna', 'Cluster'],
+        how='inner'
+    )
+
+    # Ripianificazione: assegna una nuova data ai clienti esclusi, cercando giri esistenti
+    # nello stesso cluster entro 7 giorni (ricerca binaria sulle date dei giri validi)
+    clienti_esclusi['Nuova_Data'] = trova_date_vicine(clienti_esclusi, piano_consegne_filtrato, tolleranza=tolleranza_giorni)
+
+    # Clienti ripianificabili
+    ripianificati = clienti_esclusi[clienti_esclusi['Nuova_Data'].notna()].copy()
+    ripianificati['Date_consegna_previste'] = ripianificati['Nuova_Data']
+
+    # Unisci ai clienti del piano valido
+    clienti_validi = df_exploded.merge(
+        piano_consegne_filtrato[['Data Consegna', 'Cluster']],
+        left_on=['Date_consegna_previste', 'cluster_finale'],
+        right_on=['Data Consegna', 'Cluster'],
+        how='inner'
+    )
+
+    # Unione dei clienti ripianificati e validi
+    clienti_finali = pd.concat([clienti_validi, ripianificati], ignore_index=True)
+
+    return clienti_finali
+
+
+def piano_da_consegne(clienti_finali):
+    # Piano delle consegne (una riga per giro) dalle consegne finali, una riga per cliente e data
+    piano = clienti_finali.groupby(['Date_consegna_previste', 'cluster_finale'])['Codice Cliente'].apply(list).reset_index()
+    piano.columns = ['Data Consegna', 'Cluster', 'Clienti']
+    piano['Numero Clienti'] = piano['Clienti'].apply(len)
+
+    # Mappa i codici cluster in etichette leggibili (es. "0_0" → "Zona A1")
+    piano['Zona Consegna'] = piano['Cluster'].astype(str).apply(mappa_zona)
+    return piano
+
+
+def percorso_giro_locale(lavoro, **parametri):
+    # Lavoro di un giro: (nodi, km) con km indicizzata come [deposito] + nodi
+    nodi, km = lavoro
+    dist, dist_nn, percorso = percorso_giro(km, range(1, len(nodi) + 1), **parametri)
+    return dist, dist_nn, [nodi[i - 1] for i in percorso]
+
+
+def esegui(precisione=PRECISIONE_DISTANZE, migliora=MIGLIORA_PERCORSI, tempo_max=TEMPO_MAX_PER_GIRO,
+           n_processi=N_PROCESSI, min_clienti_giro=3, tolleranza_giorni=7, bilancia=BILANCIA_CARICHI,
+           clienti_per_giro=CLIENTI_PER_GIRO):
+    """
+    Piano delle consegne per (data, cluster), con la ripianificazione dei giri con meno di
+    min_clienti_giro clienti (oppure, con bilancia=True, bilanciato sull'orizzonte entro le finestre
+    sicure dei serbatoi), e percorso giornaliero di un veicolo. Restituisce i percorsi per giorno.
+    """
+    df_cluster = leggi_artefatto(
+        "clienti_con_cluster_riparato.csv",
+        colonne=['Codice Cliente', 'latitudine', 'longitudine', 'valid_coordinates']
+    )
+
+    # Lettura in forma lunga: ogni cliente compare in più righe (una per ogni data)
+    df_exploded = leggi_artefatto_long("clienti_con_cluster_riparato.csv", 'Date_consegna_previste')
+
+    if bilancia:
+        # Bilanciamento sull'orizzonte: ogni consegna si sposta entro la sua finestra sicura
+        # (prima che il serbatoio si esaurisca) per ridurre e livellare i giri giornalieri
+        prima = giri_per_giorno(df_exploded['Date_consegna_previste'], df_exploded['cluster_finale'], clienti_per_giro)
+        with misura('bilanciamento'):
+            df_exploded['Date_consegna_previste'] = bilancia_consegne(df_exploded, clienti_per_giro)
+        dopo = giri_per_giorno(df_exploded['Date_consegna_previste'], df_exploded['cluster_finale'], clienti_per_giro)
+        print(f"Bilanciamento: veicoli stimati {prima.sum():.0f} -> {dopo.sum():.0f}, "
+              f"massimo per giorno {prima.max():.0f} -> {dopo.max():.0f}")
+        # Le consegne di uno stesso cliente riunite nello stesso giro sono una sola fermata
+        clienti_finali = df_exploded.drop_duplicates(['Codice Cliente', 'Date_consegna_previste', 'cluster_finale'])
     else:
-        return None
-    
-# Assegna una nuova data ai clienti esclusi, cercando giri esistenti nello stesso cluster entro 7 giorni  
-clienti_esclusi['Nuova_Data'] = clienti_esclusi.apply(
-    lambda r: trova_data_vicina(r, piano_consegne_filtrato),
-    axis=1
-)
-
-# Clienti ripianificabili
-ripianificati = clienti_esclusi[clienti_esclusi['Nuova_Data'].notna()].copy()
-ripianificati['Date_consegna_previste'] = ripianificati['Nuova_Data']
-
-# Unisci ai clienti del piano valido
-clienti_validi = df_exploded.merge(
-    piano_consegne_filtrato[['Data Consegna', 'Cluster']],
-    left_on=['Date_consegna_previste', 'cluster_finale'],
-    right_on=['Data Consegna', 'Cluster'],
-    how='inner'
-)
-
-# Unione dei clienti ripianificati e validi
-clienti_finali = pd.concat([clienti_validi, ripianificati], ignore_index=True)
-
-# Nuovo piano finale
-piano_consegne_finale = clienti_finali.groupby(['Date_consegna_previste', 'cluster_finale'])['Codice Cliente'].apply(list).reset_index()
-piano_consegne_finale.columns = ['Data Consegna', 'Cluster', 'Clienti']
-piano_consegne_finale['Numero Clienti'] = piano_consegne_finale['Clienti'].apply(len)
-
-# Mappa i codici cluster in etichette leggibili (es. "0_0" → "Zona A1")
-def mappa_zona(cluster_label):
-    if cluster_label.startswith("0_"):
-        return f"Zona A{int(cluster_label.split('_')[1]) + 1}"
-    elif cluster_label.startswith("1_"):
-        return f"Zona B{int(cluster_label.split('_')[1]) + 1}"
-    elif cluster_label == "2":
-        return "Zona C"
-    elif cluster_label == "3":
-        return "Zona D"
-    elif cluster_label == "outlier":
-        return "Zona X"
-    else:
-        return f"Zona ? ({cluster_label})"
-
-piano_consegne_finale['Zona Consegna'] = piano_consegne_finale['Cluster'].astype(str).apply(mappa_zona)
-
-print(piano_consegne_finale.sort_values('Data Consegna'))
-piano_consegne_finale.sort_values('Data Consegna').to_csv("piano_consegne_finale.csv", index= False)
-
-# Filtra solo quelli con coordinate valide
-df_coord = df_cluster[df_cluster['valid_coordinates'] == True][['Codice Cliente', 'latitudine', 'longitudine']]
-
-
-# Geocodifica dell'indirizzo del deposito ossia il punto di partenza di ogni giro di consegne
-key = "d5cd143fc4ec4e5caab50b49f85f9bb7"
-geocoder = OpenCageGeocode(key)
-
-indirizzo = "85010 Vaglio Basilicata (PZ), Strada Statale 407, Italy"
-result = geocoder.geocode(indirizzo)
-
-if result and len(result):
-    lat = result[0]['geometry']['lat']
-    lng = result[0]['geometry']['lng']
-    print(f'Coordinate del deposito: {lat}, {lng}')
-else:
-    print('Indirizzo non trovato.')
-
-
-# Coordinate del punto di partenza di ciascun giro
-deposito_coord = (lat, lng)
-
-#deposito_coord = (40.656361, 15.880113)  
+        clienti_finali = ripianifica_giri_piccoli(df_exploded, min_clienti_giro, tolleranza_giorni)
 
-# Ottimizzazione dei percorsi tramite l'algoritmo euristico Nearest Neighbor
-# che calcola un percorso approssimato minimo partendo dal deposito
+    # Nuovo piano finale, con la modalità di ripianificazione usata (letta dall'aggiornamento incrementale)
+    piano_consegne_finale = piano_da_consegne(clienti_finali)
+    print(piano_consegne_finale.sort_values('Data Consegna'))
+    scrivi_artefatto(piano_consegne_finale.sort_values('Data Consegna'), "piano_consegne_finale.csv",
+                     metadati={'bilancia': bilancia, 'min_clienti_giro': min_clienti_giro,
+                               'tolleranza_giorni': tolleranza_giorni, 'clienti_per_giro': clienti_per_giro})
 
-def tsp_nearest_neighbor(df_clienti, deposito_coord):
-    clienti = df_clienti.to_dict('records')
-    if not clienti:
-        return 0, []
+    # Filtra solo quelli con coordinate valide
+    df_coord = df_cluster[df_cluster['valid_coordinates'] == True][['Codice Cliente', 'latitudine', 'longitudine']]
 
-    percorso = []
-    non_visitati = clienti.copy()
-    current_coord = deposito_coord
-    distanza_totale = 0
 
-    while non_visitati:
-        nearest = min(non_visitati, key=lambda c: geodesic(current_coord, (c['latitudine'], c['longitudine'])).km)
-        distanza = geodesic(current_coord, (nearest['latitudine'], nearest['longitudine'])).km
-        distanza_totale += distanza
+    # Geocodifica dell'indirizzo del deposito ossia il punto di partenza di ogni giro di consegne
+    # (dalla cache su disco dopo la prima esecuzione)
+    key = "d5cd143fc4ec4e5caab50b49f85f9bb7"
+    cache = CacheGeocodifica("cache_geocodifica.sqlite")
 
-        percorso.append(nearest)
-        current_coord = (nearest['latitudine'], nearest['longitudine'])
-        non_visitati.remove(nearest)
+    indirizzo = "85010 Vaglio Basilicata (PZ), Strada Statale 407, Italy"
+    result = geocodifica_indirizzo(indirizzo, BackendOpenCage(key), cache=cache)
+    cache.chiudi()
 
-    percorso_codici = [cliente['Codice Cliente'] for cliente in percorso]
-    return round(distanza_totale, 2), percorso_codici
-
-
-giorni = piano_consegne_finale['Data Consegna'].unique()
-
-# Costruisce i percorsi finali per un solo veicolo che visita 
-# più zone (cluster) nello stesso giorno, partendo dal deposito
-
-risultati = [] # lista che conterrà i risultati
-
-for giorno in sorted(giorni):
-    sottoinsieme = piano_consegne_finale[piano_consegne_finale['Data Consegna'] == giorno]
-    percorso_totale = []
-    distanza_totale = 0
-    cluster_sequence = []
-
-    for _, riga in sottoinsieme.iterrows():
-        clienti = riga['Clienti']
-        cluster = riga['Cluster']
-        df_clienti_giro = df_coord[df_coord['Codice Cliente'].isin(clienti)]
-
-        dist, percorso = tsp_nearest_neighbor(df_clienti_giro, deposito_coord)
-
-        percorso_totale += percorso
-        distanza_totale += dist
-        cluster_sequence += [cluster] * len(percorso)
-
-    risultati.append({
-        'Data Consegna': giorno,
-        'Numero Cluster Serviti': len(sottoinsieme),
-        'Numero Clienti': len(percorso_totale),
-        'Distanza Totale Stimata (km)': round(distanza_totale, 2),
-        'Percorso Ottimo (NN)': percorso_totale,
-        'Cluster Percorso': cluster_sequence
-    })
-
-# Salva 
-df_risultati = pd.DataFrame(risultati)
-df_risultati = df_risultati.sort_values('Data Consegna')
-df_risultati.to_csv("percorso_ottimizzato_nearest_neightbor.csv", index=False)
\ No newline at end of file
+    if result:
+        lat, lng = result
+        print(f'Coordinate del deposito: {lat}, {lng}')
+    else:
+        print('Indirizzo non trovato.')
+
+
+    # Coordinate del punto di partenza di ciascun giro
+    deposito_coord = (lat, lng)
+
+    #deposito_coord = (40.656361, 15.880113)  
+
+    # Ottimizzazione dei percorsi tramite l'algoritmo euristico Nearest Neighbor
+    # che calcola un percorso approssimato minimo partendo dal deposito.
+    # Le distanze sono calcolate per giro (deposito + clienti del giro), non sull'intera anagrafica
+    matrice = MatriceDistanze.da_dataframe(df_coord, deposito_coord, precisione=precisione)
+
+    # Un lavoro di routing per ogni giro (giorno, cluster), eseguiti in parallelo su più processi
+    piano_ordinato = piano_consegne_finale.sort_values('Data Consegna', kind='stable').reset_index(drop=True)
+    lavori = []
+    for clienti in piano_ordinato['Clienti']:
+        nodi = matrice.indici(clienti)
+        lavori.append((nodi, matrice.sottomatrice([0] + nodi)))
+    with misura('percorsi_giri'):
+        esiti = esegui_in_parallelo(
+            percorso_giro_locale, lavori, n_processi=n_processi,
+            migliora=migliora, tempo_max=tempo_max
+        )
+    piano_ordinato['Esito'] = esiti
+
+    # Costruisce i percorsi finali per un solo veicolo che visita 
+    # più zone (cluster) nello stesso giorno, partendo dal deposito
+
+    risultati = [] # lista che conterrà i risultati
+    peggiori = []  # giri più lunghi del loro Nearest Neighbor: (data, cluster, km risparmiati < 0)
+
+    for giorno, sottoinsieme in piano_ordinato.groupby('Data Consegna', sort=True):
+        percorso_totale = []
+        distanza_totale = 0
+        distanza_nn = 0
+        cluster_sequence = []
+
+        risparmi = []
+        for _, riga in sottoinsieme.iterrows():
+            cluster = riga['Cluster']
+            dist, dist_nn, nodi = riga['Esito']
+            percorso = matrice.codici_da_indici(nodi)
+
+            percorso_totale += percorso
+            distanza_totale += dist
+            distanza_nn += dist_nn
+            cluster_sequence += [cluster] * len(percorso)
+            risparmi.append(round(float(dist_nn - dist), 2))
+            if risparmi[-1] < 0:
+                peggiori.append((giorno, cluster, risparmi[-1]))
+
+        risultati.append({
+            'Data Consegna': giorno,
+            'Numero Cluster Serviti': len(sottoinsieme),
+            'Numero Clienti': len(percorso_totale),
+            'Distanza Totale Stimata (km)': round(distanza_totale, 2),
+            'Distanza NN (km)': round(distanza_nn, 2),
+            'Km risparmiati': round(distanza_nn - distanza_totale, 2),
+            # Un valore per giro (cluster), nell'ordine di 'Cluster Percorso'
+            'Km risparmiati per giro': risparmi,
+            'Percorso Ottimo (NN)': percorso_totale,
+            'Cluster Percorso': cluster_sequence
+        })
+
+    # Salva 
+    df_risultati = pd.DataFrame(risultati)
+    df_risultati = df_risultati.sort_values('Data Consegna')
+    print(f"Km risparmiati rispetto a Nearest Neighbor: {df_risultati['Km risparmiati'].sum():.2f} "
+          f"su {df_risultati['Distanza NN (km)'].sum():.2f}")
+    # Il totale del giorno può nascondere singoli giri peggiori del Nearest Neighbor
+    print(f"Giri più lunghi del Nearest Neighbor: {len(peggiori)}")
+    for giorno, cluster, km in peggiori:
+        print(f"  {giorno} cluster {cluster}: {-km:.2f} km in più")
+    scrivi_artefatto(df_risultati, "percorso_ottimizzato_nearest_neightbor.csv")
+    return df_risultati
+
+
+if __name__ == "__main__":
+    esegui()
@@ -1,110 +1,253 @@
+import heapq
+from collections import defaultdict
+from datetime import timedelta
+
+import numpy as np
 import pandas as pd
-from geopy.distance import geodesic
-import math
-
-# Caricamento dati
-df_coord = pd.read_csv("clienti_validi_geocodificati.csv")
-df_piano = pd.read_csv("piano_consegne_finale.csv")
-
-# Coordinate del deposito 
-deposito_coord = (40.656361, 15.880113)
-
-# Funzione NEAREST NEIGHBOR 
-def tsp_nearest_neighbor(df_clienti, deposito_coord):
-    clienti = df_clienti.to_dict('records')
-    if not clienti:
-        return 0, []
-    percorso = []
-    non_visitati = clienti.copy()
-    current_coord = deposito_coord
-    distanza_totale = 0
-
-    while non_visitati:
-        nearest = min(non_visitati, key=lambda c: geodesic(current_coord, (c['latitudine'], c['longitudine'])).km)
-        distanza = geodesic(current_coord, (nearest['latitudine'], nearest['longitudine'])).km
-        distanza_totale += distanza
-        percorso.append(nearest)
-        current_coord = (nearest['latitudine'], nearest['longitudine'])
-        non_visitati.remove(nearest)
-
-    percorso_codici = [c['Codice Cliente'] for c in percorso]
-    return round(distanza_totale, 2), percorso_codici
-
-# Parametri di configurazione
-max_clienti_per_veicolo = 8
-min_clienti_per_veicolo = 3
-
-# Suddivide la lista di clienti in gruppi di dimensione compresa tra min_size e max_size.
-def suddividi_in_gruppi(clienti, min_size=3, max_size=8):
-    gruppi = []
-    i = 0
-    while i < len(clienti):
-        end = i + max_size
-        # Se l'ultimo gruppo ha meno di min_size clienti, li accorpa al gruppo precedente (se esiste),
-        if end >= len(clienti):
-            if len(clienti) - i < min_size and gruppi:
-                gruppi[-1].extend(clienti[i:])
+from distanze import MatriceDistanze
+from rete_stradale import CostiStradali
+from vrp import Turno, oltre_capacita, pianifica_veicoli
+from parallelo import esegui_in_parallelo
+from zone import mappa_zona
+from artefatti import leggi_artefatto, scrivi_artefatto
+from bilanciamento import finestre_sicure
+from strumentazione import misura
+
+# Modalità di calcolo delle distanze: 'andoyer' (ellissoide, default), 'haversine' o 'geodesic'
+PRECISIONE_DISTANZE = 'andoyer'
+
+# Miglioramento dei percorsi NN con 2-opt / Or-opt e tempo massimo (secondi) per giro
+MIGLIORA_PERCORSI = True
+TEMPO_MAX_PER_GIRO = 0.05
+
+# Suddivisione dei clienti tra i veicoli: 'vrp' (risparmi di Clarke-Wright con capacità)
+# oppure 'blocchi' (gruppi consecutivi di max 8 clienti, metodo originale)
+METODO_SUDDIVISIONE = 'vrp'
+CAPACITA_VEICOLO_LITRI = 8000
+
+# Server di routing compatibile con OSRM per km e tempi su strada (es. "http://localhost:5000");
+# con None, o se il server non risponde, distanza in linea d'aria x fattore di deviazione a 40 km/h
+SERVER_STRADALE = None
+
+# Processi per la pianificazione parallela dei giri (None = tutti i core, 1 = seriale)
+N_PROCESSI = None
+
+# Limiti di clienti per veicolo
+MAX_CLIENTI_PER_VEICOLO = 8
+MIN_CLIENTI_PER_VEICOLO = 3
+
+# Durata massima del turno (minuti, dal deposito al rientro, consegne incluse; None = nessun limite)
+# e tempo di servizio per cliente: sosta fissa + travaso dei litri alla portata della pompa
+DURATA_MAX_TURNO_MIN = 480
+TEMPO_SOSTA_MIN = 5
+PORTATA_POMPA_L_MIN = 150
+
+# Veicoli disponibili per giorno (None = nessun limite); i giri in eccesso slittano al giorno
+# successivo fino a MAX_GIORNI_RINVIO volte e mai oltre la finestra sicura del serbatoio più a
+# rischio del giro (bilanciamento.finestre_sicure), poi i loro clienti restano non serviti
+VEICOLI_PER_GIORNO = 6
+MAX_GIORNI_RINVIO = 2
+
+
+def tempo_servizio(litri, sosta=TEMPO_SOSTA_MIN, portata=PORTATA_POMPA_L_MIN):
+    return sosta + litri / portata
+
+
+def pianifica_giro(lavoro, domanda, servizio, durata_max=None, **parametri):
+    """
+    Lavoro di un giro (giorno, cluster): lavoro = (nodi, km, tempi), con km e tempi di guida (minuti)
+    del giro indicizzati come [deposito] + nodi, nel verso origine -> destinazione. Con il metodo 'vrp'
+    i clienti che da soli superano la capacità del veicolo o la durata del turno vengono esclusi.
+    Restituisce (veicoli come pianifica_veicoli, coppie (nodo non servito, motivo)).
+    """
+    nodi, km, tempi = lavoro
+    punti = np.array([0] + list(nodi))
+    locali = list(range(1, len(punti)))
+    domanda_giro = {i: domanda[punti[i]] for i in locali}
+    turno = None
+    esclusi = []
+    if parametri.get('metodo', METODO_SUDDIVISIONE) == 'vrp':
+        oltre = set(oltre_capacita(locali, domanda_giro, parametri.get('capacita', CAPACITA_VEICOLO_LITRI)))
+        esclusi += [(i, 'capacità veicolo') for i in locali if i in oltre]
+        locali = [i for i in locali if i not in oltre]
+    if durata_max is not None:
+        turno = Turno(tempi, {i: servizio[punti[i]] for i in locali}, durata_max)
+        esclusi += [(i, 'durata turno') for i in locali if not turno.ammissibile([i])]
+        locali = sorted(set(locali) - {i for i, _ in esclusi})
+    veicoli = pianifica_veicoli(km, locali, domanda_giro, turno=turno, **parametri)
+    return ([(dist, dist_nn, [int(punti[i]) for i in percorso]) for dist, dist_nn, percorso in veicoli],
+            [(int(punti[i]), motivo) for i, motivo in esclusi])
+
+
+def rinvio_sicuro(giorno, nodi, consumo, domanda):
+    # Giorni di rinvio ammessi dal serbatoio più a rischio del giro (fine della finestra sicura)
+    data = np.datetime64(giorno, 'D')
+    _, fine = finestre_sicure(np.full(len(nodi), data), [consumo[n] for n in nodi], [domanda[n] for n in nodi])
+    return int((fine - data).astype(int).min())
+
+
+def assegna_flotta(veicoli, flotta, max_rinvio=MAX_GIORNI_RINVIO, rinvio_massimo=None):
+    """
+    Limita a `flotta` i veicoli di ogni giorno. Ogni giro slitta al giorno dopo al massimo max_rinvio
+    volte e non oltre il proprio rinvio_massimo (giorni, allineato a veicoli; None = max_rinvio).
+    Hanno la precedenza i giri con meno giorni di rinvio residui, poi quelli con più litri per minuto
+    di turno. Restituisce (veicoli assegnati, con 'Data Consegna' e 'Giorni Rinvio' aggiornati,
+    coppie (veicolo scartato, motivo)).
+    """
+    if rinvio_massimo is None:
+        rinvio_massimo = [max_rinvio] * len(veicoli)
+    limite = {id(v): min(max_rinvio, r) for v, r in zip(veicoli, rinvio_massimo)}
+    in_attesa = defaultdict(list)
+    for v in veicoli:
+        in_attesa[v['Data Prevista']].append(v)
+    giorni = list(in_attesa)
+    heapq.heapify(giorni)
+    assegnati, scartati = [], []
+    while giorni:
+        giorno = heapq.heappop(giorni)
+        candidati = sorted(in_attesa.pop(giorno),
+                           key=lambda v: (limite[id(v)] - v['Giorni Rinvio'],
+                                          -v['Litri Consegnati'] / max(v['Durata Turno (min)'], 1)))
+        for k, v in enumerate(candidati):
+            if flotta is None or k < flotta:
+                v['Data Consegna'] = giorno
+                assegnati.append(v)
+            elif v['Giorni Rinvio'] < limite[id(v)]:
+                v['Giorni Rinvio'] += 1
+                successivo = giorno + timedelta(days=1)
+                if successivo not in in_attesa:
+                    heapq.heappush(giorni, successivo)
+                in_attesa[successivo].append(v)
             else:
-                gruppi.append(clienti[i:])
-            break
-        else:
-            gruppi.append(clienti[i:end])
-            i = end
-    return gruppi
-
-# Costruzione dei giri MULTI-VEICOLO 
-# Mappa i codici cluster in etichette leggibili (es. "0_0" → "Zona A1") 
-def mappa_zona(cluster_label):
-    if cluster_label.startswith("0_"):
-        return f"Zona A{int(cluster_label.split('_')[1]) + 1}"
-    elif cluster_label.startswith("1_"):
-        return f"Zona B{int(cluster_label.split('_')[1]) + 1}"
-    elif cluster_label == "2":
-        return "Zona C"
-    elif cluster_label == "3":
-        return "Zona D"
-    elif cluster_label == "outlier":
-        return "Zona X"
-    else:
-        return f"Zona ? ({cluster_label})"
-    
-risultati = []
-
-for giorno in sorted(df_piano['Data Consegna'].unique()):
-    sottoinsieme = df_piano[df_piano['Data Consegna'] == giorno]
-
-    for _, riga in sottoinsieme.iterrows():
-        clienti = eval(riga['Clienti']) if isinstance(riga['Clienti'], str) else riga['Clienti']
+                scartati.append((v, 'flotta' if v['Giorni Rinvio'] >= max_rinvio else 'finestra serbatoio'))
+    assegnati.sort(key=lambda v: (v['Data Consegna'], v['Data Prevista']))
+    return assegnati, scartati
+
+
+def esegui(precisione=PRECISIONE_DISTANZE, metodo=METODO_SUDDIVISIONE, capacita=CAPACITA_VEICOLO_LITRI,
+           min_clienti=MIN_CLIENTI_PER_VEICOLO, max_clienti=MAX_CLIENTI_PER_VEICOLO,
+           migliora=MIGLIORA_PERCORSI, tempo_max=TEMPO_MAX_PER_GIRO, n_processi=N_PROCESSI,
+           server_stradale=SERVER_STRADALE, durata_turno=DURATA_MAX_TURNO_MIN,
+           veicoli_per_giorno=VEICOLI_PER_GIORNO, max_rinvio=MAX_GIORNI_RINVIO):
+    """
+    Suddivisione di ogni giro (data, cluster) del piano tra più veicoli, con durata del turno
+    e veicoli disponibili per giorno. Restituisce un DataFrame con una riga per veicolo;
+    i clienti non serviti sono salvati in clienti_non_serviti.csv.
+    """
+    # Caricamento dati
+    df_coord = leggi_artefatto(
+        "clienti_validi_geocodificati.csv",
+        colonne=['Codice Cliente', 'latitudine', 'longitudine', 'Quantita_ultima_consegna', 'Consumo_medio_giornaliero']
+    )
+    df_piano = leggi_artefatto("piano_consegne_finale.csv")
+    df_piano['Data Consegna'] = pd.to_datetime(df_piano['Data Consegna']).dt.date
+
+    # Coordinate del deposito 
+    deposito_coord = (40.656361, 15.880113)
+
+    # Coordinate e indici di deposito + clienti (le distanze sono calcolate per giro)
+    matrice = MatriceDistanze.da_dataframe(df_coord, deposito_coord, precisione=precisione)
+
+    # Litri da consegnare e minuti di servizio per ogni nodo della matrice (stimati dall'ultima consegna)
+    domanda = {i + 1: q for i, q in enumerate(df_coord['Quantita_ultima_consegna'].fillna(0))}
+    servizio = {n: tempo_servizio(q) for n, q in domanda.items()}
+    consumo = {i + 1: c for i, c in enumerate(df_coord['Consumo_medio_giornaliero'])}
+
+    # Costruzione dei giri MULTI-VEICOLO 
+
+    # Un lavoro per ogni giro (giorno, cluster), in ordine di data; i lavori sono indipendenti
+    # e vengono distribuiti su più processi, con i risultati restituiti nello stesso ordine
+    df_piano = df_piano.sort_values('Data Consegna', kind='stable').reset_index(drop=True)
+    giri = [matrice.indici(clienti, ordina=False) for clienti in df_piano['Clienti']]
+
+    # Costi su strada di ogni giro (deposito + clienti): una tabella per giro dal server di routing
+    # o dalla cache (stimata se il server non risponde), passata così com'è al lavoro del giro
+    costi = CostiStradali(server_stradale, precisione=precisione)
+    with misura('costi_stradali'):
+        tabelle = costi.tabelle([(matrice.lat[[0] + nodi], matrice.lon[[0] + nodi]) for nodi in giri])
+    costi.chiudi()
+
+    with misura('giri_veicoli'):
+        esiti = esegui_in_parallelo(
+            pianifica_giro, [(nodi, km, minuti) for nodi, (km, minuti) in zip(giri, tabelle)],
+            n_processi=n_processi,
+            domanda=domanda,
+            servizio=servizio,
+            durata_max=durata_turno if metodo == 'vrp' else None,
+            metodo=metodo,
+            capacita=capacita,
+            min_clienti=min_clienti,
+            max_clienti=max_clienti,
+            migliora=migliora,
+            tempo_max=tempo_max
+        )
+
+    risultati = []
+    rinvio_massimo = []
+    non_serviti = []
+
+    for (_, riga), (veicoli, esclusi), nodi_giro, (_, minuti) in zip(df_piano.iterrows(), esiti, giri, tabelle):
+        giorno = riga['Data Consegna']
         cluster = riga['Cluster']
-        gruppi = suddividi_in_gruppi(clienti, min_clienti_per_veicolo, max_clienti_per_veicolo)
+        posizione = {n: i for i, n in enumerate([0] + nodi_giro)}
+        non_serviti += [(matrice.codici_da_indici([n])[0], giorno, cluster, motivo) for n, motivo in esclusi]
 
-        for i, gruppo in enumerate(gruppi):
-            df_gruppo = df_coord[df_coord['Codice Cliente'].isin(gruppo)]
-            dist, percorso = tsp_nearest_neighbor(df_gruppo, deposito_coord)
+        for i, (dist, dist_nn, nodi) in enumerate(veicoli):
+            percorso = matrice.codici_da_indici(nodi)
 
             id_veicolo = f'V{giorno}_C{cluster}_N{i+1}'
-            velocita_media_kmh = 40
-            tempo_per_cliente_min = 10
 
-            # Tempo guida in minuti
-            tempo_guida_min = (dist / velocita_media_kmh) * 60
+            # Tempo guida in minuti lungo il percorso aperto dal deposito, più il rientro per il turno
+            tappe = [posizione[n] for n in [0] + list(nodi)]
+            tempo_guida_min = float(minuti[tappe[:-1], tappe[1:]].sum())
+            tempo_rientro_min = float(minuti[tappe[-1], 0])
+            tempo_servizio_min = sum(servizio[n] for n in nodi)
             # Tempo totale = guida + consegne
-            tempo_totale_min = tempo_guida_min + len(percorso) * tempo_per_cliente_min
-
+            tempo_totale_min = tempo_guida_min + tempo_servizio_min
 
             risultati.append({
                 'Data Consegna': giorno,
+                'Data Prevista': giorno,
+                'Giorni Rinvio': 0,
                 'Cluster': cluster,
                 'Zona Consegna': mappa_zona(str(cluster)),
                 'Veicolo': id_veicolo,
                 'Numero Clienti': len(percorso),
+                'Litri Consegnati': round(sum(domanda[n] for n in nodi), 1),
                 'Distanza Stimata (km)': dist,
+                'Distanza NN (km)': dist_nn,
+                'Km risparmiati': round(dist_nn - dist, 2),
                 'Percorso Ottimo': percorso,
                 'Tempo Totale Stimato (min)': round(tempo_totale_min),
-                'Tempo Guida Stimato (min)': round(tempo_guida_min)
+                'Tempo Guida Stimato (min)': round(tempo_guida_min),
+                'Tempo Servizio (min)': round(tempo_servizio_min),
+                'Durata Turno (min)': round(tempo_totale_min + tempo_rientro_min)
             })
-
-# Esportazione finale 
-df_risultati = pd.DataFrame(risultati)
-df_risultati.to_csv("percorso_multi_veicolo.csv", index=False)
-
+            rinvio_massimo.append(rinvio_sicuro(giorno, nodi, consumo, domanda))
+
+    # Veicoli disponibili per giorno: i giri in eccesso slittano ai giorni successivi
+    # entro la finestra sicura del serbatoio più a rischio di ogni giro
+    risultati, scartati = assegna_flotta(risultati, veicoli_per_giorno, max_rinvio, rinvio_massimo)
+    non_serviti += [(c, v['Data Prevista'], v['Cluster'], motivo) for v, motivo in scartati for c in v['Percorso Ottimo']]
+
+    # Esportazione finale 
+    df_risultati = pd.DataFrame(risultati)
+    df_non_serviti = pd.DataFrame(non_serviti, columns=['Codice Cliente', 'Data Prevista', 'Cluster', 'Motivo'])
+    rinviati = df_risultati[df_risultati['Giorni Rinvio'] > 0]
+    print(f"Veicoli impiegati: {len(df_risultati)}, km totali: {df_risultati['Distanza Stimata (km)'].sum():.2f}")
+    print(f"Km risparmiati rispetto a Nearest Neighbor: {df_risultati['Km risparmiati'].sum():.2f} "
+          f"su {df_risultati['Distanza NN (km)'].sum():.2f}")
+    # Veicoli con risparmio negativo (ordine dei risparmi o del turno più lungo del Nearest Neighbor)
+    peggiori = df_risultati[df_risultati['Km risparmiati'] < 0]
+    print(f"Veicoli più lunghi del Nearest Neighbor: {len(peggiori)}")
+    for _, v in peggiori.iterrows():
+        print(f"  {v['Veicolo']}: {-v['Km risparmiati']:.2f} km in più")
+    print(f"Giri rinviati per la flotta: {len(rinviati)} ({rinviati['Numero Clienti'].sum()} clienti), "
+          f"clienti non serviti: {len(df_non_serviti)}")
+    scrivi_artefatto(df_risultati, "percorso_multi_veicolo.csv")
+    scrivi_artefatto(df_non_serviti, "clienti_non_serviti.csv")
+    return df_risultati
+
+
+if __name__ == "__main__":
+    esegui()
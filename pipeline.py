@@ -0,0 +1,265 @@
+import ast
+import hashlib
+import importlib
+import importlib.util
+import json
+import os
+import time
+
+from strumentazione import misura, scrivi_rapporto
+
+# Esecuzione unificata delle fasi del progetto, dalla previsione alla pianificazione multi-veicolo.
+# Ogni fase è la funzione esegui() del suo script; la sua impronta è un hash SHA-256 di
+# contenuto dei file di ingresso, parametri e codice sorgente della fase e dei moduli del progetto
+# che importa (anche indirettamente: modificando vrp.py si rieseguono le fasi che lo usano).
+# Una fase viene saltata se l'impronta coincide con quella dell'ultima esecuzione e i suoi file
+# di uscita non sono stati modificati: cambiando solo i limiti dei veicoli, ad esempio,
+# viene rieseguita solo la fase multi-veicolo. Poiché le uscite di una fase sono gli ingressi
+# delle successive, una fase rieseguita invalida a cascata solo le fasi che ne usano i file.
+
+PERCORSO_STATO = "stato_pipeline.json"
+PERCORSO_RAPPORTO = "rapporto_esecuzione.json"
+BLOCCO_HASH = 1 << 20
+
+# Parametri che non cambiano i file di uscita e non entrano nell'impronta
+PARAMETRI_ESCLUSI = {'mappa', 'n_processi', 'n_jobs'}
+
+
+class Fase:
+    def __init__(self, nome, modulo, ingressi, uscite):
+        self.nome = nome
+        self.modulo = modulo
+        self.ingressi = ingressi
+        self.uscite = uscite
+
+
+FASI = [
+    Fase('estrazione', 'estrazione',
+         ingressi=["estrazione per minervas REV01.xlsx"],
+         uscite=["estrazione_colonnare/manifesto.json"]),
+    Fase('regressione', 'regression_final',
+         ingressi=["estrazione_colonnare/manifesto.json"],
+         uscite=["risultati_random_forest.csv", "hotEncoding.csv", "modello_previsione.joblib"]),
+    Fase('geocodifica', 'fase_preclustring',
+         ingressi=["estrazione_colonnare/manifesto.json", "risultati_random_forest.csv"],
+         uscite=["clienti_validi_geocodificati.csv"]),
+    Fase('clustering', 'clustering',
+         ingressi=["clienti_validi_geocodificati.csv"],
+         uscite=["clienti_con_cluster_riparato.csv", "stato_clustering.joblib"]),
+    Fase('pianificazione', 'pianificazione',
+         ingressi=["clienti_con_cluster_riparato.csv"],
+         uscite=["piano_consegne_finale.csv", "percorso_ottimizzato_nearest_neightbor.csv"]),
+    Fase('multi_veicolo', 'pianificazione_multi_veicolo',
+         ingressi=["clienti_validi_geocodificati.csv", "piano_consegne_finale.csv"],
+         uscite=["percorso_multi_veicolo.csv", "clienti_non_serviti.csv"]),
+]
+
+# Parametri passati a esegui() di ogni fase (quelli assenti prendono il default dello script)
+PARAMETRI = {
+    'estrazione': {},
+    'regressione': {},
+    'geocodifica': {},
+    'clustering': {'mappa': True, 'incrementale': False},
+    'pianificazione': {'bilancia': False},
+    'multi_veicolo': {'min_clienti': 3, 'max_clienti': 8},
+}
+
+
+def hash_file(percorso):
+    # SHA-256 del contenuto del file (letto a blocchi); None se il file non esiste
+    if not os.path.exists(percorso):
+        return None
+    h = hashlib.sha256()
+    with open(percorso, 'rb') as f:
+        for blocco in iter(lambda: f.read(BLOCCO_HASH), b''):
+            h.update(blocco)
+    return h.hexdigest()
+
+
+def hash_artefatto(percorso):
+    # Un artefatto CSV è letto anche dalla sua copia Parquet (artefatti.py): si considerano entrambe
+    radice, estensione = os.path.splitext(percorso)
+    impronte = [hash_file(percorso)]
+    if estensione == '.csv':
+        impronte.append(hash_file(radice + '.parquet'))
+    return impronte if impronte[0] is not None else None
+
+
+def _origine_locale(nome, cartella):
+    # File sorgente del modulo se appartiene al progetto (stessa cartella), altrimenti None
+    try:
+        spec = importlib.util.find_spec(nome)
+    except (ImportError, ValueError):
+        return None
+    if spec is None or not spec.origin or not spec.origin.endswith('.py'):
+        return None
+    return spec.origin if os.path.dirname(os.path.abspath(spec.origin)) == cartella else None
+
+
+def moduli_progetto(nome, cartella=os.path.dirname(os.path.abspath(__file__))):
+    """
+    File sorgente del modulo e di tutti i moduli del progetto che importa, anche indirettamente
+    (import letti con ast, compresi quelli dentro le funzioni). Restituisce {nome: percorso}.
+    """
+    trovati = {}
+    da_visitare = [nome]
+    while da_visitare:
+        corrente = da_visitare.pop()
+        if corrente in trovati:
+            continue
+        origine = _origine_locale(corrente, cartella)
+        if origine is None:
+            continue
+        trovati[corrente] = origine
+        with open(origine, encoding='utf-8') as f:
+            albero = ast.parse(f.read(), filename=origine)
+        for nodo in ast.walk(albero):
+            if isinstance(nodo, ast.Import):
+                da_visitare.extend(alias.name.split('.')[0] for alias in nodo.names)
+            elif isinstance(nodo, ast.ImportFrom) and nodo.module and nodo.level == 0:
+                da_visitare.append(nodo.module.split('.')[0])
+    return trovati
+
+
+def parametri_fase(fase, cartella=os.path.dirname(os.path.abspath(__file__))):
+    """
+    Nomi dei parametri accettati da esegui() della fase, letti dal sorgente con ast (senza importare
+    il modulo); None se esegui() accetta **kwargs o il modulo non si trova.
+    """
+    origine = _origine_locale(fase.modulo, cartella)
+    if origine is None:
+        return None
+    with open(origine, encoding='utf-8') as f:
+        albero = ast.parse(f.read(), filename=origine)
+    for nodo in albero.body:
+        if isinstance(nodo, ast.FunctionDef) and nodo.name == 'esegui':
+            if nodo.args.kwarg is not None:
+                return None
+            return {a.arg for a in nodo.args.posonlyargs + nodo.args.args + nodo.args.kwonlyargs}
+    return None
+
+
+def impronta_fase(fase, parametri):
+    contenuto = {
+        'ingressi': {p: hash_artefatto(p) for p in fase.ingressi},
+        'parametri': {k: v for k, v in parametri.items() if k not in PARAMETRI_ESCLUSI},
+        'codice': {nome: hash_file(percorso) for nome, percorso in moduli_progetto(fase.modulo).items()},
+    }
+    return hashlib.sha256(json.dumps(contenuto, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def carica_stato(percorso=PERCORSO_STATO):
+    if not os.path.exists(percorso):
+        return {}
+    with open(percorso, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def salva_stato(stato, percorso=PERCORSO_STATO):
+    with open(percorso, 'w', encoding='utf-8') as f:
+        json.dump(stato, f, indent=2, sort_keys=True)
+
+
+def fase_aggiornata(fase, impronta, stato):
+    # La fase è aggiornata se impronta e uscite coincidono con quelle dell'ultima esecuzione
+    precedente = stato.get(fase.nome)
+    if precedente is None or precedente['impronta'] != impronta:
+        return False
+    return all(hash_artefatto(p) is not None and hash_artefatto(p) == precedente['uscite'].get(p)
+               for p in fase.uscite)
+
+
+def esegui_pipeline(fasi=FASI, parametri=PARAMETRI, forza=(), da=None, fino_a=None, percorso_stato=PERCORSO_STATO,
+                    cartella_profili=None):
+    """
+    Esegue in ordine le fasi non aggiornate.
+    forza: nomi delle fasi da rieseguire comunque; da / fino_a: prima e ultima fase considerate.
+    Ogni fase eseguita è misurata (strumentazione.py); con cartella_profili il profilo cProfile
+    di ogni fase è salvato in <cartella_profili>/<fase>.prof.
+    Restituisce una lista di (fase, 'eseguita' | 'saltata', secondi).
+    """
+    nomi = [f.nome for f in fasi]
+    for nome in list(forza) + [n for n in (da, fino_a) if n is not None]:
+        if nome not in nomi:
+            raise ValueError(f"Fase sconosciuta: {nome}")
+    inizio = nomi.index(da) if da else 0
+    fine = nomi.index(fino_a) + 1 if fino_a else len(fasi)
+
+    stato = carica_stato(percorso_stato)
+    esito = []
+    for fase in fasi[inizio:fine]:
+        parametri_fase = parametri.get(fase.nome, {})
+        mancanti = [p for p in fase.ingressi if not os.path.exists(p)]
+        if mancanti:
+            raise FileNotFoundError(f"Fase {fase.nome}: ingressi mancanti {mancanti}")
+
+        impronta = impronta_fase(fase, parametri_fase)
+        if fase.nome not in forza and fase_aggiornata(fase, impronta, stato):
+            print(f"[{fase.nome}] aggiornata, saltata")
+            esito.append((fase.nome, 'saltata', 0.0))
+            continue
+
+        print(f"[{fase.nome}] esecuzione")
+        profilo = os.path.join(cartella_profili, f"{fase.nome}.prof") if cartella_profili else None
+        with misura(fase.nome, profilo=profilo) as misurata:
+            importlib.import_module(fase.modulo).esegui(**parametri_fase)
+        durata = misurata['tempo_s']
+
+        stato[fase.nome] = {
+            'impronta': impronta,
+            'uscite': {p: hash_artefatto(p) for p in fase.uscite},
+            'eseguita': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'durata_s': round(durata, 3),
+        }
+        salva_stato(stato, percorso_stato)
+        print(f"[{fase.nome}] completata in {durata:.1f} s")
+        esito.append((fase.nome, 'eseguita', durata))
+    return esito
+
+
+def _valore(testo):
+    # Valori dei parametri da riga di comando: numeri, booleani, None e liste, altrimenti stringhe
+    try:
+        return json.loads(testo)
+    except json.JSONDecodeError:
+        return testo
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Esecuzione delle fasi con salto di quelle aggiornate")
+    parser.add_argument("--forza", nargs='*', default=[], help="fasi da rieseguire comunque")
+    parser.add_argument("--da", help="prima fase da considerare")
+    parser.add_argument("--fino-a", help="ultima fase da considerare")
+    parser.add_argument("--imposta", nargs='*', default=[], metavar="FASE.PARAMETRO=VALORE",
+                        help="es. multi_veicolo.max_clienti=10")
+    parser.add_argument("--senza-mappa", action="store_true", help="non genera la mappa del clustering")
+    parser.add_argument("--rapporto", default=PERCORSO_RAPPORTO, help="file JSON con tempi, memoria e contatori")
+    parser.add_argument("--profilo", metavar="CARTELLA", help="salva il profilo cProfile di ogni fase eseguita")
+    args = parser.parse_args()
+
+    parametri = {nome: dict(valori) for nome, valori in PARAMETRI.items()}
+    if args.senza_mappa:
+        parametri['clustering']['mappa'] = False
+    fasi = {fase.nome: fase for fase in FASI}
+    for voce in args.imposta:
+        chiave, _, valore = voce.partition('=')
+        nome_fase, _, nome_parametro = chiave.partition('.')
+        if nome_fase not in parametri or not nome_parametro:
+            parser.error(f"--imposta {voce}: fase sconosciuta o parametro mancante "
+                         f"(fasi: {', '.join(parametri)})")
+        # Un nome sbagliato (es. clustering.epss) fallirebbe solo all'esecuzione della fase
+        ammessi = parametri_fase(fasi[nome_fase])
+        if ammessi is not None and nome_parametro not in ammessi | set(PARAMETRI[nome_fase]):
+            parser.error(f"--imposta {voce}: parametro sconosciuto per la fase {nome_fase} "
+                         f"(parametri: {', '.join(sorted(ammessi))})")
+        parametri[nome_fase][nome_parametro] = _valore(valore)
+
+    if args.profilo:
+        os.makedirs(args.profilo, exist_ok=True)
+    esito = esegui_pipeline(parametri=parametri, forza=args.forza, da=args.da, fino_a=args.fino_a,
+                            cartella_profili=args.profilo)
+    scrivi_rapporto(args.rapporto, fasi=[{'fase': n, 'esito': e, 'tempo_s': round(s, 3)} for n, e, s in esito],
+                    parametri=parametri)
+    print(f"Rapporto dell'esecuzione salvato in {args.rapporto}")
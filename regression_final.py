@@ -1,76 +1,173 @@
 # Librerie generali
+import pickle
 import pandas as pd
 import numpy as np
 from datetime import timedelta
 
 # Machine Learning
 from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestRegressor
+from sklearn.ensemble import HistGradientBoostingRegressor, RandomForestRegressor
 from sklearn.linear_model import LinearRegression
 from sklearn.pipeline import Pipeline
 from sklearn.compose import ColumnTransformer
-from sklearn.preprocessing import OneHotEncoder
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
 
+from artefatti import lista_da_long, scrivi_artefatto
+from codifiche import CODIFICHE_DENSE, crea_codifica
+from estrazione import PERCORSO_ESTRAZIONE, leggi_estrazione, normalizza_estrazione
+from modelli import PERCORSO_MODELLO, impronta_dati, salva_modello
+from strumentazione import misura
 
-# Lettura e pulizia iniziale
-df = pd.read_excel("estrazione per minervas REV01.xlsx")
-df.columns = df.columns.str.strip().str.replace("'", "").str.replace("à", "a")
-df['Data'] = pd.to_datetime(df['Data'], dayfirst=True)
-df = df.sort_values(['Codice Cliente', 'Data'])
-
-# Filtra clienti con almeno 5 consegne
-consegne_per_cliente = df.groupby("Codice Cliente")['Data'].count().reset_index()
-clienti_validi = consegne_per_cliente[consegne_per_cliente['Data'] >= 5]['Codice Cliente']
-df_filtrato = df[df['Codice Cliente'].isin(clienti_validi)].copy()
-
-# Feature engineering
-df_filtrato['Data_prec'] = df_filtrato.groupby('Codice Cliente')['Data'].shift(1)
-df_filtrato['Quantita_prec'] = df_filtrato.groupby('Codice Cliente')['Quantita [litri]'].shift(1)
-df_filtrato['Giorni_trascorsi'] = (df_filtrato['Data'] - df_filtrato['Data_prec']).dt.days
-df_filtrato = df_filtrato.dropna(subset=['Giorni_trascorsi', 'Quantita_prec'])
-df_filtrato['Consumo_giornaliero'] = df_filtrato['Quantita_prec'] / df_filtrato['Giorni_trascorsi']
-df_filtrato['Mese'] = df_filtrato['Data'].dt.month
-df_filtrato['Stagione'] = df_filtrato['Mese'].apply(lambda x: 'Inverno' if x in [12,1,2] else 'Estate' if x in [6,7,8] else 'Intermedio')
-
-# Preprocessing
-categorical_features = ['Localita', 'Ragione sociale', 'Via', 'Stagione']
-numerical_features = ['Quantita_prec', 'Consumo_giornaliero']
-df_filtrato[numerical_features] = df_filtrato[numerical_features].replace([np.inf, -np.inf], np.nan)
-df_filtrato = df_filtrato.dropna(subset=categorical_features + numerical_features + ['Giorni_trascorsi'])
-
-X = df_filtrato[numerical_features + categorical_features]
-y = df_filtrato['Giorni_trascorsi']
-
-preprocessor = ColumnTransformer([
-    ('num', 'passthrough', numerical_features),
-    ('cat', OneHotEncoder(handle_unknown='ignore'), categorical_features)
-])
-
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-
-# Modello 1: Random Forest
-rf_model = Pipeline([
-    ('preprocessor', preprocessor),
-    ('regressor', RandomForestRegressor(n_estimators=100, random_state=42))
-])
-rf_model.fit(X_train, y_train)
-df_filtrato['Giorni_previsti_RF'] = rf_model.predict(X)
-
-# Modello 2: Regressione Lineare
-lr_model = Pipeline([
-    ('preprocessor', preprocessor),
-    ('regressor', LinearRegression())
-])
-lr_model.fit(X_train, y_train)
-df_filtrato['Giorni_previsti_LR'] = lr_model.predict(X)
-
-# Calcolo media per cliente e classificazione
+# Prima data di consegna prevista considerata, orizzonte (anni dall'ultima consegna) e numero massimo di date per cliente
+DATA_LIMITE = pd.Timestamp("2025-05-31")
+ANNI_PREVISIONE = 5
+MAX_DATE_PREVISTE = 10
+
+CATEGORICAL_FEATURES = ['Localita', 'Ragione sociale', 'Via', 'Stagione']
+NUMERICAL_FEATURES = ['Quantita_prec', 'Consumo_giornaliero']
+
+# Codifica delle feature categoriche: 'onehot' (originale), 'frequenza', 'target' o 'hash' (codifiche.py)
+CODIFICA = 'onehot'
+# Modello principale: 'random_forest' oppure 'hist_gradient_boosting' (solo con codifiche dense)
+MODELLO = 'random_forest'
+N_JOBS = -1   # processi per l'addestramento della Random Forest (-1 = tutti i core)
+
+
+# Classificazione dei clienti in base ai giorni medi previsti tra due consegne
 def classificazione(g):
     return 'Urgente' if g < 15 else ('Normale' if g <= 30 else 'Lento')
 
-for modello in ['RF', 'LR']:
-    media = df_filtrato.groupby('Codice Cliente')[f'Giorni_previsti_{modello}'].mean().reset_index()
+
+# Valutazione dei modelli, con tempi e memoria di addestramento e previsione se disponibili
+def valuta_modello(nome, y_true, y_pred, prestazioni=None):
+    print(f"\nValutazione modello: {nome}")
+    rmse = np.sqrt(mean_squared_error(y_true, y_pred))
+    mae = mean_absolute_error(y_true, y_pred)
+    r2 = r2_score(y_true, y_pred)
+    print(" - RMSE:", round(rmse, 2))
+    print(" - MAE :", round(mae, 2))
+    print(" - R²  :", round(r2, 3))
+    metriche = {'rmse': float(rmse), 'mae': float(mae), 'r2': float(r2)}
+    if prestazioni:
+        print(f" - Fit    : {prestazioni['fit_s']:.2f} s (picco RSS {prestazioni['fit_picco_rss_mb']:.0f} MB)")
+        print(f" - Predict: {prestazioni['predict_s']:.2f} s (picco RSS {prestazioni['predict_picco_rss_mb']:.0f} MB)")
+        print(f" - Modello: {prestazioni['modello_mb']:.1f} MB serializzato")
+    return metriche
+
+
+def aggiungi_feature(df):
+    """
+    Feature del modello per consegne con Data, Data_prec e Quantita_prec (giorni trascorsi,
+    consumo giornaliero, stagione): usata in addestramento e dal servizio di previsione.
+    """
+    df['Giorni_trascorsi'] = (df['Data'] - df['Data_prec']).dt.days
+    df['Consumo_giornaliero'] = df['Quantita_prec'] / df['Giorni_trascorsi']
+    df['Mese'] = df['Data'].dt.month
+    df['Stagione'] = np.select([df['Mese'].isin([12, 1, 2]), df['Mese'].isin([6, 7, 8])], ['Inverno', 'Estate'],
+                               'Intermedio')
+    df[NUMERICAL_FEATURES] = df[NUMERICAL_FEATURES].replace([np.inf, -np.inf], np.nan)
+    return df
+
+
+def prepara_dati(df):
+    """
+    Pulizia dell'estrazione e feature engineering: una riga per consegna (dalla seconda in poi)
+    dei clienti con almeno 5 consegne, con le feature del modello e il target Giorni_trascorsi.
+    """
+    # Nomi delle colonne, date e ordinamento (già pronti se i dati vengono dalla cache colonnare)
+    df = normalizza_estrazione(df)
+
+    # Filtra clienti con almeno 5 consegne
+    consegne_per_cliente = df.groupby("Codice Cliente")['Data'].count().reset_index()
+    clienti_validi = consegne_per_cliente[consegne_per_cliente['Data'] >= 5]['Codice Cliente']
+    df_filtrato = df[df['Codice Cliente'].isin(clienti_validi)].copy()
+
+    # Feature engineering
+    df_filtrato['Data_prec'] = df_filtrato.groupby('Codice Cliente')['Data'].shift(1)
+    df_filtrato['Quantita_prec'] = df_filtrato.groupby('Codice Cliente')['Quantita [litri]'].shift(1)
+    df_filtrato = aggiungi_feature(df_filtrato.dropna(subset=['Data_prec', 'Quantita_prec']).copy())
+    return df_filtrato.dropna(subset=CATEGORICAL_FEATURES + NUMERICAL_FEATURES + ['Giorni_trascorsi'])
+
+
+def crea_regressore(modello=MODELLO, n_jobs=N_JOBS):
+    if modello == 'random_forest':
+        return RandomForestRegressor(n_estimators=100, random_state=42, n_jobs=n_jobs)
+    if modello == 'hist_gradient_boosting':
+        return HistGradientBoostingRegressor(random_state=42)
+    raise ValueError(f"Modello non supportato: {modello}")
+
+
+def crea_modello(regressore, codifica=CODIFICA):
+    # Pipeline con le feature numeriche invariate e quelle categoriche codificate
+    if isinstance(regressore, HistGradientBoostingRegressor) and codifica not in CODIFICHE_DENSE:
+        raise ValueError(f"HistGradientBoosting richiede una codifica densa {sorted(CODIFICHE_DENSE)}, non '{codifica}'")
+    preprocessor = ColumnTransformer([
+        ('num', 'passthrough', NUMERICAL_FEATURES),
+        ('cat', crea_codifica(codifica), CATEGORICAL_FEATURES)
+    ])
+    return Pipeline([
+        ('preprocessor', preprocessor),
+        ('regressor', regressore)
+    ])
+
+
+def intervallo_consegne(media_giorni, quantita):
+    # Giorni tra due consegne previste: media arrotondata (almeno 1), aumentata del 10% ogni 1000 litri
+    giorni = np.maximum(np.rint(np.asarray(media_giorni, dtype=float)), 1)
+    moltiplicatore = 1 + (np.nan_to_num(np.asarray(quantita, dtype=float)) / 1000) * 0.1
+    return np.maximum(np.rint(giorni * moltiplicatore), 1).astype(np.int64)
+
+
+def date_previste(codici, data_ultima, media_giorni, quantita, data_limite=DATA_LIMITE, anni=ANNI_PREVISIONE,
+                  max_date=MAX_DATE_PREVISTE):
+    """
+    Date di consegna previste di tutti i clienti in forma lunga (Codice Cliente, Date_consegna_previste):
+    ultima consegna + k * intervallo (k >= 1) fino a `anni` anni dopo l'ultima consegna,
+    solo dalle date >= data_limite e al massimo max_date per cliente.
+    Calcolo vettoriale in datetime64[D]: per ogni cliente si ricavano il primo e l'ultimo k validi.
+    """
+    ultima = pd.to_datetime(pd.Series(np.asarray(data_ultima))).dt.normalize()
+    giorni = intervallo_consegne(media_giorni, quantita)
+    inizio = ultima.to_numpy().astype('datetime64[D]')
+    fine = (ultima + pd.DateOffset(years=anni)).to_numpy().astype('datetime64[D]')
+
+    giorni_al_limite = (np.datetime64(pd.Timestamp(data_limite).date(), 'D') - inizio).astype(np.int64)
+    primo_k = np.maximum(1, -(-giorni_al_limite // giorni))
+    ultimo_k = (fine - inizio).astype(np.int64) // giorni
+    conteggi = np.clip(ultimo_k - primo_k + 1, 0, max_date)
+
+    righe = np.repeat(np.arange(len(giorni)), conteggi)
+    posizione = np.arange(len(righe)) - np.repeat(np.cumsum(conteggi) - conteggi, conteggi)
+    date = inizio[righe] + ((primo_k[righe] + posizione) * giorni[righe]).astype('timedelta64[D]')
+    return pd.DataFrame({
+        'Codice Cliente': np.asarray(codici)[righe],
+        'Date_consegna_previste': date.astype('datetime64[ns]'),
+    })
+
+
+def _genera_date_riferimento(row):
+    # Implementazione originale riga per riga (senza limite di date), usata solo come riferimento nel benchmark
+    giorni = int(round(row['Media_giorni_previsti']))
+    if giorni <= 0: giorni = 1
+    moltiplicatore = 1 + (row['Quantita_ultima_consegna'] / 1000) * 0.1
+    giorni = int(round(giorni * moltiplicatore))
+    start = row['Data_ultima_consegna'] + timedelta(days=giorni)
+    end = row['Data_ultima_consegna'] + pd.DateOffset(years=5)
+    current = start
+    future_dates = []
+    while current <= end:
+        if current >= DATA_LIMITE:
+            future_dates.append(current.date())
+        current += timedelta(days=giorni)
+    return future_dates
+
+
+def riepilogo_clienti(df_filtrato, colonna_previsioni):
+    """
+    Riepilogo per cliente delle previsioni in colonna_previsioni: media dei giorni previsti e classe,
+    ultima consegna, date di consegna previste (colonna lista) e consumo medio giornaliero.
+    """
+    media = df_filtrato.groupby('Codice Cliente')[colonna_previsioni].mean().reset_index()
     media.columns = ['Codice Cliente', 'Media_giorni_previsti']
     media['Classe_cliente'] = media['Media_giorni_previsti'].apply(classificazione)
 
@@ -81,54 +178,122 @@ for modello in ['RF', 'LR']:
 
     media_completa = media.merge(ultima_data, on='Codice Cliente').merge(ultima_quantita, on='Codice Cliente')
 
-    def genera_date(row):
-        giorni = int(round(row['Media_giorni_previsti']))
-        if giorni <= 0: giorni = 1
-        moltiplicatore = 1 + (row['Quantita_ultima_consegna'] / 1000) * 0.1
-        giorni = int(round(giorni * moltiplicatore))
-        start = row['Data_ultima_consegna'] + timedelta(days=giorni)
-        end = row['Data_ultima_consegna'] + pd.DateOffset(years=5)
-        data_limite = pd.to_datetime("2025-05-31")
-        current = start
-        future_dates = []
-        while current <= end:
-            if current >= data_limite:
-                future_dates.append(current.date())
-            current += timedelta(days=giorni)
-        return future_dates
-
-
-    media_completa['Date_consegna_previste'] = media_completa.apply(genera_date, axis=1)
+    # Date previste in forma lunga, riportate in una colonna lista (Arrow) nell'ordine dei clienti
+    long = date_previste(media_completa['Codice Cliente'], media_completa['Data_ultima_consegna'],
+                         media_completa['Media_giorni_previsti'], media_completa['Quantita_ultima_consegna'])
+    conteggi = long['Codice Cliente'].value_counts().reindex(media_completa['Codice Cliente'], fill_value=0)
+    media_completa['Date_consegna_previste'] = lista_da_long(
+        long['Date_consegna_previste'].to_numpy().astype('datetime64[D]'), conteggi.to_numpy(), media_completa.index)
 
     # Calcolo del consumo medio giornaliero
     media_completa['Consumo_medio_giornaliero'] = media_completa['Quantita_ultima_consegna'] / media_completa['Media_giorni_previsti']
     media_completa['Consumo_medio_giornaliero'] = media_completa['Consumo_medio_giornaliero'].round(1)
-    # Riduzione delle date a massimo 10 per cliente
-    media_completa['Date_consegna_previste'] = media_completa['Date_consegna_previste'].apply(lambda x: x[:10])
 
     # Ordinamento per priorità
     media_completa['Classe_ordine'] = media_completa['Classe_cliente'].map({'Urgente': 0, 'Normale': 1, 'Lento': 2})
-    # Dopo il calcolo di media_completa, salva tutti i clienti (non solo 3)
-    media_completa.to_csv("hotEncoding.csv", index=False)
+    return media_completa
 
 
-    # Selezione di un solo cliente per ogni classe
-    clienti_selezionati = media_completa.sort_values(by='Classe_ordine').groupby('Classe_cliente').head(1)
+def esempio_sintetico(X):
+    """
+    Riga di esempio salvata nei metadati del modello (riscaldamento e prova del servizio):
+    mediane delle feature numeriche, stagione più frequente e valori fittizi per le colonne
+    anagrafiche, così che nel file del modello non finiscano dati reali dei clienti.
+    """
+    esempio = {c: float(X[c].median()) for c in NUMERICAL_FEATURES}
+    for c in CATEGORICAL_FEATURES:
+        esempio[c] = str(X[c].mode().iloc[0]) if c == 'Stagione' else 'ESEMPIO'
+    return [esempio]
 
-    # Stampa finale
-    risultato = clienti_selezionati[['Codice Cliente', 'Classe_cliente', 'Quantita_ultima_consegna', 'Consumo_medio_giornaliero', 'Date_consegna_previste']]
-    print(f"\nRisultati modello: {modello}")
-    print(risultato.reset_index(drop=True))
 
-    # Valutazione dei modelli
-def valuta_modello(nome, y_true, y_pred):
-    print(f"\nValutazione modello: {nome}")
-    rmse = np.sqrt(mean_squared_error(y_true, y_pred))
-    mae = mean_absolute_error(y_true, y_pred)
-    r2 = r2_score(y_true, y_pred)
-    print(" - RMSE:", round(rmse, 2))
-    print(" - MAE :", round(mae, 2))
-    print(" - R²  :", round(r2, 3))
+def addestra_e_prevedi(nome, modello, X_train, y_train, X):
+    # Addestramento e previsione su tutte le righe, misurando tempi, picco di memoria e dimensione del modello
+    with misura(nome):
+        with misura('fit') as fit:
+            modello.fit(X_train, y_train)
+        with misura('predict') as predict:
+            previsioni = modello.predict(X)
+    prestazioni = {
+        'fit_s': fit['tempo_s'], 'fit_picco_rss_mb': fit['picco_rss_mb'],
+        'predict_s': predict['tempo_s'], 'predict_picco_rss_mb': predict['picco_rss_mb'],
+        'modello_mb': len(pickle.dumps(modello)) / 2**20,
+    }
+    return previsioni, prestazioni
+
+
+def esegui(percorso_estrazione=PERCORSO_ESTRAZIONE, codifica=CODIFICA, modello=MODELLO, n_jobs=N_JOBS,
+           percorso_modello=PERCORSO_MODELLO):
+    """
+    Previsione dei giorni tra due consegne (modello principale e Regressione Lineare) e generazione
+    delle date di consegna previste per cliente. Restituisce il risultato del modello principale.
+    codifica: codifica delle feature categoriche; modello: 'random_forest' o 'hist_gradient_boosting'.
+    Il modello principale viene salvato in percorso_modello (modelli.py) per il servizio di previsione.
+    """
+    # Lettura dalla cache colonnare dell'estrazione (estrazione.py) e feature engineering
+    df_filtrato = prepara_dati(leggi_estrazione(percorso_estrazione))
+
+    X = df_filtrato[NUMERICAL_FEATURES + CATEGORICAL_FEATURES]
+    y = df_filtrato['Giorni_trascorsi']
+
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+
+    # Modello 1: Random Forest (o HistGradientBoosting); le sue previsioni restano nelle colonne *_RF
+    # e in risultati_random_forest.csv, letti dalle fasi successive
+    rf_model = crea_modello(crea_regressore(modello, n_jobs), codifica)
+    df_filtrato['Giorni_previsti_RF'], prestazioni_rf = addestra_e_prevedi(modello, rf_model, X_train, y_train, X)
+
+    # Modello 2: Regressione Lineare
+    lr_model = crea_modello(LinearRegression(), codifica)
+    df_filtrato['Giorni_previsti_LR'], prestazioni_lr = addestra_e_prevedi('regressione_lineare', lr_model,
+                                                                           X_train, y_train, X)
+
+    # Calcolo media per cliente e classificazione
+    for sigla in ['RF', 'LR']:
+        media_completa = riepilogo_clienti(df_filtrato, f'Giorni_previsti_{sigla}')
+        # Dopo il calcolo di media_completa, salva tutti i clienti (non solo 3)
+        scrivi_artefatto(media_completa, "hotEncoding.csv")
+        # Le previsioni della Random Forest sono l'input della fase di geocodifica
+        if sigla == 'RF':
+            scrivi_artefatto(media_completa, "risultati_random_forest.csv")
+            risultato_rf = media_completa
+
+
+        # Selezione di un solo cliente per ogni classe
+        clienti_selezionati = media_completa.sort_values(by='Classe_ordine').groupby('Classe_cliente').head(1)
+
+        # Stampa finale
+        risultato = clienti_selezionati[['Codice Cliente', 'Classe_cliente', 'Quantita_ultima_consegna', 'Consumo_medio_giornaliero', 'Date_consegna_previste']]
+        print(f"\nRisultati modello: {sigla}")
+        print(risultato.reset_index(drop=True))
+
+    # Valutazione dei modelli sul test set (previsioni già calcolate su tutte le righe)
+    nome_modello = "Random Forest" if modello == 'random_forest' else "HistGradientBoosting"
+    metriche = valuta_modello(f"{nome_modello} ({codifica})", y_test, df_filtrato.loc[X_test.index, 'Giorni_previsti_RF'],
+                              prestazioni_rf)
+    valuta_modello(f"Regressione Lineare ({codifica})", y_test, df_filtrato.loc[X_test.index, 'Giorni_previsti_LR'],
+                   prestazioni_lr)
+
+    metadati = salva_modello(rf_model, {
+        'modello': modello,
+        'codifica': codifica,
+        'feature_numeriche': NUMERICAL_FEATURES,
+        'feature_categoriche': CATEGORICAL_FEATURES,
+        'righe_addestramento': len(X_train),
+        'impronta_dati': impronta_dati(X_train, y_train),
+        'metriche_test': metriche,
+        'prestazioni': prestazioni_rf,
+        'esempio': esempio_sintetico(X_train),
+    }, percorso_modello)
+    print(f"\nModello {metadati['versione_modello']} salvato in {percorso_modello}")
+    return risultato_rf
+
+
+if __name__ == "__main__":
+    import argparse
 
-valuta_modello("Random Forest", y_test, rf_model.predict(X_test))
-valuta_modello("Regressione Lineare", y_test, lr_model.predict(X_test))
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Previsione dei giorni tra due consegne e date previste")
+    parser.add_argument("--codifica", default=CODIFICA, choices=['onehot', 'frequenza', 'target', 'hash'])
+    parser.add_argument("--modello", default=MODELLO, choices=['random_forest', 'hist_gradient_boosting'])
+    parser.add_argument("--n-jobs", type=int, default=N_JOBS)
+    args = parser.parse_args()
+    esegui(codifica=args.codifica, modello=args.modello, n_jobs=args.n_jobs)
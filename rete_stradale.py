@@ -0,0 +1,381 @@
+import http.client
+import json
+import queue
+import sqlite3
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from distanze import PRECISIONI, haversine_km
+from strumentazione import incrementa
+
+# Costi stradali (km e minuti di guida) tra i punti di un giro, richiesti in blocco a un server
+# di routing con l'API "table" di OSRM: una richiesta per giro invece di una per coppia.
+# Le connessioni HTTP restano aperte e vengono riusate (pool), le matrici ottenute sono salvate
+# per coppia di punti in una cache SQLite persistente. Senza server raggiungibile i costi sono
+# stimati dalla distanza in linea d'aria per un fattore di deviazione e una velocità media.
+# `python rete_stradale.py` avvia un server locale compatibile con OSRM per le prove.
+
+PERCORSO_CACHE = "cache_rete_stradale.sqlite"
+FATTORE_DEVIAZIONE = 1.3      # km su strada / km in linea d'aria
+VELOCITA_MEDIA_KMH = 40
+MAX_PUNTI_TABELLA = 100       # limite di coordinate per richiesta (max-table-size di OSRM)
+CONNESSIONI = 4
+TIMEOUT_S = 10
+ERRORI_MAX = 3                # risposte di errore consecutive dopo cui il server non viene più usato
+DECIMALI_CHIAVE = 5           # ~1 m: punti più vicini condividono la voce in cache
+SECONDI_AL_GIORNO = 86400
+
+
+def chiave_punto(lat, lon):
+    return f"{lat:.{DECIMALI_CHIAVE}f},{lon:.{DECIMALI_CHIAVE}f}"
+
+
+def stima_costi(lat, lon, fattore=FATTORE_DEVIAZIONE, velocita_kmh=VELOCITA_MEDIA_KMH, precisione='haversine'):
+    # Matrici (km, minuti) stimate: distanza in linea d'aria x fattore di deviazione, a velocità media costante
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    km = PRECISIONI[precisione](lat[:, None], lon[:, None], lat[None, :], lon[None, :]) * fattore
+    return km, km / velocita_kmh * 60
+
+
+class PoolConnessioni:
+    """
+    Connessioni HTTP persistenti (keep-alive) verso un host, riusate tra le richieste.
+    Una connessione che fallisce viene chiusa e non torna nel pool; se era riusata (il server
+    può averla chiusa mentre era inattiva) la richiesta viene ripetuta una volta su una connessione nuova.
+    """
+
+    def __init__(self, url, dimensione=CONNESSIONI, timeout=TIMEOUT_S):
+        parti = urlsplit(url)
+        self.host = parti.hostname
+        self.porta = parti.port
+        self.prefisso = parti.path.rstrip('/')
+        self.classe = http.client.HTTPSConnection if parti.scheme == 'https' else http.client.HTTPConnection
+        self.timeout = timeout
+        self.libere = queue.LifoQueue()
+        self.semaforo = threading.BoundedSemaphore(dimensione)
+        self.aperte = 0
+        self._lock = threading.Lock()
+
+    def _apri(self):
+        with self._lock:
+            self.aperte += 1
+        return self.classe(self.host, self.porta, timeout=self.timeout)
+
+    def _chiudi(self, conn):
+        conn.close()
+        with self._lock:
+            self.aperte -= 1
+
+    def _scambia(self, conn, percorso):
+        try:
+            conn.request('GET', self.prefisso + percorso)
+            risposta = conn.getresponse()
+            return risposta, risposta.read()
+        except Exception:
+            self._chiudi(conn)
+            raise
+
+    def richiedi(self, percorso):
+        # GET del percorso indicato: restituisce il corpo JSON decodificato
+        with self.semaforo:
+            try:
+                conn = self.libere.get_nowait()
+            except queue.Empty:
+                conn = None
+            if conn is None:
+                conn = self._apri()
+                risposta, corpo = self._scambia(conn, percorso)
+            else:
+                try:
+                    risposta, corpo = self._scambia(conn, percorso)
+                except (OSError, http.client.HTTPException):
+                    # Connessione keep-alive chiusa dal server (RemoteDisconnected, BrokenPipe): un nuovo tentativo
+                    conn = self._apri()
+                    risposta, corpo = self._scambia(conn, percorso)
+            self.libere.put(conn)
+        if risposta.status != 200:
+            raise ValueError(f"Errore del server di routing ({risposta.status}): {corpo[:200]!r}")
+        return json.loads(corpo)
+
+    def chiudi(self):
+        while not self.libere.empty():
+            self._chiudi(self.libere.get_nowait())
+
+
+class CacheRete:
+    # Cache su disco coppia di punti -> (km, minuti) con scadenza (TTL)
+
+    def __init__(self, percorso=PERCORSO_CACHE, ttl_giorni=180):
+        self.ttl = ttl_giorni * SECONDI_AL_GIORNO
+        self.conn = sqlite3.connect(percorso)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS costi ("
+            " origine TEXT, destinazione TEXT, km REAL, minuti REAL, salvato REAL NOT NULL,"
+            " PRIMARY KEY (origine, destinazione))"
+        )
+        with self.conn:
+            self.conn.execute("DELETE FROM costi WHERE salvato < ?", (time.time() - self.ttl,))
+
+    def leggi(self, chiavi):
+        # Matrici (km, minuti) tra le chiavi fornite, oppure None se manca anche una sola coppia
+        posizione = {c: i for i, c in enumerate(dict.fromkeys(chiavi))}
+        n = len(posizione)
+        km = np.full((n, n), np.nan)
+        minuti = np.full((n, n), np.nan)
+        distinte = list(posizione)
+        for inizio in range(0, len(distinte), 400):
+            blocco = distinte[inizio:inizio + 400]
+            segnaposto = ",".join("?" * len(blocco))
+            righe = self.conn.execute(
+                f"SELECT origine, destinazione, km, minuti FROM costi WHERE origine IN ({segnaposto})"
+                f" AND destinazione IN ({','.join('?' * len(distinte))})",
+                blocco + distinte,
+            )
+            for origine, destinazione, k, m in righe:
+                km[posizione[origine], posizione[destinazione]] = k
+                minuti[posizione[origine], posizione[destinazione]] = m
+        np.fill_diagonal(km, 0.0)
+        np.fill_diagonal(minuti, 0.0)
+        if np.isnan(km).any():
+            return None
+        # Le chiavi ripetute (punti coincidenti) hanno le stesse righe della prima occorrenza
+        indici = [posizione[c] for c in chiavi]
+        return km[np.ix_(indici, indici)], minuti[np.ix_(indici, indici)]
+
+    def scrivi(self, tabelle):
+        # tabelle: (chiavi, km, minuti) per ogni giro, salvate in un'unica transazione
+        adesso = time.time()
+        righe = [(o, d, float(km[i, j]), float(minuti[i, j]), adesso)
+                 for chiavi, km, minuti in tabelle
+                 for i, o in enumerate(chiavi) for j, d in enumerate(chiavi) if o != d]
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO costi (origine, destinazione, km, minuti, salvato) VALUES (?, ?, ?, ?, ?)",
+                righe,
+            )
+
+    def voci(self):
+        return self.conn.execute("SELECT COUNT(*) FROM costi").fetchone()[0]
+
+    def chiudi(self):
+        self.conn.close()
+
+
+class CostiStradali:
+    """
+    Fornitore delle matrici di costo stradale (km, minuti) tra i punti di ogni giro.
+    url: server compatibile con OSRM (es. "http://localhost:5000"); None = solo stima.
+    Se il server non è raggiungibile (anche su una connessione nuova) o restituisce errori_max risposte
+    di errore consecutive si passa alla stima per il resto dell'esecuzione; i giri con un errore
+    isolato usano la stima.
+    """
+
+    def __init__(self, url=None, percorso_cache=PERCORSO_CACHE, fattore=FATTORE_DEVIAZIONE,
+                 velocita_kmh=VELOCITA_MEDIA_KMH, precisione='haversine', connessioni=CONNESSIONI,
+                 timeout=TIMEOUT_S, max_punti=MAX_PUNTI_TABELLA, profilo='driving', errori_max=ERRORI_MAX):
+        self.fattore = fattore
+        self.velocita_kmh = velocita_kmh
+        self.precisione = precisione
+        self.connessioni = connessioni
+        self.max_punti = max_punti
+        self.profilo = profilo
+        self.errori_max = errori_max
+        self.errori = 0
+        self.pool = PoolConnessioni(url, connessioni, timeout) if url else None
+        self.cache = CacheRete(percorso_cache) if url and percorso_cache else None
+        self.statistiche = {'giri': 0, 'cache_hit': 0, 'richieste': 0, 'stimati': 0}
+        self._lock = threading.Lock()
+
+    def stima(self, lat, lon):
+        return stima_costi(lat, lon, self.fattore, self.velocita_kmh, self.precisione)
+
+    def tabella(self, lat, lon):
+        return self.tabelle([(lat, lon)])[0]
+
+    def tabelle(self, punti_giri):
+        """
+        Matrici (km, minuti) per ogni giro, dato come coppia di array (lat, lon).
+        I giri mancanti in cache sono richiesti al server in parallelo sulle connessioni del pool.
+        """
+        punti_giri = [(np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)) for lat, lon in punti_giri]
+        risultati = [None] * len(punti_giri)
+        self.statistiche['giri'] += len(punti_giri)
+
+        # Giri da richiedere, raggruppati per insieme di punti (giri identici: una sola richiesta)
+        da_richiedere = {}
+        for i, (lat, lon) in enumerate(punti_giri):
+            if self.pool is None:
+                continue
+            chiavi = [chiave_punto(a, b) for a, b in zip(lat, lon)]
+            trovato = self.cache.leggi(chiavi) if self.cache is not None else None
+            if trovato is not None:
+                risultati[i] = trovato
+                self.statistiche['cache_hit'] += 1
+                incrementa('cache_rete_hit')
+            else:
+                da_richiedere.setdefault(tuple(chiavi), []).append(i)
+                incrementa('cache_rete_miss')
+
+        if da_richiedere:
+            gruppi = list(da_richiedere.items())
+            with ThreadPoolExecutor(self.connessioni) as executor:
+                matrici = list(executor.map(lambda g: self._richiedi(*punti_giri[g[1][0]]), gruppi))
+            for (_, indici), esito in zip(gruppi, matrici):
+                for i in indici:
+                    risultati[i] = esito
+            if self.cache is not None:
+                self.cache.scrivi([(chiavi, *esito) for (chiavi, _), esito in zip(gruppi, matrici)
+                                   if esito is not None])
+
+        for i, (lat, lon) in enumerate(punti_giri):
+            if risultati[i] is None:
+                risultati[i] = self.stima(lat, lon)
+                self.statistiche['stimati'] += 1
+                incrementa('costi_stimati')
+        return risultati
+
+    def _richiedi(self, lat, lon):
+        # Tabella dal server, a blocchi di origini x destinazioni se i punti superano max_punti;
+        # None se il server non è raggiungibile (da qui in poi si usa la stima)
+        pool = self.pool
+        if pool is None:
+            return None
+        n = len(lat)
+        km = np.empty((n, n))
+        minuti = np.empty((n, n))
+        passo = n if n <= self.max_punti else self.max_punti // 2
+        try:
+            for o in range(0, n, passo):
+                for d in range(0, n, passo):
+                    origini = np.arange(o, min(o + passo, n))
+                    destinazioni = np.arange(d, min(d + passo, n))
+                    k, m = self._richiedi_blocco(pool, lat, lon, origini, destinazioni)
+                    km[np.ix_(origini, destinazioni)] = k
+                    minuti[np.ix_(origini, destinazioni)] = m
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            # Errore di rete (già ripetuto su una connessione nuova) oppure risposte di errore ripetute:
+            # il server viene abbandonato; una risposta di errore isolata vale solo per questo giro
+            with self._lock:
+                self.errori += 1
+                abbandona = not isinstance(e, ValueError) or self.errori >= self.errori_max
+                if abbandona and self.pool is not None:
+                    warnings.warn(f"Server di routing non utilizzabile ({e}): costi stimati con fattore {self.fattore}")
+                    self.pool = None
+                    pool.chiudi()
+            return None
+        with self._lock:
+            self.errori = 0
+
+        # Coppie senza percorso (null nella risposta): stima
+        mancanti = np.isnan(km) | np.isnan(minuti)
+        if mancanti.any():
+            km_stima, minuti_stima = self.stima(lat, lon)
+            km[mancanti] = km_stima[mancanti]
+            minuti[mancanti] = minuti_stima[mancanti]
+        return km, minuti
+
+    def _richiedi_blocco(self, pool, lat, lon, origini, destinazioni):
+        if len(origini) == len(lat) and len(destinazioni) == len(lat):
+            punti, parametri = np.arange(len(lat)), ""
+        else:
+            punti = np.union1d(origini, destinazioni)
+            posizione = {p: i for i, p in enumerate(punti)}
+            parametri = (f"&sources={';'.join(str(posizione[p]) for p in origini)}"
+                         f"&destinations={';'.join(str(posizione[p]) for p in destinazioni)}")
+        coordinate = ";".join(f"{lon[p]:.6f},{lat[p]:.6f}" for p in punti)
+        with self._lock:
+            incrementa('richieste_tabella')
+            self.statistiche['richieste'] += 1
+        corpo = pool.richiedi(f"/table/v1/{self.profilo}/{coordinate}?annotations=distance,duration{parametri}")
+        if corpo.get('code') != 'Ok':
+            raise ValueError(f"Errore del server di routing: {corpo.get('code')} {corpo.get('message', '')}")
+        km = np.array(corpo['distances'], dtype=float) / 1000
+        minuti = np.array(corpo['durations'], dtype=float) / 60
+        return km, minuti
+
+    def chiudi(self):
+        if self.pool is not None:
+            self.pool.chiudi()
+        if self.cache is not None:
+            self.cache.chiudi()
+
+
+def crea_server_locale(host="127.0.0.1", porta=5000, fattore=1.4, velocita_kmh=35,
+                       max_punti=MAX_PUNTI_TABELLA, asimmetria=0.0):
+    """
+    Server HTTP locale con l'API table di OSRM (GET /table/v1/<profilo>/<lon,lat;...>),
+    con costi sintetici: haversine x fattore a velocità costante. Solo per le prove.
+    Con asimmetria > 0 i costi dipendono dal verso, come su strada (sensi unici, salite):
+    verso nord x (1 + asimmetria), verso sud x (1 - asimmetria).
+    """
+    class Gestore(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"   # keep-alive: una connessione serve più richieste
+        disable_nagle_algorithm = True  # intestazioni e corpo senza attendere l'ACK del client
+
+        def _rispondi(self, stato, corpo):
+            dati = json.dumps(corpo).encode()
+            self.send_response(stato)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(dati)))
+            self.end_headers()
+            self.wfile.write(dati)
+
+        def do_GET(self):
+            self.server.richieste += 1
+            parti = urlsplit(self.path)
+            segmenti = parti.path.strip('/').split('/')
+            if len(segmenti) != 4 or segmenti[:2] != ['table', 'v1']:
+                return self._rispondi(400, {'code': 'InvalidUrl', 'message': 'percorso sconosciuto'})
+            try:
+                lon, lat = np.array([c.split(',') for c in segmenti[3].split(';')], dtype=float).T
+                query = parse_qs(parti.query)
+                n = len(lat)
+                origini = [int(i) for i in query['sources'][0].split(';')] if 'sources' in query else list(range(n))
+                destinazioni = ([int(i) for i in query['destinations'][0].split(';')]
+                                if 'destinations' in query else list(range(n)))
+            except (ValueError, IndexError):
+                return self._rispondi(400, {'code': 'InvalidQuery', 'message': 'coordinate o indici non validi'})
+            if n > max_punti:
+                return self._rispondi(400, {'code': 'TooBig', 'message': f'più di {max_punti} coordinate'})
+            metri = haversine_km(lat[origini, None], lon[origini, None],
+                                 lat[None, destinazioni], lon[None, destinazioni]) * fattore * 1000
+            metri = metri * (1 + asimmetria * np.sign(lat[None, destinazioni] - lat[origini, None]))
+            self._rispondi(200, {'code': 'Ok',
+                                 'distances': np.round(metri, 1).tolist(),
+                                 'durations': np.round(metri / (velocita_kmh / 3.6), 1).tolist()})
+
+        def log_message(self, *argomenti):
+            pass   # nessun log per richiesta
+
+    server = ThreadingHTTPServer((host, porta), Gestore)
+    server.daemon_threads = True
+    server.richieste = 0
+    return server
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Server locale compatibile con l'API table di OSRM (costi sintetici)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=5000)
+    parser.add_argument("--fattore", type=float, default=1.4, help="km su strada / km in linea d'aria")
+    parser.add_argument("--velocita", type=float, default=35, help="velocità media (km/h)")
+    parser.add_argument("--asimmetria", type=float, default=0.0,
+                        help="costi dipendenti dal verso: verso nord x (1 + a), verso sud x (1 - a)")
+    args = parser.parse_args()
+
+    server = crea_server_locale(args.host, args.porta, args.fattore, args.velocita, asimmetria=args.asimmetria)
+    print(f"Server di routing locale su http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
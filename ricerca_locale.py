@@ -0,0 +1,127 @@
+import time
+
+import numpy as np
+
+from distanze import tsp_nearest_neighbor
+
+# Miglioramento dei percorsi costruiti con Nearest Neighbor tramite ricerca locale
+# (2-opt e Or-opt) sulla matrice delle distanze precalcolata.
+# I percorsi sono aperti: partono dal deposito e terminano all'ultimo cliente,
+# come nel calcolo delle distanze di tsp_nearest_neighbor. La matrice può essere asimmetrica
+# (costi su strada): le mosse che invertono un segmento ne contano il costo nel nuovo verso.
+
+EPS = 1e-9
+
+
+def lista_vicini(km, nodi, k=8):
+    # Per ogni nodo del giro (deposito incluso) i k nodi più vicini dello stesso giro
+    nodi = np.asarray(nodi, dtype=int)
+    sotto = km[np.ix_(nodi, nodi)]
+    ordine = np.argsort(sotto, axis=1)[:, 1:k + 1]
+    return {int(nodi[i]): [int(nodi[j]) for j in ordine[i]] for i in range(len(nodi))}
+
+
+def _arco(km, a, b):
+    # Costo dell'arco a -> b; b=None indica la fine del percorso aperto
+    return 0.0 if b is None else km[a, b]
+
+
+def _inversione(km, segmento):
+    # Costo aggiuntivo per percorrere il segmento al contrario (0 con una matrice simmetrica)
+    if len(segmento) < 2:
+        return 0.0
+    return float(km[segmento[1:], segmento[:-1]].sum() - km[segmento[:-1], segmento[1:]].sum())
+
+
+def _due_opt(km, p, vicini, scadenza):
+    """
+    Un passo di 2-opt con liste di vicini: inverte p[i..j] se il nuovo arco (p[i-1], p[j])
+    accorcia il percorso. Restituisce True se ha trovato un miglioramento.
+    """
+    n = len(p)
+    pos = {nodo: idx for idx, nodo in enumerate(p)}
+    # Somme prefisse degli archi nei due versi: costo dell'inversione di p[i..j] in O(1)
+    avanti = np.concatenate([[0.0], np.cumsum(km[p[:-1], p[1:]])])
+    indietro = np.concatenate([[0.0], np.cumsum(km[p[1:], p[:-1]])])
+    for i in range(1, n - 1):
+        a, b = p[i - 1], p[i]
+        for c in vicini[a]:
+            j = pos[c]
+            if j <= i:
+                continue
+            succ = p[j + 1] if j + 1 < n else None
+            delta = (km[a, c] + _arco(km, b, succ) - km[a, b] - _arco(km, c, succ)
+                     + indietro[j] - indietro[i] - avanti[j] + avanti[i])
+            if delta < -EPS:
+                p[i:j + 1] = p[i:j + 1][::-1]
+                return True
+        if time.process_time() > scadenza:
+            return False
+    return False
+
+
+def _or_opt(km, p, vicini, scadenza, lunghezza_max=3):
+    """
+    Un passo di Or-opt: sposta un segmento di 1..3 clienti (eventualmente invertito)
+    accanto a uno dei vicini del suo primo o ultimo cliente.
+    """
+    n = len(p)
+    for lunghezza in range(1, lunghezza_max + 1):
+        for i in range(1, n - lunghezza + 1):
+            segmento = p[i:i + lunghezza]
+            prec = p[i - 1]
+            succ = p[i + lunghezza] if i + lunghezza < n else None
+            guadagno = km[prec, segmento[0]] + _arco(km, segmento[-1], succ) - _arco(km, prec, succ)
+
+            resto = p[:i] + p[i + lunghezza:]
+            inversione = _inversione(km, segmento)
+            pos = {nodo: idx for idx, nodo in enumerate(resto)}
+            candidati = set()
+            for estremo in (segmento[0], segmento[-1]):
+                for c in vicini[estremo]:
+                    if c in pos:
+                        candidati.add(pos[c])
+                        if pos[c] > 0:
+                            candidati.add(pos[c] - 1)
+
+            # Inserimento tra resto[k] e resto[k+1], nei due versi del segmento
+            for k in sorted(candidati):
+                a = resto[k]
+                b = resto[k + 1] if k + 1 < len(resto) else None
+                for seg, extra in ((segmento, 0.0), (segmento[::-1], inversione)):
+                    costo = km[a, seg[0]] + _arco(km, seg[-1], b) - _arco(km, a, b) + extra
+                    if costo - guadagno < -EPS:
+                        p[:] = resto[:k + 1] + seg + resto[k + 1:]
+                        return True
+            if time.process_time() > scadenza:
+                return False
+    return False
+
+
+def migliora_percorso(km, percorso, partenza=0, tempo_max=0.05, k_vicini=8):
+    """
+    Applica 2-opt e Or-opt al percorso (lista di nodi, deposito escluso) fino a un ottimo locale
+    o allo scadere di `tempo_max` secondi di CPU (indipendenti dal carico della macchina).
+    Restituisce (distanza arrotondata, percorso migliorato).
+    """
+    p = [partenza] + [int(n) for n in percorso]
+    if len(p) > 2:
+        vicini = lista_vicini(km, p, k=k_vicini)
+        scadenza = time.process_time() + tempo_max
+        while time.process_time() <= scadenza:
+            if _due_opt(km, p, vicini, scadenza):
+                continue
+            if _or_opt(km, p, vicini, scadenza):
+                continue
+            break
+    distanza = float(km[p[:-1], p[1:]].sum())
+    return round(distanza, 2), p[1:]
+
+
+def percorso_giro(km, nodi, partenza=0, migliora=True, tempo_max=0.05):
+    # Nearest Neighbor seguito (opzionalmente) da 2-opt / Or-opt: restituisce (distanza, distanza NN, percorso)
+    dist_nn, percorso = tsp_nearest_neighbor(km, nodi, partenza)
+    dist = dist_nn
+    if migliora:
+        dist, percorso = migliora_percorso(km, percorso, partenza, tempo_max=tempo_max)
+    return dist, dist_nn, percorso
@@ -0,0 +1,133 @@
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.cluster import KMeans
+from sklearn.metrics import silhouette_score
+from sklearn.neighbors import NearestNeighbors
+from sklearn.preprocessing import StandardScaler
+
+from distanze import RAGGIO_TERRA_KM, haversine_km
+
+# Selezione automatica (senza grafici) dei parametri del clustering:
+# - eps di DBSCAN dal gomito della curva k-distance ordinata;
+# - numero di sottocluster KMeans per ogni cluster che supera il limite di clienti
+#   o di raggio della zona (approssimazione della lunghezza dei giri).
+# I candidati sono valutati in parallelo con un silhouette score su un campione,
+# perché quello completo è O(n²) in tempo e memoria.
+
+
+def curva_k_distanza(punti, min_samples=4, metrica='euclidean'):
+    """
+    Distanza di ogni punto dal suo min_samples-esimo vicino (punto stesso incluso), in ordine crescente.
+    Con metrica 'haversine' i punti sono (lat, lon) in gradi e le distanze in km.
+    """
+    if metrica == 'haversine':
+        X = np.radians(np.asarray(punti, dtype=float))
+        d, _ = NearestNeighbors(n_neighbors=min_samples, metric='haversine', algorithm='ball_tree').fit(X).kneighbors(X)
+        return np.sort(d[:, -1]) * RAGGIO_TERRA_KM
+    d, _ = NearestNeighbors(n_neighbors=min_samples).fit(punti).kneighbors(punti)
+    return np.sort(d[:, -1])
+
+
+def trova_gomito(curva):
+    """
+    Indice del gomito di una curva crescente e convessa: il punto più distante dalla corda
+    che unisce gli estremi, con entrambi gli assi normalizzati in [0, 1].
+    """
+    n = len(curva)
+    if n < 3 or curva[-1] == curva[0]:
+        return n - 1
+    x = np.linspace(0.0, 1.0, n)
+    y = (curva - curva[0]) / (curva[-1] - curva[0])
+    return int(np.argmax(x - y))
+
+
+def stima_eps(punti, min_samples=4, quota_outlier_max=0.03, metrica='euclidean'):
+    """
+    eps di DBSCAN dal gomito della curva k-distance.
+    Se il gomito lascerebbe fuori dai punti core più di quota_outlier_max dei clienti,
+    eps viene alzato al quantile corrispondente della curva.
+    Restituisce (eps, curva), in km con metrica 'haversine'.
+    """
+    curva = curva_k_distanza(punti, min_samples, metrica)
+    eps = curva[trova_gomito(curva)]
+    if quota_outlier_max is not None:
+        eps = max(eps, np.quantile(curva, 1.0 - quota_outlier_max))
+    return float(eps), curva
+
+
+def silhouette_campionata(X, labels, campione=2000, seed=42, metrica='euclidean'):
+    # Silhouette score su al più `campione` punti (NaN se c'è un solo cluster); con 'haversine' X è in gradi
+    if len(np.unique(labels)) < 2:
+        return np.nan
+    if metrica == 'haversine':
+        X = np.radians(np.asarray(X, dtype=float))
+    sample_size = campione if len(X) > campione else None
+    return float(silhouette_score(X, labels, metric=metrica, sample_size=sample_size, random_state=seed))
+
+
+def raggio_zona_km(lat, lon, percentile=95):
+    # Raggio della zona: percentile della distanza dei clienti dal baricentro
+    return float(np.percentile(haversine_km(lat, lon, np.mean(lat), np.mean(lon)), percentile))
+
+
+def zona_da_suddividere(coords, max_clienti_zona, raggio_max_km):
+    return len(coords) > max_clienti_zona or raggio_zona_km(coords[:, 0], coords[:, 1]) > raggio_max_km
+
+
+def _valuta_k(cluster, coords, k, max_clienti_zona, raggio_max_km, campione, seed):
+    # KMeans con k gruppi sulle coordinate standardizzate del cluster e verifica dei vincoli di zona
+    scaler = StandardScaler().fit(coords)
+    scaled = scaler.transform(coords)
+    kmeans = KMeans(n_clusters=k, random_state=seed).fit(scaled)
+    labels = kmeans.labels_
+    raggi = [raggio_zona_km(coords[labels == s, 0], coords[labels == s, 1]) for s in range(k)]
+    return {
+        'cluster': cluster,
+        'k': k,
+        'silhouette': silhouette_campionata(scaled, labels, campione, seed),
+        'max_clienti': int(np.bincount(labels).max()),
+        'max_raggio_km': max(raggi),
+        'scaler': scaler,
+        'kmeans': kmeans,
+    }
+
+
+def scegli_sottocluster(coordinate, labels, max_clienti_zona=300, raggio_max_km=30.0, k_candidati=5,
+                        tolleranza_silhouette=0.01, campione=2000, n_processi=None, seed=42):
+    """
+    Per ogni cluster DBSCAN che supera max_clienti_zona clienti o raggio_max_km di raggio
+    valuta k = k_min .. k_min + k_candidati - 1 sottocluster (k_min dal limite di clienti).
+    Tra i candidati che rispettano entrambi i limiti sceglie il k più piccolo con silhouette campionato
+    entro tolleranza_silhouette dal migliore (meno zone, meno giri); se nessuno li rispetta,
+    quello con il raggio massimo più piccolo.
+    n_processi: None = tutti i core, 1 = seriale.
+    Restituisce (dizionario cluster -> (scaler, KMeans), valutazioni di tutti i candidati).
+    """
+    coordinate = np.asarray(coordinate, dtype=float)
+    lavori = []
+    for cluster in np.unique(labels[labels != -1]):
+        coords = coordinate[labels == cluster]
+        if not zona_da_suddividere(coords, max_clienti_zona, raggio_max_km):
+            continue
+        k_min = max(2, int(np.ceil(len(coords) / max_clienti_zona)))
+        for k in range(k_min, min(k_min + k_candidati, len(coords))):
+            lavori.append((int(cluster), coords, k))
+
+    valutazioni = Parallel(n_jobs=-1 if n_processi is None else n_processi)(
+        delayed(_valuta_k)(cluster, coords, k, max_clienti_zona, raggio_max_km, campione, seed)
+        for cluster, coords, k in lavori
+    )
+
+    sottocluster = {}
+    for cluster in dict.fromkeys(v['cluster'] for v in valutazioni):
+        candidati = [v for v in valutazioni if v['cluster'] == cluster]
+        validi = [v for v in candidati
+                  if v['max_clienti'] <= max_clienti_zona and v['max_raggio_km'] <= raggio_max_km]
+        if validi:
+            migliore = max(np.nan_to_num(v['silhouette'], nan=-1.0) for v in validi)
+            scelto = min((v for v in validi if np.nan_to_num(v['silhouette'], nan=-1.0) >= migliore - tolleranza_silhouette),
+                         key=lambda v: v['k'])
+        else:
+            scelto = min(candidati, key=lambda v: (v['max_raggio_km'], v['k']))
+        sottocluster[cluster] = (scelto['scaler'], scelto['kmeans'])
+    return sottocluster, valutazioni
@@ -0,0 +1,222 @@
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from modelli import PERCORSO_MODELLO, carica_modello
+from regression_final import CATEGORICAL_FEATURES, NUMERICAL_FEATURES, aggiungi_feature
+
+# Servizio di previsione dei giorni tra due consegne sul modello salvato da regression_final.py.
+# Il modello viene caricato una sola volta e "riscaldato" con una previsione di prova;
+# le richieste concorrenti sono raccolte in micro-batch (fino a MAX_BATCH righe o ATTESA_MAX_MS)
+# e previste con un'unica chiamata a predict(), il cui costo fisso (ad es. i 100 alberi della
+# Random Forest) viene così diviso tra le richieste.
+# Il server HTTP locale (libreria standard) espone POST /prevedi e GET /salute.
+
+MAX_BATCH = 256
+ATTESA_MAX_MS = 5.0
+HOST = "127.0.0.1"
+PORTA = 8765
+
+
+def eventi_in_feature(eventi):
+    """
+    Feature del modello da eventi di consegna (lista di dizionari). Ogni evento contiene
+    Localita, Ragione sociale e Via e, per le feature numeriche, Data, Data_prec e Quantita_prec
+    oppure direttamente Quantita_prec, Consumo_giornaliero e Stagione.
+    """
+    df = pd.DataFrame(list(eventi))
+    if df.empty:
+        raise ValueError("Nessun evento da prevedere")
+    if 'Consumo_giornaliero' not in df or 'Stagione' not in df:
+        for colonna in ('Data', 'Data_prec'):
+            if colonna not in df:
+                raise ValueError(f"Colonna mancante negli eventi: {colonna}")
+            df[colonna] = pd.to_datetime(df[colonna])
+        df = aggiungi_feature(df)
+    mancanti = [c for c in NUMERICAL_FEATURES + CATEGORICAL_FEATURES if c not in df]
+    if mancanti:
+        raise ValueError(f"Colonne mancanti negli eventi: {mancanti}")
+    return df[NUMERICAL_FEATURES + CATEGORICAL_FEATURES]
+
+
+class ServizioPrevisioni:
+    """
+    Previsioni a micro-batch sul modello salvato: invia() accoda le righe di una richiesta
+    e restituisce un Future; un thread raccoglie le richieste in attesa e le prevede insieme.
+    """
+
+    def __init__(self, percorso=PERCORSO_MODELLO, max_batch=MAX_BATCH, attesa_max_ms=ATTESA_MAX_MS):
+        self.modello, self.metadati = carica_modello(percorso)
+        self.max_batch = max_batch
+        self.attesa_max = attesa_max_ms / 1000
+        self.statistiche = {'richieste': 0, 'righe': 0, 'batch': 0, 'batch_divisi': 0}
+        self._coda = queue.Queue()
+        self._riscalda()
+        self._thread = threading.Thread(target=self._ciclo, daemon=True)
+        self._thread.start()
+
+    def _riscalda(self):
+        # Previsione sull'esempio salvato nei metadati, prima di accettare richieste
+        esempio = self.metadati.get('esempio')
+        if esempio:
+            self.modello.predict(pd.DataFrame(esempio))
+
+    def invia(self, X):
+        futuro = Future()
+        self._coda.put((X, futuro))
+        return futuro
+
+    def prevedi_eventi(self, eventi, timeout=None):
+        return self.invia(eventi_in_feature(eventi)).result(timeout)
+
+    def _ciclo(self):
+        while True:
+            richiesta = self._coda.get()
+            if richiesta is None:
+                return
+            richieste = [richiesta]
+            righe = len(richiesta[0])
+            scadenza = time.monotonic() + self.attesa_max
+            while righe < self.max_batch:
+                try:
+                    richiesta = self._coda.get(timeout=max(0.0, scadenza - time.monotonic()))
+                except queue.Empty:
+                    break
+                if richiesta is None:
+                    self._coda.put(None)
+                    break
+                richieste.append(richiesta)
+                righe += len(richiesta[0])
+            self._prevedi_batch(richieste)
+
+    def _prevedi_batch(self, richieste):
+        try:
+            previsioni = self.modello.predict(pd.concat([X for X, _ in richieste], ignore_index=True))
+        except Exception:
+            # Una richiesta non valida fa fallire il batch: si prevede ogni richiesta da sola,
+            # così l'errore arriva solo a chi l'ha inviata
+            for X, futuro in richieste:
+                try:
+                    futuro.set_result(self.modello.predict(X))
+                except Exception as e:
+                    futuro.set_exception(e)
+            self.statistiche['batch_divisi'] += 1
+        else:
+            inizio = 0
+            for X, futuro in richieste:
+                futuro.set_result(previsioni[inizio:inizio + len(X)])
+                inizio += len(X)
+        self.statistiche['richieste'] += len(richieste)
+        self.statistiche['righe'] += sum(len(X) for X, _ in richieste)
+        self.statistiche['batch'] += 1
+
+    def chiudi(self):
+        self._coda.put(None)
+        self._thread.join()
+
+
+class ServerPrevisioni(ThreadingHTTPServer):
+    request_queue_size = 128   # connessioni in attesa: le richieste arrivano a raffiche
+    daemon_threads = True
+
+
+def crea_server(servizio, host=HOST, porta=PORTA):
+    # Server HTTP locale: POST /prevedi {"eventi": [...]} -> {"giorni_previsti": [...]}, GET /salute
+    class Gestore(BaseHTTPRequestHandler):
+        def _rispondi(self, stato, corpo):
+            dati = json.dumps(corpo).encode()
+            self.send_response(stato)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(dati)))
+            self.end_headers()
+            self.wfile.write(dati)
+
+        def do_GET(self):
+            if self.path != '/salute':
+                return self._rispondi(404, {'errore': 'percorso sconosciuto'})
+            m = servizio.metadati
+            self._rispondi(200, {
+                'versione_modello': m['versione_modello'], 'creato': m['creato'], 'modello': m.get('modello'),
+                'codifica': m.get('codifica'), 'metriche_test': m.get('metriche_test'),
+                'statistiche': servizio.statistiche,
+            })
+
+        def do_POST(self):
+            if self.path != '/prevedi':
+                return self._rispondi(404, {'errore': 'percorso sconosciuto'})
+            try:
+                corpo = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                previsioni = servizio.prevedi_eventi(corpo['eventi'])
+            except KeyError as e:
+                return self._rispondi(400, {'errore': f"Campo mancante nella richiesta: {e}"})
+            except (ValueError, TypeError) as e:
+                return self._rispondi(400, {'errore': str(e)})
+            except Exception as e:
+                return self._rispondi(500, {'errore': f"Errore interno: {type(e).__name__}: {e}"})
+            self._rispondi(200, {'versione_modello': servizio.metadati['versione_modello'],
+                                 'giorni_previsti': np.round(previsioni, 2).tolist()})
+
+        def log_message(self, *argomenti):
+            pass   # nessun log per richiesta
+
+    return ServerPrevisioni((host, porta), Gestore)
+
+
+def prova_carico(url, eventi, n_richieste=1000, concorrenza=32):
+    # Richieste concorrenti di un evento ciascuna: restituisce latenze (ms) e richieste al secondo
+    from concurrent.futures import ThreadPoolExecutor
+    from urllib.request import Request, urlopen
+
+    def richiesta(i):
+        corpo = json.dumps({'eventi': [eventi[i % len(eventi)]]}, default=str).encode()
+        t0 = time.perf_counter()
+        with urlopen(Request(url + '/prevedi', data=corpo, headers={'Content-Type': 'application/json'})) as r:
+            r.read()
+        return (time.perf_counter() - t0) * 1000
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concorrenza) as executor:
+        latenze = np.array(list(executor.map(richiesta, range(n_richieste))))
+    return latenze, n_richieste / (time.perf_counter() - t0)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Servizio HTTP locale di previsione dei giorni tra due consegne")
+    parser.add_argument("--modello", default=PERCORSO_MODELLO)
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--porta", type=int, default=PORTA)
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    parser.add_argument("--attesa-ms", type=float, default=ATTESA_MAX_MS)
+    parser.add_argument("--prova", type=int, metavar="N",
+                        help="invia N richieste concorrenti con l'esempio del modello e termina")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    servizio = ServizioPrevisioni(args.modello, args.max_batch, args.attesa_ms)
+    server = crea_server(servizio, args.host, args.porta)
+    print(f"Modello {servizio.metadati['versione_modello']} caricato in {time.perf_counter() - t0:.2f} s, "
+          f"in ascolto su http://{args.host}:{server.server_port}")
+
+    if args.prova:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        latenze, al_secondo = prova_carico(f"http://{args.host}:{server.server_port}",
+                                           servizio.metadati['esempio'], args.prova)
+        print(f"{args.prova} richieste: {al_secondo:.0f} al secondo, latenza p50 {np.percentile(latenze, 50):.1f} ms, "
+              f"p95 {np.percentile(latenze, 95):.1f} ms; {servizio.statistiche['batch']} batch "
+              f"({servizio.statistiche['righe'] / max(servizio.statistiche['batch'], 1):.1f} righe per batch)")
+        server.shutdown()
+    else:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    server.server_close()
+    servizio.chiudi()
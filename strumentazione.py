@@ -0,0 +1,142 @@
+import cProfile
+import json
+import os
+import platform
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows: niente tempi CPU dei processi figli né picco RSS da getrusage
+    resource = None
+
+# Strumentazione delle esecuzioni: per ogni misura (fase della pipeline o punto caldo al suo interno)
+# tempo reale, tempo CPU (processo e figli), picco di memoria RSS e variazione dei contatori
+# (valutazioni di distanza, chiamate al geocoder, hit della cache, ...).
+# Le misure possono essere annidate; il rapporto dell'esecuzione viene scritto in JSON.
+
+CONTATORI = Counter()
+
+_MISURE = []     # misure completate, nell'ordine di chiusura
+_ATTIVE = []     # misure aperte (pila), per i nomi annidati e il picco di memoria
+
+
+def incrementa(nome, n=1):
+    CONTATORI[nome] += n
+
+
+def _leggi_status(campo):
+    # Valore in MB di un campo di /proc/self/status (Linux), None se non disponibile
+    try:
+        with open('/proc/self/status') as f:
+            for riga in f:
+                if riga.startswith(campo + ':'):
+                    return int(riga.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _picco_rss_mb():
+    # Picco RSS del processo dall'ultimo azzeramento (VmHWM); in alternativa il massimo da getrusage
+    picco = _leggi_status('VmHWM')
+    if picco is None and resource is not None:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        picco = maxrss / 2**20 if sys.platform == 'darwin' else maxrss / 1024
+    return picco
+
+
+def _azzera_picco_rss():
+    # Azzera VmHWM (Linux); il picco corrente viene prima riportato alle misure aperte
+    for attiva in _ATTIVE:
+        attiva['picco'] = max(attiva['picco'] or 0.0, _picco_rss_mb() or 0.0)
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _tempi_cpu():
+    if resource is None:
+        return time.process_time(), 0.0
+    proprio = resource.getrusage(resource.RUSAGE_SELF)
+    figli = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return proprio.ru_utime + proprio.ru_stime, figli.ru_utime + figli.ru_stime
+
+
+@contextmanager
+def misura(nome, profilo=None):
+    """
+    Misura il blocco di codice: tempo reale, CPU del processo e dei figli terminati,
+    picco RSS e contatori incrementati nel blocco.
+    profilo: percorso di un file .prof in cui salvare il profilo cProfile del blocco.
+    """
+    attiva = {'nome': '.'.join([a['nome_breve'] for a in _ATTIVE] + [nome]), 'nome_breve': nome, 'picco': None}
+    _azzera_picco_rss()
+    _ATTIVE.append(attiva)
+    contatori_prima = CONTATORI.copy()
+    cpu_prima, cpu_figli_prima = _tempi_cpu()
+    profiler = cProfile.Profile() if profilo else None
+    t0 = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    try:
+        yield attiva
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(profilo)
+        durata = time.perf_counter() - t0
+        cpu, cpu_figli = _tempi_cpu()
+        _ATTIVE.pop()
+        picco = max(attiva['picco'] or 0.0, _picco_rss_mb() or 0.0)
+        for esterna in _ATTIVE:
+            esterna['picco'] = max(esterna['picco'] or 0.0, picco)
+        delta = CONTATORI.copy()
+        delta.subtract(contatori_prima)
+        voce = {
+            'nome': attiva['nome'],
+            'tempo_s': round(durata, 4),
+            'cpu_s': round(cpu - cpu_prima, 4),
+            'cpu_figli_s': round(cpu_figli - cpu_figli_prima, 4),
+            'picco_rss_mb': round(picco, 1),
+            'contatori': {k: v for k, v in sorted(delta.items()) if v},
+            'profilo': profilo,
+        }
+        attiva.update(voce)   # la misura restituita dal with contiene i valori finali
+        _MISURE.append(voce)
+
+
+def misure(prefisso=None):
+    # Misure completate, opzionalmente solo quelle annidate in `prefisso`
+    return [m for m in _MISURE if prefisso is None or m['nome'].startswith(prefisso + '.')]
+
+
+def rapporto(**extra):
+    # Rapporto dell'esecuzione: misure, contatori totali e informazioni sull'ambiente
+    picco_figli = None
+    if resource is not None:
+        picco_figli = round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)
+    return {
+        'creato': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'piattaforma': platform.platform(),
+        'cpu': os.cpu_count(),
+        'misure': misure(),
+        'contatori': dict(sorted(CONTATORI.items())),
+        'picco_rss_figli_mb': picco_figli,
+        **extra,
+    }
+
+
+def scrivi_rapporto(percorso, **extra):
+    with open(percorso, 'w', encoding='utf-8') as f:
+        json.dump(rapporto(**extra), f, indent=2, ensure_ascii=False, default=str)
+
+
+def azzera():
+    CONTATORI.clear()
+    _MISURE.clear()
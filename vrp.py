@@ -0,0 +1,264 @@
+import time
+
+import numpy as np
+
+from distanze import tsp_nearest_neighbor
+from ricerca_locale import migliora_percorso, percorso_giro
+
+# VRP capacitato per la suddivisione dei clienti di un giro tra più veicoli:
+# costruzione con l'algoritmo dei risparmi di Clarke-Wright (vincoli di capacità in litri
+# e numero massimo di clienti), accorpamento dei giri troppo piccoli, ricerca locale
+# tra giri (spostamento di singoli clienti) e 2-opt / Or-opt sul singolo giro.
+# Con un Turno ogni unione e inserimento è ammesso solo se il giro resta entro la durata massima.
+
+EPS = 1e-9
+
+
+class Turno:
+    """
+    Vincolo di durata del turno: guida dal deposito al rientro (matrice tempi in minuti,
+    indicizzata come km) più i tempi di servizio dei clienti, entro durata_max minuti.
+    """
+
+    def __init__(self, tempi, servizio, durata_max, partenza=0):
+        self.tempi = tempi
+        self.servizio = servizio
+        self.durata_max = durata_max
+        self.partenza = partenza
+
+    def durata(self, giro):
+        if not giro:
+            return 0.0
+        sequenza = [self.partenza] + list(giro) + [self.partenza]
+        return float(self.tempi[sequenza[:-1], sequenza[1:]].sum()) + sum(self.servizio.get(n, 0.0) for n in giro)
+
+    def ammissibile(self, giro):
+        return self.durata(giro) <= self.durata_max + EPS
+
+    def aumento(self, a, b, nodo):
+        # Minuti in più inserendo `nodo` tra a e b (b=None: in coda, prima del rientro)
+        b = self.partenza if b is None else b
+        t = self.tempi
+        return t[a, nodo] + t[nodo, b] - t[a, b] + self.servizio.get(nodo, 0.0)
+
+
+def _costo_aperto(km, giro, partenza=0):
+    # Lunghezza del percorso aperto deposito -> clienti (senza ritorno)
+    if not giro:
+        return 0.0
+    sequenza = [partenza] + giro
+    return float(km[sequenza[:-1], sequenza[1:]].sum())
+
+
+def _inserimento_migliore(km, giro, nodo, partenza=0, turno=None):
+    # Posizione e costo aggiuntivo del miglior inserimento di `nodo` nel percorso aperto;
+    # con un turno solo le posizioni che non superano la durata massima (None se nessuna)
+    sequenza = [partenza] + giro
+    migliore, posizione = np.inf, None
+    margine = turno.durata_max - turno.durata(giro) if turno is not None else np.inf
+    for k in range(len(sequenza)):
+        a = sequenza[k]
+        b = sequenza[k + 1] if k + 1 < len(sequenza) else None
+        costo = km[a, nodo] + (km[nodo, b] - km[a, b] if b is not None else 0.0)
+        if costo < migliore and (turno is None or turno.aumento(a, b, nodo) <= margine + EPS):
+            migliore, posizione = costo, k
+    return migliore, posizione
+
+
+def clarke_wright(km, nodi, domanda, capacita, max_clienti, partenza=0, turno=None):
+    """
+    Algoritmo dei risparmi: parte da un giro per cliente e unisce i giri in ordine di
+    risparmio decrescente s(i, j) = d(0, i) + d(0, j) - d(i, j), rispettando capacità, massimo clienti
+    e (se indicato) durata del turno.
+    I risparmi considerano il rientro al deposito, così da non moltiplicare i veicoli.
+    Le unioni possono invertire un giro: con costi asimmetrici si usa la media dei due versi.
+    """
+    nodi = [int(n) for n in nodi]
+    giri = {n: [n] for n in nodi}
+    giro_di = {n: n for n in nodi}
+    carico = {n: domanda.get(n, 0.0) for n in nodi}
+
+    if len(nodi) > 1:
+        arr = np.asarray(nodi)
+        punti = np.concatenate([[partenza], arr])
+        sotto = km[np.ix_(punti, punti)]
+        sotto = (sotto + sotto.T) / 2
+        dal_deposito = sotto[0, 1:]
+        risparmi = dal_deposito[:, None] + dal_deposito[None, :] - sotto[1:, 1:]
+        ii, jj = np.triu_indices(len(arr), k=1)
+        valori = risparmi[ii, jj]
+        for idx in np.argsort(-valori, kind='stable'):
+            if valori[idx] <= 0:
+                break
+            i, j = int(arr[ii[idx]]), int(arr[jj[idx]])
+            gi, gj = giro_di[i], giro_di[j]
+            if gi == gj:
+                continue
+            a, b = giri[gi], giri[gj]
+            # i e j devono essere estremi dei rispettivi giri
+            if i not in (a[0], a[-1]) or j not in (b[0], b[-1]):
+                continue
+            if len(a) + len(b) > max_clienti or carico[gi] + carico[gj] > capacita:
+                continue
+            a = a if a[-1] == i else a[::-1]      # a termina con i
+            b = b if b[0] == j else b[::-1]       # b inizia con j
+            if turno is not None and not turno.ammissibile(a + b):
+                continue
+            giri[gi] = a + b
+            carico[gi] += carico.pop(gj)
+            for n in giri.pop(gj):
+                giro_di[n] = gi
+
+    return list(giri.values())
+
+
+def _inseribili(km, giro, nodi, partenza, turno):
+    # Verifica che i nodi possano essere inseriti uno dopo l'altro nel giro entro la durata del turno
+    giro = list(giro)
+    for n in nodi:
+        _, k = _inserimento_migliore(km, giro, n, partenza, turno)
+        if k is None:
+            return False
+        giro.insert(k, n)
+    return True
+
+
+def _accorpa_piccoli(km, giri, domanda, capacita, min_clienti, max_clienti, partenza=0, turno=None):
+    # I giri con meno di min_clienti vengono distribuiti negli altri giri, se i vincoli lo consentono
+    giri = sorted(giri, key=len)
+    risultato = []
+    while giri:
+        giro = giri.pop(0)
+        altri = giri + risultato
+        if len(giro) >= min_clienti or not altri:
+            risultato.append(giro)
+            continue
+        carico_giro = sum(domanda.get(n, 0.0) for n in giro)
+        candidati = [g for g in altri
+                     if len(g) + len(giro) <= max_clienti
+                     and sum(domanda.get(n, 0.0) for n in g) + carico_giro <= capacita
+                     and (turno is None or _inseribili(km, g, giro, partenza, turno))]
+        if not candidati:
+            risultato.append(giro)
+            continue
+        destinazione = min(candidati, key=lambda g: sum(_inserimento_migliore(km, g, n, partenza)[0] for n in giro))
+        for n in giro:
+            _, k = _inserimento_migliore(km, destinazione, n, partenza, turno)
+            destinazione.insert(k, n)
+    return risultato
+
+
+def _sposta_clienti(km, giri, domanda, capacita, min_clienti, max_clienti, scadenza, partenza=0, turno=None):
+    # Ricerca locale tra giri: sposta un cliente nel giro e nella posizione che riducono i km totali
+    migliorato = True
+    while migliorato and time.process_time() <= scadenza:
+        migliorato = False
+        carichi = [sum(domanda.get(n, 0.0) for n in g) for g in giri]
+        for a, origine in enumerate(giri):
+            for n in list(origine):
+                # L'origine può svuotarsi (un veicolo in meno) ma non scendere sotto il minimo
+                if 1 < len(origine) <= min_clienti:
+                    continue
+                senza = [x for x in origine if x != n]
+                guadagno = _costo_aperto(km, origine, partenza) - _costo_aperto(km, senza, partenza)
+                for b, destinazione in enumerate(giri):
+                    if a == b or len(destinazione) >= max_clienti or carichi[b] + domanda.get(n, 0.0) > capacita:
+                        continue
+                    costo, k = _inserimento_migliore(km, destinazione, n, partenza, turno)
+                    if k is not None and costo - guadagno < -EPS:
+                        origine.remove(n)
+                        destinazione.insert(k, n)
+                        migliorato = True
+                        break
+                if migliorato:
+                    break
+            if migliorato:
+                break
+        giri = [g for g in giri if g]
+    return giri
+
+
+def _migliora_entro_turno(km, giro, partenza, tempo_max, turno, nearest_neighbor=False, migliora=True):
+    # Riordino (NN) e ricerca locale sui km (solo con migliora); se il nuovo ordine supera il turno
+    # si mantiene quello di partenza
+    sequenza = tsp_nearest_neighbor(km, giro, partenza)[1] if nearest_neighbor else list(giro)
+    if migliora:
+        distanza, percorso = migliora_percorso(km, sequenza, partenza, tempo_max)
+    else:
+        distanza, percorso = round(_costo_aperto(km, sequenza, partenza), 2), sequenza
+    if turno is None or turno.ammissibile(percorso):
+        return distanza, percorso
+    return round(_costo_aperto(km, list(giro), partenza), 2), list(giro)
+
+
+def oltre_capacita(nodi, domanda, capacita):
+    # Clienti che da soli superano la capacità del veicolo: nessun giro li può servire
+    return [n for n in nodi if domanda.get(n, 0.0) > capacita + EPS]
+
+
+def vrp_savings(km, nodi, domanda, capacita=8000, min_clienti=3, max_clienti=8, partenza=0, tempo_max=0.05,
+                turno=None, migliora=True):
+    """
+    Suddivide i clienti (nodi della matrice km) in giri veicolo.
+    domanda: dizionario nodo -> litri da consegnare; turno: vincolo opzionale di durata (Turno).
+    Con migliora=False i giri restano quelli dei risparmi, in ordine Nearest Neighbor, senza
+    spostamenti tra giri né 2-opt / Or-opt.
+    Restituisce una lista di (distanza, percorso) con percorsi aperti che partono dal deposito.
+    Solleva ValueError se un cliente da solo supera la capacità (vedi oltre_capacita).
+    """
+    if len(nodi) == 0:
+        return []
+    oltre = oltre_capacita(nodi, domanda, capacita)
+    if oltre:
+        raise ValueError(f"Clienti con domanda oltre la capacità del veicolo ({capacita} l): {oltre}")
+    scadenza = time.process_time() + tempo_max
+
+    giri = clarke_wright(km, nodi, domanda, capacita, max_clienti, partenza, turno)
+    giri = _accorpa_piccoli(km, giri, domanda, capacita, min_clienti, max_clienti, partenza, turno)
+    # Sequenza iniziale di ogni giro (NN + ricerca locale), poi spostamenti tra giri
+    risultati = [_migliora_entro_turno(km, g, partenza, tempo_max / 4, turno, nearest_neighbor=True, migliora=migliora)
+                 for g in giri]
+    if migliora:
+        giri = _sposta_clienti(km, [percorso for _, percorso in risultati], domanda, capacita, min_clienti,
+                               max_clienti, scadenza, partenza, turno)
+        risultati = [_migliora_entro_turno(km, g, partenza, tempo_max / 4, turno) for g in giri]
+    # Ordine deterministico: prima i giri che partono più vicino al deposito
+    return sorted(risultati, key=lambda r: km[partenza, r[1][0]])
+
+
+# Suddivide la lista di clienti in gruppi di dimensione compresa tra min_size e max_size.
+def suddividi_in_gruppi(clienti, min_size=3, max_size=8):
+    gruppi = []
+    i = 0
+    while i < len(clienti):
+        end = i + max_size
+        # Se l'ultimo gruppo ha meno di min_size clienti, li accorpa al gruppo precedente (se esiste),
+        if end >= len(clienti):
+            if len(clienti) - i < min_size and gruppi:
+                gruppi[-1].extend(clienti[i:])
+            else:
+                gruppi.append(clienti[i:])
+            break
+        else:
+            gruppi.append(clienti[i:end])
+            i = end
+    return gruppi
+
+
+def pianifica_veicoli(km, nodi, domanda, metodo='vrp', capacita=8000, min_clienti=3, max_clienti=8,
+                      migliora=True, tempo_max=0.05, turno=None):
+    """
+    Suddivide i clienti di un giro (nodi della matrice km) tra i veicoli.
+    Restituisce, per ogni veicolo, (distanza, distanza del solo Nearest Neighbor, percorso).
+    metodo='vrp': risparmi di Clarke-Wright; metodo='blocchi': gruppi consecutivi nell'ordine dei nodi
+    (i vincoli di capacità e di turno valgono solo per 'vrp': i clienti che da soli superano la
+    capacità sollevano ValueError, da escludere prima con oltre_capacita).
+    """
+    if metodo == 'vrp':
+        giri = vrp_savings(km, nodi, domanda, capacita=capacita, min_clienti=min_clienti,
+                           max_clienti=max_clienti, tempo_max=tempo_max, turno=turno, migliora=migliora)
+        return [(dist, tsp_nearest_neighbor(km, percorso)[0], percorso) for dist, percorso in giri]
+    if metodo == 'blocchi':
+        return [percorso_giro(km, sorted(gruppo), migliora=migliora, tempo_max=tempo_max)
+                for gruppo in suddividi_in_gruppi(list(nodi), min_clienti, max_clienti)]
+    raise ValueError(f"Metodo di suddivisione non supportato: {metodo}")
@@ -0,0 +1,19 @@
+# Etichette leggibili delle zone di consegna a partire dai codici cluster del clustering:
+# la lettera identifica il cluster DBSCAN, il numero il sottocluster KMeans
+# (es. "0_0" → "Zona A1", "2" → "Zona C", "outlier" → "Zona X").
+
+# Lettere dei cluster; la X è riservata agli outlier
+LETTERE_ZONE = "ABCDEFGHIJKLMNOPQRSTUVWYZ"
+
+
+def mappa_zona(cluster_label):
+    cluster_label = str(cluster_label)
+    if cluster_label == "outlier":
+        return "Zona X"
+    cluster, _, sub = cluster_label.partition("_")
+    if not cluster.isdigit() or (sub and not sub.isdigit()):
+        return f"Zona ? ({cluster_label})"
+    if int(cluster) >= len(LETTERE_ZONE):
+        return f"Zona {cluster_label}"
+    lettera = LETTERE_ZONE[int(cluster)]
+    return f"Zona {lettera}{int(sub) + 1}" if sub else f"Zona {lettera}"